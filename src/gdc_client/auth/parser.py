@@ -33,7 +33,8 @@ def read_token_file(path):
     # but also needing the logs to be set up before you can process args
     log = logging.getLogger("auth")
     log.setLevel(logging.WARNING)
-    s_handler = logging.StreamHandler(sys.stdout)
+    # stdout may carry a downloaded file, see download --stdout
+    s_handler = logging.StreamHandler(sys.stderr)
     s_handler.setFormatter(LogFormatter())
     log.addHandler(s_handler)
 
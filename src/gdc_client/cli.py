@@ -4,7 +4,7 @@ import argparse
 import logging
 import sys
 
-from gdc_client import download, upload, settings
+from gdc_client import download, upload, serve, settings
 from gdc_client.exceptions import ClientError
 from gdc_client import log as logger
 from gdc_client import auth
@@ -83,6 +83,13 @@ def main() -> None:
     )
     upload.parser.config(upload_subparser, config_loader.to_dict("upload"))
 
+    serve_subparser = subparsers.add_parser(
+        "serve",
+        parents=[template],
+        help="serve GDC files to local readers over HTTP",
+    )
+    serve.parser.config(serve_subparser, config_loader.to_dict("serve"))
+
     settings_subparser = subparsers.add_parser(
         "settings",
         help="display default settings",
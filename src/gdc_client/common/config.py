@@ -6,8 +6,17 @@ from configparser import ConfigParser, NoOptionError, NoSectionError
 from gdc_client.defaults import (
     processes,
     USER_DEFAULT_CONFIG_LOCATION,
+    FILE_CACHE_SIZE,
+    HEDGE_BUDGET,
+    LOW_SPEED_LIMIT,
+    LOW_SPEED_TIME,
     HTTP_CHUNK_SIZE,
     SAVE_INTERVAL,
+    SERVE_BLOCK_SIZE,
+    SERVE_CACHE_DIR,
+    SERVE_CACHE_SIZE,
+    SERVE_HOST,
+    SERVE_PORT,
     UPLOAD_PART_SIZE,
 )
 
@@ -38,10 +47,19 @@ class GDCClientConfigShared:
         "save_interval": ConfigParser.getint,
         "dir": ConfigParser.get,
         "n_processes": ConfigParser.getint,
+        "concurrent_files": ConfigParser.getint,
+        "engine": ConfigParser.get,
+        "hedge_budget": ConfigParser.getint,
+        "low_speed_limit": ConfigParser.getint,
+        "low_speed_time": ConfigParser.getint,
+        "file_cache": ConfigParser.get,
+        "file_cache_size": ConfigParser.getint,
+        "trust_catalog": ConfigParser.getboolean,
         "retry_amount": ConfigParser.getint,
         "wait_time": ConfigParser.getfloat,
         "no_segment_md5sums": ConfigParser.getboolean,
         "no_file_md5sum": ConfigParser.getboolean,
+        "preallocate": ConfigParser.getboolean,
         "no_verify": ConfigParser.getboolean,
         "no_related_files": ConfigParser.getboolean,
         "no_annotations": ConfigParser.getboolean,
@@ -50,6 +68,11 @@ class GDCClientConfigShared:
         "disable_multipart": ConfigParser.getboolean,
         "path": ConfigParser.get,
         "latest": ConfigParser.getboolean,
+        "host": ConfigParser.get,
+        "port": ConfigParser.getint,
+        "cache_dir": ConfigParser.get,
+        "cache_size": ConfigParser.getint,
+        "block_size": ConfigParser.getint,
     }
 
     def __init__(self, config_path=None):
@@ -72,8 +95,17 @@ class GDCClientConfigShared:
                 "dir": ".",
                 "save_interval": SAVE_INTERVAL,
                 "http_chunk_size": HTTP_CHUNK_SIZE,
+                "concurrent_files": 1,
+                "engine": "process",
+                "hedge_budget": HEDGE_BUDGET,
+                "low_speed_limit": LOW_SPEED_LIMIT,
+                "low_speed_time": LOW_SPEED_TIME,
+                "file_cache": None,
+                "file_cache_size": FILE_CACHE_SIZE,
+                "trust_catalog": False,
                 "no_segment_md5sums": False,
                 "no_file_md5sum": False,
+                "preallocate": False,
                 "no_verify": False,
                 "no_related_files": False,
                 "no_annotations": False,
@@ -88,6 +120,14 @@ class GDCClientConfigShared:
                 "insecure": False,
                 "disable_multipart": False,
             },
+            "serve": {
+                "host": SERVE_HOST,
+                "port": SERVE_PORT,
+                "cache_dir": SERVE_CACHE_DIR,
+                "cache_size": SERVE_CACHE_SIZE,
+                "block_size": SERVE_BLOCK_SIZE,
+                "no_verify": False,
+            },
         }
 
     def to_dict(self, section):
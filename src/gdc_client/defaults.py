@@ -24,8 +24,27 @@ processes = min(cpu_count(), 8)
 
 HTTP_CHUNK_SIZE = 1024 * 1024  # 1 MB
 SAVE_INTERVAL = 1024 * 1024 * 1024  # 1 GiB
+# Straggling segments of a file that may be requested again
+HEDGE_BUDGET = 4
+# Requests slower than LOW_SPEED_LIMIT bytes/sec for LOW_SPEED_TIME seconds
+# are restarted, 0 never does
+LOW_SPEED_LIMIT = 0
+LOW_SPEED_TIME = 30
+# Bytes of downloaded files kept in the node-wide file cache
+FILE_CACHE_SIZE = 100 * 1024 * 1024 * 1024  # 100 GiB
 # Part size for multipart uploads
 UPLOAD_PART_SIZE = 1024 * 1024 * 1024  # 1 GiB
 
+####################
+# Local file server
+####################
+
+SERVE_HOST = "127.0.0.1"
+SERVE_PORT = 8087
+# Block cache shared by every server on the node
+SERVE_CACHE_DIR = os.path.expanduser(os.path.join("~", ".cache", "gdc-client"))
+SERVE_CACHE_SIZE = 16 * 1024 * 1024 * 1024  # 16 GiB
+SERVE_BLOCK_SIZE = 1024 * 1024  # 1 MiB
+
 # The following file will contain superseded files information
 SUPERSEDED_INFO_FILENAME_TEMPLATE = re.compile(r"superseded_files[\d._]+.txt")
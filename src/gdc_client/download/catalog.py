@@ -0,0 +1,82 @@
+import logging
+import os
+import sqlite3
+import threading
+
+log = logging.getLogger("gdc-download")
+
+CATALOG_NAME = ".gdc_catalog.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    uuid TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    md5sum TEXT NOT NULL,
+    path TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL
+)
+"""
+
+
+class Catalog:
+    """Files downloaded to a directory and verified against their md5sum.
+
+    The catalog is an SQLite database in the download directory. A file
+    recorded in it is known to be complete as long as it still has the
+    size and modification time it had when it was verified, which takes a
+    single ``stat`` to check instead of asking the API.
+    """
+
+    def __init__(self, directory):
+        directory = os.path.abspath(os.path.expanduser(directory or "."))
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, CATALOG_NAME)
+        # files downloaded concurrently are recorded from several threads
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute(SCHEMA)
+
+    def record(self, uuid, path, md5sum):
+        """Record that the file at ``path`` is ``uuid`` and was verified"""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                (uuid, st.st_size, md5sum, path, st.st_mtime_ns),
+            )
+
+    def is_complete(self, uuid, md5sum=None):
+        """Whether ``uuid`` was downloaded and has not changed since
+
+        :param str md5sum: optional. The expected md5sum of the file
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT size, md5sum, path, mtime_ns FROM files WHERE uuid = ?",
+                (uuid,),
+            ).fetchone()
+        if row is None:
+            return False
+
+        size, recorded_md5sum, path, mtime_ns = row
+        if md5sum is not None and md5sum != recorded_md5sum:
+            return False
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        return st.st_size == size and st.st_mtime_ns == mtime_ns
+
+    def completed(self, uuids, md5sums=None):
+        """The ``uuids`` that are complete in the download directory
+
+        :param dict md5sums: optional. The expected md5sum of each file
+        """
+        md5sums = md5sums or {}
+        return [uuid for uuid in uuids if self.is_complete(uuid, md5sums.get(uuid))]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -43,6 +43,7 @@ class GDCHTTPDownloadClient(HTTPClient):
         download_related_files=True,
         download_annotations=True,
         index_client=None,
+        catalog=None,
         *args,
         **kwargs,
     ):
@@ -52,6 +53,8 @@ class GDCHTTPDownloadClient(HTTPClient):
             download_related_files (bool):
             download_annotations (bool):
             index_client (gdc_client.query.index.GDCIndexClient): gdc api files index client
+            catalog (gdc_client.download.catalog.Catalog): optional. records
+                the verified files of the download directory
         """
 
         self.base_uri = uri
@@ -63,11 +66,34 @@ class GDCHTTPDownloadClient(HTTPClient):
         self.md5_check = kwargs.get("file_md5sum")
 
         self.gdc_index_client = index_client
+        self.catalog = catalog
         self.base_directory = kwargs.get("directory")
         self.verify = kwargs.get("verify")
 
         super().__init__(self.data_uri, *args, **kwargs)
 
+    def known_file_information(self, url):
+        """File information from the index metadata, which saves requesting
+        it from the data server before downloading the file
+        """
+        file_id = self.file_id(url)
+        if (
+            self.gdc_index_client is None
+            or file_id not in self.gdc_index_client.metadata
+        ):
+            return {}
+        return {
+            "name": self.gdc_index_client.get_filename(file_id),
+            "size": self.gdc_index_client.get_filesize(file_id),
+            "md5sum": self.gdc_index_client.get_md5sum(file_id),
+        }
+
+    def file_downloaded(self, stream):
+        # only files checked against their md5sum go in the catalog
+        if self.catalog is None or not (stream.check_file_md5sum and stream.md5sum):
+            return
+        self.catalog.record(self.file_id(stream.url), stream.path, stream.md5sum)
+
     def download_related_files(self, file_id):
         # type: (str) -> None
         """Finds and downloads files related to the primary entity.
@@ -85,7 +111,13 @@ class GDCHTTPDownloadClient(HTTPClient):
 
                 log.debug(f"related file {related_file}")
                 related_file_url = urlparse.urljoin(self.data_uri, related_file)
-                stream = DownloadStream(related_file_url, directory, self.token)
+                stream = DownloadStream(
+                    related_file_url,
+                    directory,
+                    self.token,
+                    session_pool=self.session_pool,
+                    **self.known_file_information(related_file_url),
+                )
 
                 # TODO: un-set this when parcel is moved to dtt
                 # hacky way to get it working like the old dtt
@@ -165,6 +197,8 @@ class GDCHTTPDownloadClient(HTTPClient):
             if self.gdc_index_client.get_md5sum(member_uuid) != md5sum.hexdigest():
                 log.error(f"UUID {member_uuid} has invalid md5sum")
                 errors.append(member_uuid)
+            elif self.catalog is not None:
+                self.catalog.record(member_uuid, filename, md5sum.hexdigest())
 
         return errors
 
@@ -1,11 +1,17 @@
+import argparse
 import logging
+import re
+import sqlite3
+import sys
 import time
 from urllib import parse as urlparse
 from functools import partial
 
 from gdc_client.parcel import colored, manifest
 
+from gdc_client.download.catalog import Catalog
 from gdc_client.download.client import GDCHTTPDownloadClient
+from gdc_client.download.preflight import plan_downloads
 from gdc_client.query.index import GDCIndexClient
 from gdc_client.query.versions import get_latest_versions
 from gdc_client.utils import build_url
@@ -18,20 +24,58 @@ def validate_args(parser, args):
     if not args.file_ids and not args.manifest:
         msg = "must specify either --manifest or file_id"
         parser.error(msg)
+    if args.stdout and len(args.file_ids) + len(args.manifest) != 1:
+        parser.error("--stdout streams exactly one file")
 
 
-def get_client(args, index_client):
+def byte_range(value):
+    """Parse a ``start-end`` byte range with inclusive offsets, as in an
+    HTTP Range header. ``start-`` reaches the end of the file and
+    ``-length`` is the last ``length`` bytes of it.
+
+    :returns: the ``(start, stop)`` slice bounds of the range
+    """
+    match = re.fullmatch(r"(\d*)-(\d*)", value)
+    if not match or not any(match.groups()):
+        raise argparse.ArgumentTypeError(
+            f"invalid byte range '{value}', expected start-end"
+        )
+
+    start, end = match.groups()
+    if not start:
+        if not int(end):
+            raise argparse.ArgumentTypeError(f"empty byte range '{value}'")
+        return -int(end), None
+    if not end:
+        return int(start), None
+    if int(end) < int(start):
+        raise argparse.ArgumentTypeError(f"empty byte range '{value}'")
+    return int(start), int(end) + 1
+
+
+def get_client(args, index_client, catalog=None):
     # args get converted into kwargs
     kwargs = {
+        "catalog": catalog,
         "token": args.token_file,
         "n_procs": args.n_processes,
+        "concurrent_files": args.concurrent_files,
+        "engine": args.engine,
+        "hedge_budget": args.hedge_budget,
+        "low_speed_limit": args.low_speed_limit,
+        "low_speed_time": args.low_speed_time,
+        "file_cache": args.file_cache,
+        "file_cache_size": args.file_cache_size,
         "directory": args.dir,
         "segment_md5sums": not args.no_segment_md5sums,
         "file_md5sum": not args.no_file_md5sum,
+        "preallocate": args.preallocate,
         "http_chunk_size": args.http_chunk_size,
         "save_interval": args.save_interval,
-        "download_related_files": not args.no_related_files,
-        "download_annotations": not args.no_annotations,
+        "byte_ranges": args.byte_ranges,
+        # parts of a file come without its related files and annotations
+        "download_related_files": not (args.no_related_files or args.byte_ranges),
+        "download_annotations": not (args.no_annotations or args.byte_ranges),
         "no_auto_retry": args.no_auto_retry,
         "retry_amount": args.retry_amount,
         "verify": not args.no_verify,
@@ -48,11 +92,29 @@ def download(parser, args):
     using the ?tarfile url parameter. Combining many smaller files into one
     download decreases the number of open connections we have to make
     """
+    validate_args(parser, args)
+
+    # files already downloaded to the directory are skipped, except when
+    # streaming or downloading parts of them
+    catalog = None
+    if not (args.stdout or args.byte_ranges):
+        try:
+            catalog = Catalog(args.dir)
+        except (OSError, sqlite3.Error) as e:
+            log.warning(f"Unable to open the download catalog: {e}")
+    try:
+        return download_ids(args, catalog)
+    finally:
+        if catalog:
+            catalog.close()
+
+
+def download_ids(args, catalog):
+    """Downloads the files of ``args``, skipping those complete in ``catalog``"""
     successful_count = 0
     unsuccessful_count = 0
     big_errors = []
     small_errors = []
-    validate_args(parser, args)
 
     # sets do not allow duplicates in a list
     ids = set(args.file_ids)
@@ -62,6 +124,13 @@ def download(parser, args):
             break
         ids.add(i["id"])
 
+    trusted, skipped = [], []
+    if catalog and args.trust_catalog and not args.latest:
+        # without even asking the API about them
+        trusted, ids = split_trusted(catalog, ids)
+        if not ids:
+            return report_skipped(trusted, args)
+
     # Query the api to get the latest version of a file(s) according to the gdc.
     # Return OLD_ID => NEW_ID mapping
     ids_map = get_latest_versions(args.server, ids, verify=not args.no_verify)
@@ -76,14 +145,52 @@ def download(parser, args):
         if latest_id is not None and file_id != latest_id:
             log.warning(f'The file "{file_id}" was superseded by "{latest_id}"')
 
-    ids = ids_map.values() if args.latest else ids_map.keys()
+    ids = list(ids_map.values() if args.latest else ids_map.keys())
+    if catalog and args.trust_catalog and args.latest:
+        # the latest versions are the ids the files were recorded under
+        trusted, ids = split_trusted(catalog, ids)
+        if not ids:
+            return report_skipped(trusted, args)
 
     index_client = GDCIndexClient(args.server, not args.no_verify)
-    client = get_client(args, index_client)
+    client = get_client(args, index_client, catalog)
 
     # separate the smaller files from the larger files
     bigs, smalls = index_client.separate_small_files(ids, args.http_chunk_size)
 
+    if catalog and not args.trust_catalog:
+        done = set(
+            catalog.completed(
+                ids, {i: index_client.get_md5sum(i) for i in index_client.metadata}
+            )
+        )
+        skipped = [i for i in ids if i in done]
+        bigs = [b for b in bigs if b not in done]
+        smalls = [[s for s in group if s not in done] for group in smalls]
+        smalls = [group for group in smalls if group]
+    report_skipped(trusted + skipped, args)
+
+    if args.stdout:
+        # whatever its size, the file is streamed without landing on disk
+        return stream_download(client, list(ids)[0], args)
+
+    refused = []
+    if args.byte_ranges:
+        # only parts of the files are downloaded, which a tarfile can't do
+        bigs, smalls = list(ids), []
+    else:
+        # make sure the files fit on disk before downloading any of them
+        planned, refused = plan_downloads(
+            args.dir,
+            bigs + [s for group in smalls for s in group],
+            index_client,
+            file_cache=client.file_cache,
+        )
+    if refused:
+        bigs = [b for b in planned if b in bigs]
+        smalls = [[s for s in group if s not in refused] for group in smalls]
+        smalls = [group for group in smalls if group]
+
     # the big files will be normal downloads
     # the small files will be joined together and tarfiled
     if smalls:
@@ -140,7 +247,8 @@ def download(parser, args):
 
         successful_count += len(bigs) - len(big_errors)
 
-    unsuccessful_count = len(ids) - successful_count
+    successful_count += len(trusted) + len(skipped)
+    unsuccessful_count = len(ids) + len(trusted) - successful_count
 
     msg = "Successfully downloaded"
     log.info(
@@ -157,7 +265,43 @@ def download(parser, args):
             )
         )
 
-    return small_errors or big_errors
+    return small_errors or big_errors or refused
+
+
+def split_trusted(catalog, ids):
+    """Split ``ids`` into those the catalog records as complete and the rest"""
+    trusted = catalog.completed(ids)
+    done = set(trusted)
+    return trusted, [i for i in ids if i not in done]
+
+
+def report_skipped(skipped, args):
+    """Log the files skipped because they are already downloaded"""
+    if skipped:
+        log.info(f"Skipping {len(skipped)} files already downloaded to {args.dir}")
+    return []
+
+
+def stream_download(client, file_id, args):
+    """Stream a file to stdout in order, with parallel range requests.
+
+    Logs and progress go to stderr. Related files and annotations are not
+    downloaded.
+    """
+    url = urlparse.urljoin(client.data_uri, file_id)
+    try:
+        client.stream_file(url, sys.stdout.buffer)
+    except Exception as e:
+        if client.debug:
+            raise
+        log.error(f"{file_id}: {e}")
+        return [file_id]
+
+    msg = "Successfully streamed"
+    log.info(
+        "{}: {}".format(colored(msg, "green") if not args.color_off else msg, file_id)
+    )
+    return []
 
 
 def retry_download(client, url, retry_amount, no_auto_retry, wait_time):
@@ -214,6 +358,32 @@ def config(parser, download_defaults):
         type=str,
         help="The TCP server address server[:port]",
     )
+    parser.add_argument(
+        "--stdout",
+        action="store_true",
+        help="Stream a single file to stdout, in order and without writing it "
+        "to disk. Logs and progress are written to stderr. Redirect stdout to "
+        "a named pipe to stream into another program.",
+    )
+    parser.add_argument(
+        "--byte-range",
+        type=byte_range,
+        action="append",
+        dest="byte_ranges",
+        metavar="START-END",
+        help="Download only bytes START to END (inclusive) of each file, to "
+        "<file name>.START-END. START- reaches the end of the file and -LENGTH "
+        "is its last LENGTH bytes. May be given several times.",
+    )
+    parser.add_argument(
+        "--trust-catalog",
+        dest="trust_catalog",
+        action="store_true",
+        help="Skip the files recorded as downloaded in the catalog of the "
+        "download directory without asking the API about them. By default "
+        "they are skipped once their size and md5sum are checked against "
+        "the API.",
+    )
     parser.add_argument(
         "--no-segment-md5sums",
         dest="no_segment_md5sums",
@@ -227,9 +397,64 @@ def config(parser, download_defaults):
         action="store_true",
         help="Do not verify file md5sum after download",
     )
+    parser.add_argument(
+        "--preallocate",
+        action="store_true",
+        help="Reserve disk space for each file before downloading it and "
+        "keep downloaded data out of the page cache",
+    )
     parser.add_argument(
         "-n", "--n-processes", type=int, help="Number of client connections."
     )
+    parser.add_argument(
+        "--concurrent-files",
+        type=int,
+        dest="concurrent_files",
+        help="Number of files to download at the same time. The client "
+        "connections (--n-processes) are shared between them.",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["process", "async"],
+        help="Download engine. 'async' runs every connection as a coroutine "
+        "in a single process and requires aiohttp.",
+    )
+    parser.add_argument(
+        "--hedge-budget",
+        type=int,
+        dest="hedge_budget",
+        help="Number of times per file a straggling segment may be requested "
+        "again on an idle connection. 0 disables hedged requests.",
+    )
+    parser.add_argument(
+        "--low-speed-limit",
+        type=int,
+        dest="low_speed_limit",
+        help="Restart a request that receives less than this many bytes per "
+        "second for --low-speed-time seconds. Off (0) by default.",
+    )
+    parser.add_argument(
+        "--low-speed-time",
+        type=int,
+        dest="low_speed_time",
+        help="Number of seconds a request may stay below --low-speed-limit "
+        "before it is restarted.",
+    )
+    parser.add_argument(
+        "--file-cache",
+        dest="file_cache",
+        metavar="DIR",
+        help="Directory of a cache of downloaded files shared by every "
+        "download on the node. Cached files are linked into the download "
+        "directory instead of being downloaded again.",
+    )
+    parser.add_argument(
+        "--file-cache-size",
+        dest="file_cache_size",
+        type=int,
+        help="Size in bytes of the file cache. The least recently used files "
+        "are removed once it is full.",
+    )
     parser.add_argument(
         "--http-chunk-size",
         "-c",
@@ -0,0 +1,129 @@
+import logging
+import os
+import shutil
+
+from gdc_client.parcel import state
+
+log = logging.getLogger("gdc-download")
+
+PARTIAL_EXTENSION = ".partial"
+STATE_EXTENSION = ".parcel"
+
+
+def free_space(directory):
+    """Free bytes on the filesystem ``directory`` is or will be created on"""
+    path = os.path.abspath(directory)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return shutil.disk_usage(path).free
+
+
+def _completed_bytes(state_path):
+    """Bytes recorded as downloaded by the resume state at ``state_path``"""
+    try:
+        with open(state_path, "rb") as f:
+            completed = state.load(f)
+        state.replay(f"{state_path}.journal", completed)
+    except Exception as e:
+        log.debug(f"Unable to read {state_path}, assuming nothing is resumable: {e}")
+        return 0
+    return completed.size
+
+
+def _allocated_bytes(path):
+    """Bytes of disk actually taken by ``path``, which may be sparse"""
+    st = os.stat(path)
+    if hasattr(st, "st_blocks"):
+        return st.st_blocks * 512
+    return 0
+
+
+def remaining_bytes(directory, file_id, file_size):
+    """Disk space still needed to download ``file_id`` into ``directory``
+
+    A file that is already complete needs nothing. A resumable partial file
+    needs whatever is neither recorded as downloaded by its resume state nor
+    already allocated, e.g. by ``--preallocate``.
+
+    :param str directory: the download directory
+    :param str file_id: the file UUID, files are saved under ``directory/file_id``
+    :param int file_size: the size of the file from the index metadata
+    :returns: the number of bytes still to be written
+    """
+    state_directory = os.path.join(directory, file_id, "logs")
+    if not os.path.isdir(state_directory):
+        return file_size
+
+    for name in os.listdir(state_directory):
+        if not name.endswith(STATE_EXTENSION):
+            continue
+        file_name = name[: -len(STATE_EXTENSION)]
+        path = os.path.join(directory, file_id, file_name)
+        temp_path = path + PARTIAL_EXTENSION
+
+        if os.path.isfile(path) and os.path.getsize(path) == file_size:
+            return 0
+        if os.path.isfile(temp_path):
+            done = max(
+                _completed_bytes(os.path.join(state_directory, name)),
+                _allocated_bytes(temp_path),
+            )
+            return max(file_size - done, 0)
+
+    return file_size
+
+
+def plan_downloads(directory, file_ids, index_client, file_cache=None):
+    """Check that the files to download fit in the free space of ``directory``
+
+    The sizes come from the index metadata, so nothing is downloaded to find
+    out. Files without a known size are always planned. If everything does
+    not fit, the files needing the least space are planned first, which lets
+    resumable downloads finish, and the rest are refused. Files in the
+    ``file_cache`` are expected to be linked, not copied, and need nothing.
+
+    :param str directory: the download directory
+    :param list file_ids: the file UUIDs, in download order
+    :param index_client: a :class:`GDCIndexClient` holding the file metadata
+    :param file_cache: optional. The :class:`FileCache` files are copied from
+    :returns: tuple of the file UUIDs to download, in download order, and
+        the refused file UUIDs
+    """
+    directory = directory or "."
+    needed = {}
+    for file_id in file_ids:
+        file_size = index_client.get_filesize(file_id)
+        if file_size is None:
+            log.debug(f"Size of {file_id} is unknown, not checking space for it")
+            needed[file_id] = 0
+        elif file_cache is not None and file_cache.contains(
+            file_id, index_client.get_md5sum(file_id)
+        ):
+            needed[file_id] = 0
+        else:
+            needed[file_id] = remaining_bytes(directory, file_id, file_size)
+
+    free = free_space(directory)
+    total = sum(needed.values())
+    log.debug(f"{total} bytes to download, {free} bytes free in {directory}")
+    if total <= free:
+        return list(file_ids), []
+
+    planned, refused = [], []
+    for file_id in sorted(file_ids, key=needed.get):
+        if needed[file_id] <= free:
+            planned.append(file_id)
+            free -= needed[file_id]
+        else:
+            refused.append(file_id)
+
+    log.error(
+        "Not enough disk space in {}: {} bytes needed, {} bytes free. "
+        "Not downloading {}".format(
+            directory, total, free_space(directory), ", ".join(refused)
+        )
+    )
+    return planned, refused
@@ -4,3 +4,35 @@ class ClientError(Exception):
 
 class MD5ValidationError(Exception):
     """Base MD5 validation error."""
+
+
+class StateError(Exception):
+    """Unreadable download resume state."""
+
+
+class StalledTransferError(Exception):
+    """Transfer rate fell below the low-speed limit."""
+
+
+class HTTPStatusError(RuntimeError):
+    """The data server answered a request with an error status."""
+
+    # client errors that may go away when the request is sent again
+    RETRYABLE_CLIENT_ERRORS = (408, 425, 429)
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+    @property
+    def retryable(self):
+        """False for a client error that sending the request again will not
+        fix, such as 401, 403 or 404"""
+        return (
+            not 400 <= self.status < 500 or self.status in self.RETRYABLE_CLIENT_ERRORS
+        )
+
+
+def retryable(e):
+    """False if ``e`` is an error that retrying the request will not fix"""
+    return not isinstance(e, HTTPStatusError) or e.retryable
@@ -12,13 +12,15 @@ def setup_logging(args):
     log_level = min(args.log_levels) if hasattr(args, "log_levels") else logging.INFO
     color_off = args.color_off if hasattr(args, "color_off") else False
     log_file = args.log_file if hasattr(args, "log_file") else None
+    # keep the logs out of a file streamed to stdout
+    log_stream = sys.stderr if getattr(args, "stdout", False) else sys.stdout
 
     root = logging.getLogger()
     root.setLevel(log_level)
 
     f_formatter = logging.Formatter("%(asctime)s: %(levelname)s: %(message)s")
 
-    s_handler = logging.StreamHandler(sys.stdout)
+    s_handler = logging.StreamHandler(log_stream)
     s_handler.setFormatter(LogFormatter(color_off=color_off))
     root.addHandler(s_handler)
 
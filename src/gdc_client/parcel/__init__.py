@@ -1,2 +1,3 @@
 from gdc_client.parcel.http_client import HTTPClient
 from gdc_client.parcel.portability import colored
+from gdc_client.parcel.remote_file import RemoteFile
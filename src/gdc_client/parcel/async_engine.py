@@ -0,0 +1,266 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import time
+
+from intervaltree import Interval
+
+from gdc_client.exceptions import HTTPStatusError, StalledTransferError, retryable
+from gdc_client.parcel import utils
+from gdc_client.parcel.const import HEDGE_INTERVAL, WRITE_BEHIND_CHUNKS, WRITER_THREADS
+from gdc_client.parcel.defaults import max_timeout
+from gdc_client.parcel.segment import SegmentProducer
+from gdc_client.parcel.throughput import LowSpeedMonitor, SegmentFailed, SegmentStats
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+log = logging.getLogger("async")
+
+
+class _WorkQueue:
+    """Gives an asyncio queue the ``put`` interface the producer hands work to"""
+
+    def __init__(self):
+        self.queue = asyncio.Queue()
+
+    def put(self, item):
+        self.queue.put_nowait(item)
+
+    def empty(self):
+        return self.queue.empty()
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class AsyncDownloadEngine:
+    """Download a file with many concurrent range requests from one process.
+
+    Instead of forking a process per connection, ``connections`` coroutines
+    share a single event loop and aiohttp session. Chunks are written and
+    hashed by a small thread pool behind a bounded write-behind window, so
+    disk I/O never stalls the loop and a slow disk pushes back on the
+    network.
+
+    Work is scheduled by the same :class:`SegmentProducer` as the process
+    engine, with the same state file, so a download started with one engine
+    can be resumed with the other.
+    """
+
+    def __init__(
+        self,
+        stream,
+        connections,
+        verify=True,
+        write_behind=WRITE_BEHIND_CHUNKS,
+        writer_threads=WRITER_THREADS,
+        retries=5,
+    ):
+        if aiohttp is None:
+            raise RuntimeError(
+                "The async download engine requires aiohttp. "
+                "Install it with 'pip install gdc-client[async]'."
+            )
+
+        self.stream = stream
+        self.connections = connections
+        self.verify = verify
+        self.write_behind = write_behind
+        self.writer_threads = writer_threads
+        self.retries = retries
+
+    def download(self):
+        """Download the file
+
+        :returns: the :class:`SegmentProducer` that tracked the download
+        """
+        return asyncio.run(self._download())
+
+    async def _download(self):
+        # The queue has to be created inside the running loop
+        self.q_work = _WorkQueue()
+        self.producer = SegmentProducer(
+            self.stream, self.connections, q_work=self.q_work
+        )
+        if self.producer.done:
+            return self.producer
+
+        self.all_done = asyncio.Event()
+        self.write_window = asyncio.Semaphore(self.write_behind)
+        self.executor = ThreadPoolExecutor(self.writer_threads)
+        self.fd = utils.open_for_positional_writes(self.stream.temp_path)
+
+        connector = aiohttp.TCPConnector(
+            limit=self.connections, ssl=None if self.verify else False
+        )
+        timeout = aiohttp.ClientTimeout(sock_connect=max_timeout, sock_read=max_timeout)
+        try:
+            async with aiohttp.ClientSession(
+                connector=connector, timeout=timeout, trust_env=True
+            ) as session:
+                workers = [
+                    asyncio.ensure_future(
+                        self._worker(session, self.producer.slots.slot(i))
+                    )
+                    for i in range(self.connections)
+                ]
+                loop = asyncio.get_running_loop()
+                self.producer.verify_resumed(
+                    lambda report: loop.call_soon_threadsafe(
+                        self._handle_report, report
+                    )
+                )
+                while not (self.producer.finished or self.producer.downloaded):
+                    try:
+                        await asyncio.wait_for(self.all_done.wait(), HEDGE_INTERVAL)
+                    except asyncio.TimeoutError:
+                        # look for stragglers while no reports come in
+                        self.producer.schedule()
+
+                for _ in workers:
+                    self.q_work.put(None)
+                # a connection that lost a hedged race may be stuck, it has
+                # nothing left to write
+                _, stuck = await asyncio.wait(workers, timeout=HEDGE_INTERVAL)
+                for worker in stuck:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+
+            self.producer.save_state()
+            self.producer.finish_md5sum()
+        finally:
+            self.executor.shutdown(wait=True)
+            os.close(self.fd)
+            self.producer.close()
+        self.producer.check_failure()
+
+        return self.producer
+
+    async def _worker(self, session, slot):
+        while True:
+            segment = await self.q_work.get()
+            if segment is None:
+                log.debug("Producer returned with no more work")
+                return
+
+            began = time.time()
+            try:
+                written, latency, stalls = await self._write_segment(
+                    session, segment, slot
+                )
+                stats = SegmentStats(
+                    slot.index, written, time.time() - began, latency, stalls
+                )
+            except Exception as e:
+                log.error(f"Download aborted: {str(e)}")
+                stats = SegmentFailed(slot.index, str(e), retryable(e))
+
+            self._handle_report(stats)
+
+    def _handle_report(self, report):
+        self.producer.handle_report(report)
+        if self.producer.finished or self.producer.downloaded:
+            self.all_done.set()
+
+    async def _write_segment(self, session, segment, slot):
+        """Download ``segment``, retrying from the last written offset
+
+        :returns: tuple of the bytes written, the last request latency and
+            the number of requests restarted because they stalled
+        """
+        segment = slot.start(segment)
+        written = latency = stalls = 0
+        retries = self.retries
+        try:
+            while True:
+                begin = segment.begin + written
+                # The producer may have handed the tail to another connection
+                end = min(segment.end, slot.limit)
+                if begin >= end:
+                    return written, latency, stalls
+
+                try:
+                    latency = await self._fetch(session, begin, end, slot)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    if not retryable(e):
+                        # the server refuses the file, not just this request
+                        raise
+                    if isinstance(e, StalledTransferError):
+                        stalls += 1
+                    log.debug(f"Unable to download part of file: {str(e)}")
+
+                # everything claimed has been written, resume after it
+                written = slot.position - segment.begin
+                if slot.position >= min(segment.end, slot.limit):
+                    return written, latency, stalls
+                log.debug(f"Segment stopped short at {slot.position}")
+
+                if not retries:
+                    raise RuntimeError("Max retries exceeded.")
+                retries -= 1
+                log.debug("Retrying download of this segment")
+        finally:
+            slot.release()
+            if self.stream.preallocate and not self.stream.hashes_while_downloading:
+                # nothing reads this back, keep it out of the page cache
+                utils.fadvise(self.fd, segment.begin, written, "POSIX_FADV_DONTNEED")
+
+    async def _fetch(self, session, begin, end, slot):
+        """Stream ``[begin, end)`` to disk through the write-behind window
+
+        :returns: the request latency
+        """
+        headers = self.stream.header(begin, end - 1)
+        written = 0
+        writes = []
+        requested = time.time()
+        try:
+            async with session.get(self.stream.url, headers=headers) as r:
+                latency = time.time() - requested
+                if r.status >= 400:
+                    raise HTTPStatusError(f"[{r.status}] {await r.text()}", r.status)
+
+                monitor = LowSpeedMonitor(
+                    self.stream.low_speed_limit, self.stream.low_speed_time
+                )
+                chunks = r.content.iter_chunked(self.stream.http_chunk_size)
+                async for chunk in chunks:
+                    monitor.update(len(chunk))
+                    offset = begin + written
+                    claimed = slot.claim(offset, len(chunk))
+                    if claimed.end > claimed.begin:
+                        piece = chunk[claimed.begin - offset : claimed.end - offset]
+                        writes.append(await self._write_behind(piece, claimed.begin))
+                    written += len(chunk)
+                    if claimed.end < offset + len(chunk):
+                        log.debug(f"Segment split at {claimed.end}")
+                        break
+        finally:
+            # Everything claimed so far has to land before the segment is over
+            await asyncio.gather(*writes)
+        return latency
+
+    async def _write_behind(self, chunk, offset):
+        await self.write_window.acquire()
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, self._write_chunk, chunk, offset)
+        future.add_done_callback(self._chunk_written)
+        return future
+
+    def _write_chunk(self, chunk, offset):
+        utils.pwrite(self.fd, chunk, offset)
+        data = None
+        if self.stream.check_segment_md5sums:
+            data = {"md5sum": utils.md5sum(chunk)}
+        return Interval(offset, offset + len(chunk), data)
+
+    def _chunk_written(self, future):
+        self.write_window.release()
+        if not future.cancelled() and future.exception() is None:
+            self._handle_report(future.result())
@@ -0,0 +1,236 @@
+import collections
+import os
+import queue
+import select
+import struct
+import time
+
+from intervaltree import Interval
+
+from gdc_client.parcel.throughput import SegmentFailed, SegmentStats
+from gdc_client.parcel.verify import CorruptChunk, VerifyDone
+
+# Every completion report is a fixed-size record:
+#   kind (1), stalls (1), slot (2), latency in us (4),
+#   offset (8), length (8), md5 digest (16)
+# Task done records carry the segment stats: written bytes in the offset
+# field, the elapsed time in us in the length field and the session pool
+# hits and misses in the digest field. The stalls byte is 0
+# for every other kind of record. Resume verification
+# reports corrupt chunks as offset/length and, once done, the number of
+# checked and corrupt chunks in the offset and length fields. A failed task
+# is reported with the retryable flag in the stalls byte and the length of
+# its error message in the length field and the session pool hits and misses
+# in the digest field, followed by records carrying the message 16 bytes at a
+# time in the digest field
+RECORD = struct.Struct("<BBHIQQ16s")
+SESSION_COUNTS = struct.Struct("<QQ")
+
+TASK_DONE = 0
+CHUNK = 1
+CHUNK_MD5 = 2
+CORRUPT = 3
+VERIFY_DONE = 4
+FAILED = 5
+ERROR_TEXT = 6
+
+NO_DIGEST = bytes(16)
+
+# Writes of at most PIPE_BUF bytes to a pipe are atomic, so batches from
+# several worker processes never interleave
+BATCH_RECORDS = max(1, getattr(select, "PIPE_BUF", 512) // RECORD.size)
+READ_SIZE = 1024 * RECORD.size
+# the records of a failure are written at once, the message is cut to fit
+MAX_ERROR_SIZE = 16 * (BATCH_RECORDS - 1)
+
+
+class CompletionChannel:
+    """Low-overhead completion reports from download workers to the producer.
+
+    Replaces a ``multiprocessing.Manager`` queue: workers write batches of
+    packed records straight into an OS pipe inherited over ``fork``, and the
+    producer decodes them on its side. Completed chunks are buffered by each
+    worker and sent once a batch is full, ``flush_interval`` seconds have
+    passed, or the worker reports the end of a task.
+
+    The interface mirrors the queue it replaces: workers ``put`` an
+    :class:`Interval`, or :class:`SegmentStats` (:class:`SegmentFailed` or
+    ``None`` on failure) once a task is finished, and the producer ``get``s
+    them back in order. ``None`` comes back as :class:`SegmentStats`. Resume
+    verification reports :class:`CorruptChunk` and :class:`VerifyDone`
+    through the same channel.
+    """
+
+    def __init__(self, flush_interval=0.5):
+        self.flush_interval = flush_interval
+        self._read_fd, self._write_fd = os.pipe()
+        self._owner_pid = os.getpid()
+        self._pending = []
+        self._last_flush = time.monotonic()
+        self._received = collections.deque()
+        self._partial = b""
+        # the failure whose error message is being received
+        self._failure = None
+
+    def put(self, interval):
+        """Report a completed chunk, or the end of a task if ``interval`` is
+        :class:`SegmentStats`, :class:`SegmentFailed` or None"""
+        if isinstance(interval, SegmentFailed):
+            self._put_failure(interval)
+            return
+
+        if interval is None:
+            interval = SegmentStats(0, 0, 0, 0)
+        if isinstance(interval, SegmentStats):
+            self._pending.append(
+                RECORD.pack(
+                    TASK_DONE,
+                    min(interval.stalls, 0xFF),
+                    interval.slot,
+                    min(int(interval.latency * 1e6), 0xFFFFFFFF),
+                    interval.written,
+                    int(interval.elapsed * 1e6),
+                    SESSION_COUNTS.pack(interval.session_hits, interval.session_misses),
+                )
+            )
+            self.flush()
+            return
+
+        if isinstance(interval, CorruptChunk):
+            length = interval.end - interval.begin
+            self._pending.append(
+                RECORD.pack(CORRUPT, 0, 0, 0, interval.begin, length, NO_DIGEST)
+            )
+            self.flush()
+            return
+
+        if isinstance(interval, VerifyDone):
+            self._pending.append(
+                RECORD.pack(VERIFY_DONE, 0, 0, 0, *interval, NO_DIGEST)
+            )
+            self.flush()
+            return
+
+        length = interval.end - interval.begin
+        if interval.data and interval.data.get("md5sum"):
+            digest = bytes.fromhex(interval.data["md5sum"])
+            record = RECORD.pack(CHUNK_MD5, 0, 0, 0, interval.begin, length, digest)
+        else:
+            record = RECORD.pack(CHUNK, 0, 0, 0, interval.begin, length, NO_DIGEST)
+        self._pending.append(record)
+
+        if (
+            len(self._pending) >= BATCH_RECORDS
+            or time.monotonic() - self._last_flush >= self.flush_interval
+        ):
+            self.flush()
+
+    def _put_failure(self, failure):
+        # the records of the failure go into a batch of their own
+        self.flush()
+        error = failure.error.encode("utf-8", "replace")[:MAX_ERROR_SIZE]
+        counts = SESSION_COUNTS.pack(failure.session_hits, failure.session_misses)
+        self._pending.append(
+            RECORD.pack(
+                FAILED, failure.retryable, failure.slot, 0, 0, len(error), counts
+            )
+        )
+        for i in range(0, len(error), 16):
+            self._pending.append(
+                RECORD.pack(ERROR_TEXT, 0, 0, 0, 0, 0, error[i : i + 16])
+            )
+        self.flush()
+
+    def flush(self):
+        """Write buffered records to the pipe in atomic batches"""
+        if self._read_fd is not None and os.getpid() != self._owner_pid:
+            # A forked worker only writes, drop its copy of the read end so
+            # that the pipe breaks once the producer closes it
+            os.close(self._read_fd)
+            self._read_fd = None
+
+        while self._pending:
+            batch = self._pending[:BATCH_RECORDS]
+            del self._pending[:BATCH_RECORDS]
+            try:
+                os.write(self._write_fd, b"".join(batch))
+            except BrokenPipeError:
+                # the producer stopped listening once the file was complete
+                self._pending = []
+        self._last_flush = time.monotonic()
+
+    def get(self, timeout=None):
+        """Block until the next report is available and return it
+
+        :param float timeout: optional. Seconds to wait for a report
+        :raises queue.Empty: if no report came in within ``timeout``
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._received:
+            if deadline is not None:
+                left = max(0, deadline - time.monotonic())
+                if not select.select([self._read_fd], [], [], left)[0]:
+                    raise queue.Empty
+            data = os.read(self._read_fd, READ_SIZE)
+            if not data:
+                raise EOFError("Completion channel closed")
+            self._decode(data)
+        return self._received.popleft()
+
+    def _decode(self, data):
+        data = self._partial + data
+        usable = len(data) - len(data) % RECORD.size
+        self._partial = data[usable:]
+
+        for kind, stalls, slot, latency, offset, length, digest in RECORD.iter_unpack(
+            data[:usable]
+        ):
+            if kind == FAILED:
+                counts = SESSION_COUNTS.unpack(digest)
+                self._failure = (slot, bool(stalls), length, bytearray(), counts)
+                self._receive_failure()
+            elif kind == ERROR_TEXT:
+                self._failure[3].extend(digest)
+                self._receive_failure()
+            elif kind == TASK_DONE:
+                self._received.append(
+                    SegmentStats(
+                        slot,
+                        offset,
+                        length / 1e6,
+                        latency / 1e6,
+                        stalls,
+                        *SESSION_COUNTS.unpack(digest),
+                    )
+                )
+            elif kind == CORRUPT:
+                self._received.append(CorruptChunk(offset, offset + length))
+            elif kind == VERIFY_DONE:
+                self._received.append(VerifyDone(offset, length))
+            elif kind == CHUNK_MD5:
+                self._received.append(
+                    Interval(offset, offset + length, {"md5sum": digest.hex()})
+                )
+            else:
+                self._received.append(Interval(offset, offset + length, None))
+
+    def _receive_failure(self):
+        slot, retryable, length, error, counts = self._failure
+        if len(error) < length:
+            return
+        self._failure = None
+        self._received.append(
+            SegmentFailed(
+                slot, error[:length].decode("utf-8", "replace"), retryable, *counts
+            )
+        )
+
+    def close(self):
+        for fd in (self._read_fd, self._write_fd):
+            if fd is None:
+                continue
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self._read_fd = self._write_fd = None
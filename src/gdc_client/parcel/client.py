@@ -6,17 +6,24 @@
 # Availability: https://github.com/LabAdvComp/parcel
 # ***************************************************************************************
 
+from concurrent.futures import ThreadPoolExecutor
+
 from gdc_client.parcel import const
 from gdc_client.parcel import utils
+from gdc_client.parcel.async_engine import AsyncDownloadEngine
+from gdc_client.parcel.connection import SessionPool
 from gdc_client.parcel.download_stream import DownloadStream
-from gdc_client.parcel.portability import Process
+from gdc_client.parcel.file_cache import FileCache
+from gdc_client.parcel.ordered_stream import OrderedDownload
 from gdc_client.parcel.segment import SegmentProducer
+from gdc_client.parcel.worker_pool import WorkerPool
 
 import logging
 import os
-import requests
 import tempfile
+import threading
 import time
+from urllib.parse import urlparse
 
 # Logging
 log = logging.getLogger("client")
@@ -35,6 +42,32 @@ class Client:
             The number of processes to use in download
         :param str directory:
             The directory to which any data will be downloaded
+        :param int concurrent_files:
+            optional. The number of files to download at once, sharing
+            the ``n_procs`` connections between them
+        :param bool preallocate:
+            optional. Reserve disk space for each file before downloading
+            it and keep downloaded data out of the page cache
+        :param str engine:
+            optional. ``process`` (default) downloads with a pool of worker
+            processes, ``async`` with coroutines on a single event loop
+        :param int hedge_budget:
+            optional. How many straggling segments of each file may be
+            requested a second time on an idle connection, 0 to never
+        :param int low_speed_limit:
+            optional. Restart a request that receives less than this many
+            bytes/sec over ``low_speed_time`` seconds, 0 to never
+        :param int low_speed_time:
+            optional. Seconds over which the low-speed limit is measured
+        :param list byte_ranges:
+            optional. ``(start, stop)`` ranges to download instead of each
+            whole file, each saved to its own file. See
+            :meth:`DownloadStream.select_byte_range`
+        :param str file_cache:
+            optional. Directory of a cache of downloaded files shared by
+            every download on the node, see :class:`FileCache`
+        :param int file_cache_size:
+            optional. Bytes the file cache may hold
 
         """
 
@@ -43,12 +76,44 @@ class Client:
         )
         DownloadStream.check_segment_md5sums = kwargs.get("segment_md5sums", True)
         DownloadStream.check_file_md5sum = kwargs.get("file_md5sum", True)
+        DownloadStream.preallocate = kwargs.get("preallocate", False)
+        low_speed_limit = kwargs.get("low_speed_limit")
+        DownloadStream.low_speed_limit = (
+            const.LOW_SPEED_LIMIT if low_speed_limit is None else low_speed_limit
+        )
+        DownloadStream.low_speed_time = (
+            kwargs.get("low_speed_time") or const.LOW_SPEED_TIME
+        )
         SegmentProducer.save_interval = kwargs.get("save_interval", const.SAVE_INTERVAL)
+        hedge_budget = kwargs.get("hedge_budget")
+        SegmentProducer.max_hedges = (
+            const.HEDGE_BUDGET if hedge_budget is None else hedge_budget
+        )
 
         self.debug = debug
         self.directory = directory or os.path.abspath(os.getcwd())
         self.directory = os.path.expanduser(self.directory)
         self.n_procs = n_procs
+        self.concurrent_files = max(1, kwargs.get("concurrent_files") or 1)
+        self.files_in_flight = 1
+        # the index of each thread downloading files, which decides its
+        # share of the connections
+        self.lanes = {}
+        self.lanes_lock = threading.Lock()
+        self.engine = kwargs.get("engine") or "process"
+        self.byte_ranges = kwargs.get("byte_ranges") or []
+        self.file_cache = None
+        if kwargs.get("file_cache"):
+            self.file_cache = FileCache(
+                kwargs["file_cache"],
+                kwargs.get("file_cache_size") or const.FILE_CACHE_SIZE,
+            )
+        # keep-alive sessions shared by every request this client makes,
+        # each worker process/thread gets its own entries in the pool
+        self.session_pool = SessionPool()
+        # the worker pools of the files in flight, by thread, while
+        # download_files runs
+        self.worker_pools = None
         self.start = None
         self.stop = None
         self.token = token
@@ -88,23 +153,28 @@ class Client:
     def start_timer(self):
         """Start a download timer.
 
-        :returns: None
+        :returns: The start time
 
         """
 
         self.start_time = time.time()
+        return self.start_time
 
-    def stop_timer(self, file_size=None):
+    def stop_timer(self, file_size=None, start_time=None):
         """Stop a download timer and pring a summary.
 
+        :param float start_time:
+            optional. The time returned by :meth:`start_timer`, for when
+            several files are timed at once
         :returns: None
 
         """
 
         self.stop_time = time.time()
+        start_time = start_time or self.start_time
         rate_info = ""
         if file_size and file_size > 0:
-            rate = (int(file_size) * 8 / 1e9) / (self.stop_time - self.start_time)
+            rate = (int(file_size) * 8 / 1e9) / (self.stop_time - start_time)
             rate_info = f": {rate:.2f} Gbps average"
 
         log.debug("Download complete" + rate_info)
@@ -128,39 +198,40 @@ class Client:
         for url in urls:
             log.debug(f"Given url: {url}")
 
-        # Download each file
-        downloaded, errors = [], {}
-        for url in urls:
-            url = self.fix_uri(url)
+        # Download each file. With concurrent_files, several files are in
+        # flight at once and share the n_procs connection budget, each one
+        # needs a connection at least
+        self.files_in_flight = min(self.concurrent_files, len(urls), self.n_procs)
+        self.files_in_flight = max(1, self.files_in_flight)
+        self.lanes = {}
 
-            # Construct download stream
-            stream = DownloadStream(url, self.directory, self.token)
-
-            # Download file
-            try:
-                # validate temporary file before renaming to permanent file location
-                self.parallel_download(stream)
-                utils.validate_file_md5sum(
-                    stream,
-                    (
-                        stream.temp_path
-                        if os.path.isfile(stream.temp_path)
-                        else stream.path
-                    ),
+        # The download workers are started once and reused for every file
+        self.worker_pools = {}
+        try:
+            if self.files_in_flight > 1:
+                log.debug(
+                    "Downloading {} files at a time sharing {} connections".format(
+                        self.files_in_flight, self.n_procs
+                    )
                 )
-                if os.path.isfile(stream.temp_path):
-                    utils.remove_partial_extension(stream.temp_path)
-                downloaded.append(url)
+                with ThreadPoolExecutor(max_workers=self.files_in_flight) as executor:
+                    results = list(executor.map(self._download_file, urls))
+            else:
+                results = [self._download_file(url) for url in urls]
+        finally:
+            for pool in self.worker_pools.values():
+                pool.close()
+            self.worker_pools = None
+            self.lanes = {}
 
-            # Handle file download error, store error to print out later
-            except Exception as e:
-                errors[url] = str(e)
-                if self.debug:
-                    log.exception(e)
-                    raise
+        downloaded, errors = [], {}
+        for url, error in results:
+            if error is None:
+                downloaded.append(url)
+            else:
+                errors[url] = error
 
-            finally:
-                utils.print_closing_header(url)
+        log.debug(f"Client {self.session_pool.stats()}")
 
         # Print error messages
         for url, error in errors.items():
@@ -169,13 +240,144 @@ class Client:
 
         return downloaded, errors
 
+    def _download_file(self, url):
+        """Download a single file, validate it and move it into place.
+
+        :returns: tuple of the url and an error message, or None on success
+
+        """
+        url = self.fix_uri(url)
+
+        # Download file, or each of the requested byte ranges of it
+        try:
+            for stream in self._download_streams(url):
+                # validate temporary file before renaming to permanent file location
+                self.parallel_download(stream)
+                if os.path.isfile(stream.temp_path):
+                    utils.validate_file_md5sum(
+                        stream, stream.temp_path, md5sum=stream.streamed_md5sum
+                    )
+                else:
+                    utils.validate_file_md5sum(stream, stream.path)
+                if os.path.isfile(stream.temp_path):
+                    utils.remove_partial_extension(stream.temp_path)
+                if self.file_cache and stream.check_file_md5sum and stream.md5sum:
+                    self.file_cache.add(
+                        self.file_id(stream.url), stream.md5sum, stream.path
+                    )
+                self.file_downloaded(stream)
+            if self.files_in_flight > 1:
+                log.info(f"Downloaded {url}")
+            return url, None
+
+        # Handle file download error, store error to print out later
+        except Exception as e:
+            if self.debug:
+                log.exception(e)
+                raise
+            return url, str(e)
+
+        finally:
+            utils.print_closing_header(url)
+
+    def stream_file(self, url, out):
+        """Download a file in order to a binary file object, such as stdout
+        or a named pipe, without writing it to disk.
+
+        The file is still downloaded with ``n_procs`` parallel range
+        requests, see :class:`OrderedDownload`.
+
+        Requested byte ranges are written one after the other.
+
+        :param str url: The url of the file
+        :param out: The binary file object the file is written to
+        :raises MD5ValidationError: if the file checksum is invalid, once
+            the whole file has been written to ``out``
+        """
+        url = self.fix_uri(url)
+
+        utils.print_opening_header(url)
+        try:
+            for stream in self._download_streams(url):
+                log.debug("Getting file information...")
+                stream.init()
+                start_time = self.start_timer()
+                OrderedDownload(stream, out, self.n_procs).download()
+                self.stop_timer(stream.size, start_time)
+        finally:
+            utils.print_closing_header(url)
+
+    def _download_streams(self, url):
+        """The streams to download for ``url``, one for the whole file or
+        one per requested byte range"""
+        return [
+            DownloadStream(
+                url,
+                self.directory,
+                self.token,
+                session_pool=self.session_pool,
+                byte_range=byte_range,
+                **self.known_file_information(url),
+            )
+            for byte_range in self.byte_ranges or [None]
+        ]
+
+    @staticmethod
+    def file_id(url):
+        """The id of the file at ``url``, the last part of its path"""
+        return urlparse(url).path.rstrip("/").split("/")[-1]
+
+    def _link_from_cache(self, stream):
+        """Copy the file from the file cache instead of downloading it
+
+        The cached file is cloned to the temporary path, to be validated
+        and moved into place like a downloaded file.
+
+        :returns: True on a cache hit
+        """
+        if self.file_cache is None or not stream.md5sum:
+            return False
+        os.makedirs(stream.directory, exist_ok=True)
+        if not self.file_cache.link(
+            self.file_id(stream.url), stream.md5sum, stream.temp_path, stream.size
+        ):
+            return False
+        # the cache checked the md5sum of the copy
+        stream.streamed_md5sum = stream.md5sum
+        return True
+
+    def file_downloaded(self, stream):
+        """Called once the file of ``stream`` is validated and in place"""
+
+    def known_file_information(self, url):
+        """File information known without asking the data server
+
+        :returns: a dict of the ``name``, ``size`` and ``md5sum`` of the
+            file at ``url`` that are known, to seed its :class:`DownloadStream`
+        """
+        return {}
+
     def serial_download(self, stream):
         """Download file to directory serially."""
         self._download(1, stream)
 
     def parallel_download(self, stream):
-        """Download file to directory in parallel."""
-        self._download(self.n_procs, stream)
+        """Download file to directory in parallel.
+
+        The connections are shared evenly between the files in flight.
+        """
+        self._download(self._connections(), stream)
+
+    def _connections(self):
+        """The connections of the files downloaded by this thread
+
+        The files in flight get ``n_procs // files_in_flight`` connections
+        each and the first ones one more, until all ``n_procs`` are used.
+        """
+        share, remainder = divmod(self.n_procs, self.files_in_flight)
+        with self.lanes_lock:
+            lane = self.lanes.setdefault(threading.get_ident(), len(self.lanes))
+        return max(1, share + (lane < remainder))
 
     def _download(self, nprocs, stream):
         """Start ``self.n_procs`` to download the file.
@@ -189,6 +391,12 @@ class Client:
         utils.print_opening_header(stream.url)
         log.debug("Getting file information...")
         stream.init()
+        # progress bars of several files would overwrite each other
+        stream.show_progress = self.files_in_flight == 1
+
+        if self._link_from_cache(stream):
+            log.debug(f"Copied {stream.url} from the file cache")
+            return
 
         # if there's no size/Content-Length in the http header
         # then you can't parallel stream it in chunks
@@ -198,46 +406,61 @@ class Client:
 
         # Create segments producer to stream
         n_procs = 1 if stream.size < 0.01 * const.GB else nprocs
-        producer = SegmentProducer(stream, n_procs)
+        if self.engine == "async":
+            return self._async_download(n_procs, stream)
 
+        pool = self._worker_pool(nprocs)
+        try:
+            producer = pool.producer(stream, n_procs)
+            if producer.done:
+                return
+
+            start_time = self.start_timer()
+
+            # Wait for file to finish download
+            producer.wait_for_completion()
+            # the producer already gave the workers that have not reported
+            # a moment, the ones left lost a hedged race and are stuck on
+            # stalled connections
+            pool.settle(producer.n_procs - producer.idle, timeout=0)
+            self.stop_timer(stream.size, start_time)
+            log.debug(producer.summary())
+        except BaseException:
+            # the workers may still be busy with this file
+            pool.close()
+            raise
+        finally:
+            if self.worker_pools is None:
+                pool.close()
+
+    def _worker_pool(self, n_procs):
+        """The workers downloading the files of this thread
+
+        Outside of :meth:`download_files`, a pool is started for each file.
+
+        :param int n_procs: the number of workers needed
+        """
+        key = threading.get_ident()
+        pool = (self.worker_pools or {}).get(key)
+        if pool is not None and pool.usable and pool.n_procs >= n_procs:
+            return pool
+        if pool is not None:
+            pool.close()
+
+        pool = WorkerPool(n_procs, self.session_pool, debug=self.debug)
+        if self.worker_pools is not None:
+            self.worker_pools[key] = pool
+        return pool
+
+    def _async_download(self, n_procs, stream):
+        """Download the file with ``n_procs`` coroutines in this process"""
+        engine = AsyncDownloadEngine(stream, n_procs, verify=self.verify)
+        start_time = self.start_timer()
+        producer = engine.download()
         if producer.done:
             return
-
-        def download_worker():
-            while True:
-                try:
-                    segment = producer.q_work.get()
-                    if segment is None:
-                        log.debug("Producer returned with no more work")
-                        return
-                    stream.write_segment(segment, producer.q_complete)
-                    # write_segment completed successfully, send sentinel value
-                    # to master process to indicate a task was completed
-                    producer.q_complete.put(None)
-                except Exception as e:
-                    # send sentinel value to master process even though
-                    # write_segment failed to indicate a task is "finished"
-                    producer.q_complete.put(None)
-                    if self.debug:
-                        raise
-                    else:
-                        log.error(f"Download aborted: {str(e)}")
-                        # worker needs to stay alive until final sentinel value
-                        # from master process is received
-                        continue
-
-        # Divide work amongst process pool
-        pool = [Process(target=download_worker) for i in range(n_procs)]
-
-        # Start pool
-        for p in pool:
-            p.start()
-
-        self.start_timer()
-
-        # Wait for file to finish download
-        producer.wait_for_completion()
-        self.stop_timer(stream.size)
+        self.stop_timer(stream.size, start_time)
+        log.debug(producer.summary())
 
     def _standard_tcp_download(self, stream):
         """Backup download method for when you can't
@@ -247,7 +470,9 @@ class Client:
         """
 
         try:
-            r = requests.get(stream.url, stream=True, verify=self.verify)
+            r = self.session_pool.get(stream.url).get(
+                stream.url, stream=True, verify=self.verify
+            )
 
             if r.status_code == 200:
                 stream.setup_directories()
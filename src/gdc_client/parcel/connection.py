@@ -0,0 +1,81 @@
+import logging
+import os
+import threading
+from urllib.parse import urlparse
+
+import requests
+
+log = logging.getLogger("connection")
+
+
+class SessionPool:
+    """Keep-alive HTTP sessions reused across segments, retries and files.
+
+    A session (and the connection pool behind its adapter) is created the
+    first time a host is requested and handed out again on every following
+    request to the same host. Sessions are keyed by process and thread as
+    well, so forked workers never reuse a socket inherited from their parent
+    and threaded workers never share a session.
+    """
+
+    def __init__(self, max_retries=16):
+        self.max_retries = max_retries
+        self.hits = 0
+        self.misses = 0
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._lock_pid = os.getpid()
+
+    def _key(self, url):
+        parsed = urlparse(url)
+        return os.getpid(), threading.get_ident(), parsed.scheme, parsed.netloc
+
+    def get(self, url):
+        """Return a pooled session for the host of ``url``
+
+        :param str url: the url that is about to be requested
+        :returns: a :class:`requests.Session` with keep-alive connections
+        """
+        key = self._key(url)
+        if key[0] != self._lock_pid:
+            # the lock may have been held by another thread when this
+            # process was forked, never wait on that copy
+            self._lock = threading.Lock()
+            self._lock_pid = key[0]
+
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None:
+                self.hits += 1
+                return session
+
+            self.misses += 1
+            self._close_exited(key[0])
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(max_retries=self.max_retries)
+            session.mount(f"{key[2]}://", adapter)
+            self._sessions[key] = session
+            return session
+
+    def _close_exited(self, pid):
+        # sessions are never asked for again once their thread has exited
+        alive = {t.ident for t in threading.enumerate()}
+        for key in [k for k in self._sessions if k[0] == pid and k[1] not in alive]:
+            self._sessions.pop(key).close()
+
+    def add(self, hits, misses):
+        """Count the requests a forked worker made through its copy of the
+        pool, which the pool of this process never sees"""
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def stats(self):
+        return f"session pool {self.hits} hits, {self.misses} misses"
+
+    def close(self):
+        """Close the sessions opened by the calling process"""
+        pid = os.getpid()
+        with self._lock:
+            for key in [k for k in self._sessions if k[0] == pid]:
+                self._sessions.pop(key).close()
@@ -15,3 +15,67 @@ MB = 1024 * 1024
 
 HTTP_CHUNK_SIZE = 1 * MB
 SAVE_INTERVAL = 1 * GB
+# Checkpoints append to a journal, which is compacted into a full state
+# snapshot once it holds more than this many records and more records than
+# the snapshot itself
+JOURNAL_COMPACT_RECORDS = 64 * 1024
+
+# Work is cut into about SEGMENTS_PER_PROCESS segments per process, bounded
+# by the sizes below. In-flight segments are not split below MIN_SEGMENT_SIZE
+SEGMENTS_PER_PROCESS = 4
+MIN_SEGMENT_SIZE = 4 * MB
+MAX_SEGMENT_SIZE = 512 * MB
+
+# Segments are sized from the observed per-connection throughput so that each
+# one keeps its connection busy for SEGMENT_TARGET_DURATION seconds and for at
+# least LATENCY_FACTOR times the request latency
+SEGMENT_TARGET_DURATION = 20
+LATENCY_FACTOR = 10
+
+# The async engine writes and hashes chunks on WRITER_THREADS threads and
+# stops reading from the network while WRITE_BEHIND_CHUNKS chunks are queued
+WRITE_BEHIND_CHUNKS = 64
+WRITER_THREADS = 4
+
+# Read size used to hash the completed prefix of a file during download
+HASH_READ_SIZE = 4 * MB
+
+# Threads checking the md5sums of resumed chunks
+VERIFY_THREADS = 4
+
+# An in-flight segment running below HEDGE_RATE_FACTOR times the median
+# connection rate for at least HEDGE_MIN_AGE seconds is requested again from
+# its current offset on an idle connection, at most HEDGE_BUDGET times per
+# file. Stragglers are looked for at least every HEDGE_INTERVAL seconds
+HEDGE_BUDGET = 4
+HEDGE_RATE_FACTOR = 0.25
+HEDGE_MIN_AGE = 5
+HEDGE_INTERVAL = 1
+
+# With a LOW_SPEED_LIMIT, a request that receives less than that many
+# bytes/sec over LOW_SPEED_TIME seconds is aborted and resumed from where it
+# stopped on a new connection. Off by default. Responses are then read
+# STALL_READ_SIZE bytes at a time to notice a stall before a whole chunk
+# trickles in
+LOW_SPEED_LIMIT = 0
+LOW_SPEED_TIME = 30
+STALL_READ_SIZE = 16 * 1024
+
+# Streaming a file in order holds at most STREAM_BUFFER_SIZE bytes of
+# segments of up to STREAM_SEGMENT_SIZE bytes that arrived ahead of their turn
+STREAM_BUFFER_SIZE = 256 * MB
+STREAM_SEGMENT_SIZE = 16 * MB
+
+# Remote files are read in blocks of REMOTE_BLOCK_SIZE bytes, the last
+# REMOTE_CACHE_BLOCKS of them are cached and sequential reads fetch up to
+# REMOTE_READAHEAD_BLOCKS blocks per request
+REMOTE_BLOCK_SIZE = 1 * MB
+REMOTE_CACHE_BLOCKS = 64
+REMOTE_READAHEAD_BLOCKS = 16
+
+# The bytes of a file left over by segments that ran out of retries are
+# put back in the work pool up to REQUEUE_PASSES times
+REQUEUE_PASSES = 3
+
+# Bytes of downloaded files kept in the file cache, when there is one
+FILE_CACHE_SIZE = 100 * GB
@@ -6,10 +6,13 @@
 # Availability: https://github.com/LabAdvComp/parcel
 # ***************************************************************************************
 
+from gdc_client.exceptions import HTTPStatusError, StalledTransferError, retryable
 from gdc_client.parcel import utils
 from gdc_client.parcel import const
 from gdc_client.parcel.defaults import max_timeout, deprecation_header
+from gdc_client.parcel.throughput import LowSpeedMonitor
 
+import errno
 import logging
 from intervaltree import Interval
 import os
@@ -22,25 +25,109 @@ class DownloadStream:
 
     http_chunk_size = const.HTTP_CHUNK_SIZE
     check_segment_md5sums = True
-
-    def __init__(self, url, directory, token=None):
+    show_progress = True
+    # reserve disk space up front and keep written data out of the page cache
+    preallocate = False
+    # restart requests slower than low_speed_limit bytes/sec over
+    # low_speed_time seconds, a limit of 0 never does
+    low_speed_limit = const.LOW_SPEED_LIMIT
+    low_speed_time = const.LOW_SPEED_TIME
+
+    def __init__(
+        self,
+        url,
+        directory,
+        token=None,
+        session_pool=None,
+        name=None,
+        size=None,
+        md5sum=None,
+        byte_range=None,
+    ):
+        """
+        :param str name: optional. The file name, if already known
+        :param int size: optional. The file size, if already known
+        :param str md5sum: optional. The file md5sum, if already known.
+            Together with ``size``, it saves requesting the file
+            information from the data server.
+        :param tuple byte_range: optional. ``(start, stop)`` of the only
+            part of the file to download, see :meth:`select_byte_range`
+        """
         self.initialized = False
         self.is_regular_file = True
         self.log = logging.getLogger(str(url))
-        self.name = None
+        # a known name may be an S3 key as well
+        self.name = self._parse_filename(name) if name else name
         self.directory = self._get_directory_name(directory, url)
-        self.size = None
-        self.md5sum = None
+        self.size = size
+        self.md5sum = md5sum
         self.token = token
         self.url = url
         self.check_file_md5sum = True
-
-    def init(self):
-        self.get_information()
+        self.session_pool = session_pool
+        # whole-file md5 computed by the producer while downloading
+        self.streamed_md5sum = None
+        self.byte_range = byte_range
+        # offset in the remote file of the first byte downloaded
+        self.offset = 0
+
+    def __getstate__(self):
+        # streams are handed to worker processes, which have their own
+        # sessions in the pool
+        state = self.__dict__.copy()
+        state["session_pool"] = None
+        return state
+
+    def init(self, verify=True):
+        """Learn what is not known yet about the file
+
+        :param bool verify: optional. Verify the server certificate of the
+            request for the file information
+        :returns: the stream
+        """
+        if not (self.size and self.md5sum):
+            self.get_information(verify=verify)
+        elif not self.name:
+            self.get_name(verify=verify)
+        else:
+            self.log.debug("File information already known")
+        if self.byte_range:
+            self.select_byte_range(*self.byte_range)
         self.print_download_information()
         self.initialized = True
         return self
 
+    def select_byte_range(self, start, stop=None):
+        """Download only the bytes ``[start, stop)`` of the file.
+
+        The range follows slice semantics: a negative ``start`` counts from
+        the end of the file and ``stop`` defaults to the end of the file.
+        The range is saved as ``<name>.<first>-<last>`` with the offsets of
+        its first and last bytes, and resumes like a whole file. Segments
+        and requests are then relative to the start of the range, and there
+        is no whole-file md5 to check.
+
+        Must be called once the file size is known.
+
+        :param int start: The offset of the first byte
+        :param int stop: optional. The offset after the last byte
+        :raises ValueError: if the range is empty
+        """
+        if not self.size:
+            raise ValueError("Cannot download a byte range of a file of unknown size")
+        start, stop, _ = slice(start, stop).indices(self.size)
+        if start >= stop:
+            raise ValueError(
+                f"Byte range {start}-{stop - 1} is outside of the {self.size} byte file"
+            )
+
+        self.offset = start
+        self.size = stop - start
+        self.name = f"{self.name}.{start}-{stop - 1}"
+        self.md5sum = None
+        self.check_file_md5sum = False
+        self.log.debug(f"Byte range          : {start}-{stop - 1}")
+
     def _get_directory_name(self, directory, url):
         # get filename/id
         path = urlparse(url).path
@@ -64,8 +151,14 @@ class DownloadStream:
     def setup_file(self):
         self.setup_directories()
         try:
-            utils.set_file_length(self.temp_path, self.size)
-        except:
+            if self.preallocate:
+                utils.preallocate_file(self.temp_path, self.size)
+            else:
+                utils.set_file_length(self.temp_path, self.size)
+        except Exception as e:
+            if getattr(e, "errno", None) == errno.ENOSPC:
+                # out of space is not something to proceed from
+                raise
             self.log.warning(
                 utils.STRIP(
                     """Unable to set file length. File appears to
@@ -107,6 +200,19 @@ class DownloadStream:
         """
         return os.path.join(self.state_directory, f"{self.name}.parcel")
 
+    @property
+    def hashes_while_downloading(self):
+        """True if the whole-file md5 is computed as the download goes on"""
+        return bool(self.check_file_md5sum and self.md5sum and self.is_regular_file)
+
+    @property
+    def journal_path(self):
+        """Function to standardize the progress journal path for a download.
+
+        :returns: A string specifying the download journal path
+        """
+        return f"{self.state_path}.journal"
+
     @property
     def state_directory(self):
         """Function to standardize the state directory for a download.
@@ -125,6 +231,7 @@ class DownloadStream:
             The end of the range interval. This value is inclusive.
             If give range A-B, then both bytes A and B will be
             included.
+            Both are relative to the selected byte range, if any.
         :returns: A dictionary header containing the token
         """
 
@@ -132,7 +239,7 @@ class DownloadStream:
             "X-Auth-Token": self.token,
         }
         if start is not None and end is not None:
-            header["Range"] = f"bytes={start}-{end}"
+            header["Range"] = f"bytes={start + self.offset}-{end + self.offset}"
             # provide host because it's mandatory, range request
             # may not work otherwise
             scheme, host, path, params, q, frag = urlparse(self.url)
@@ -153,10 +260,15 @@ class DownloadStream:
         """
         self.log.debug(f"Request to {self.url}")
 
-        # Set urllib3 retries and mount for session
-        a = requests.adapters.HTTPAdapter(max_retries=max_retries)
-        s = requests.Session()
-        s.mount(urlparse(self.url).scheme, a)
+        if self.session_pool is not None:
+            # Reuse a keep-alive session owned by the client
+            s = self.session_pool.get(self.url)
+            self.log.debug(self.session_pool.stats())
+        else:
+            # Set urllib3 retries and mount for session
+            a = requests.adapters.HTTPAdapter(max_retries=max_retries)
+            s = requests.Session()
+            s.mount(urlparse(self.url).scheme, a)
 
         headers = self.headers() if headers is None else headers
         try:
@@ -177,22 +289,23 @@ class DownloadStream:
         try:
             r.raise_for_status()
         except Exception as e:
-            raise RuntimeError(f"{str(e)}: {r.text}")
+            raise HTTPStatusError(f"{str(e)}: {r.text}", r.status_code)
 
         if close:
             r.close()
         return r
 
-    def get_information(self):
+    def get_information(self, verify=True):
         """Make a request to the data server for information on the file.
 
         :param str file_id: The id of the entity being requested.
+        :param bool verify: optional. Verify SSL hostname
         :returns: Tuple containing the name and size of the entity
 
         """
 
         headers = self.header()
-        r = self.request(headers, close=True)
+        r = self.request(headers, verify=verify, close=True)
         self.log.debug("Request responded")
 
         content_length = r.headers.get("Content-Length")
@@ -204,6 +317,31 @@ class DownloadStream:
             self.size = int(content_length)
             self.log.debug(f"{self.size} bytes")
 
+        self._set_name(r)
+
+        self.md5sum = None
+        if self.check_file_md5sum:
+            self.md5sum = r.headers.get("content-md5", "")
+
+        return self.name, self.size
+
+    def get_name(self, verify=True):
+        """Learn the file name from a one byte range request.
+
+        Unlike :meth:`get_information`, this does not start streaming the
+        whole file, so the connection can be reused afterwards.
+
+        :param bool verify: optional. Verify SSL hostname
+        :returns: The file name
+        """
+        r = self.request(self.header(0, 0), verify=verify)
+        # read the byte so the connection goes back to the pool
+        r.content
+        r.close()
+        self._set_name(r)
+        return self.name
+
+    def _set_name(self, r):
         attachment = r.headers.get("content-disposition", None)
         self.log.debug(f"Attachment:         : {attachment}")
 
@@ -215,25 +353,58 @@ class DownloadStream:
             else "untitled"
         )
 
-        self.md5sum = None
-        if self.check_file_md5sum:
-            self.md5sum = r.headers.get("content-md5", "")
-
-        return self.name, self.size
-
-    def write_segment(self, segment, q_complete, retries=5):
+    def write_segment(self, segment, q_complete, retries=5, slot=None):
         """Read data from the data server and write it to a file.
 
+        The temporary file is opened once for the lifetime of the segment
+        (including any retries) and every chunk is written positionally.
+
         :param str file_id: The id of the file
         :params str path: A string specifying the full download path
         :params tuple segment:
             A tuple containing the interval to download (start, end)
         :params q_out: A multiprocessing Queue used for async reporting
-        :returns: The total number of bytes written
+        :params slot:
+            optional. The worker's :class:`SegmentSlot`. Every chunk is
+            claimed through it before being written, which lets the
+            producer cut the segment short and hand its tail to another
+            worker.
+        :returns: tuple of the total number of bytes written, the latency
+            of the last request and the number of requests restarted
+            because they stalled. They are returned rather than kept on the
+            stream, which threaded workers share
 
         """
 
+        if slot is not None:
+            segment = slot.start(segment)
+
+        fd = utils.open_for_positional_writes(self.temp_path)
         written = 0
+        try:
+            written, latency, stalls = self._write_segment(
+                fd, segment, q_complete, retries, slot
+            )
+            return written, latency, stalls
+        finally:
+            if self.preallocate and not self.hashes_while_downloading:
+                # nothing reads this back, keep it out of the page cache
+                utils.fadvise(fd, segment.begin, written, "POSIX_FADV_DONTNEED")
+            os.close(fd)
+            if slot is not None:
+                slot.release()
+
+    def _write_segment(self, fd, segment, q_complete, retries, slot=None):
+        written = 0
+        # seconds between sending the request and parsing its headers
+        latency = 0
+        r = None
+        if slot is not None:
+            # The producer may already have taken the tail of this segment
+            segment = Interval(segment.begin, min(segment.end, slot.limit))
+            if segment.begin >= segment.end:
+                return written, latency, 0
+
         # Create header that specifies range and make initial stream
         # request. Note the 1 subtracted from the end of the interval
         # is because the HTTP range request is inclusive of the top of
@@ -244,42 +415,79 @@ class DownloadStream:
         try:
             # Initialize segment request
             r = self.request(self.header(start, end))
+            latency = r.elapsed.total_seconds()
 
             # Iterate over the data stream
             self.log.debug(f"Initializing segment: {start}-{end}")
-            for chunk in r.iter_content(chunk_size=self.http_chunk_size):
+            for chunk in self._iter_chunks(r):
                 if not chunk:
                     continue  # Empty are keep-alives.
                 offset = start + written
 
+                # Stop at the point where the rest of the segment was
+                # handed to another worker, and skip what the straggler of
+                # a hedged race already wrote
+                received = len(chunk)
+                stolen = False
+                if slot is not None:
+                    claimed = slot.claim(offset, received)
+                    stolen = claimed.end < offset + received
+                    chunk = chunk[claimed.begin - offset : claimed.end - offset]
+                    write_at = claimed.begin
+                else:
+                    write_at = offset
+
                 # Write the chunk to disk, create an interval that
                 # represents the chunk, get md5 info if necessary, and
                 # report completion back to the producer
-                utils.write_offset(self.temp_path, chunk, offset)
-                if self.check_segment_md5sums:
-                    iv_data = {"md5sum": utils.md5sum(chunk)}
-                else:
-                    iv_data = None
-                complete_segment = Interval(offset, offset + len(chunk), iv_data)
-                q_complete.put(complete_segment)
+                if chunk:
+                    utils.pwrite(fd, chunk, write_at)
+                    if self.check_segment_md5sums:
+                        iv_data = {"md5sum": utils.md5sum(chunk)}
+                    else:
+                        iv_data = None
+                    complete_segment = Interval(
+                        write_at, write_at + len(chunk), iv_data
+                    )
+                    q_complete.put(complete_segment)
 
-                written += len(chunk)
+                if stolen:
+                    written += claimed.end - offset
+                    self.log.debug(f"Segment split at {claimed.end}")
+                    segment = Interval(segment.begin, claimed.end)
+                    break
+                written += received
 
         except KeyboardInterrupt:
-            return self.log.error("Process stopped by user.")
+            self.log.error("Process stopped by user.")
+            return written, latency, 0
 
         # Retry on exception if we haven't exceeded max retries
         except Exception as e:
+            # Don't hand a half read connection back to the session pool
+            if r is not None:
+                r.close()
+
+            if not retryable(e):
+                # the server refuses the file, not just this request
+                raise
+
             # TODO FIXME HACK create new segment to avoid duplicate downloads
             segment = Interval(segment.begin + written, segment.end, None)
 
+            stalled = isinstance(e, StalledTransferError)
             self.log.debug(f"Unable to download part of file: {str(e)}\n.")
             if retries > 0:
                 self.log.debug("Retrying download of this segment")
-                return self.write_segment(segment, q_complete, retries - 1)
+                rest, latency, stalls = self._write_segment(
+                    fd, segment, q_complete, retries - 1, slot
+                )
+                return written + rest, latency, stalls + stalled
             else:
-                self.log.error("Max retries exceeded.")
-                return 0
+                # the producer downloads what is left again
+                raise RuntimeError(f"Max retries exceeded: {str(e)}")
+
+        r.close()
 
         # Check that the data is not truncated or elongated
         if written != segment.end - segment.begin:
@@ -292,12 +500,39 @@ class DownloadStream:
                 )
             )
             if retries:
-                return self.write_segment(segment, q_complete, retries - 1)
+                rest, latency, stalls = self._write_segment(
+                    fd, segment, q_complete, retries - 1, slot
+                )
+                return written + rest, latency, stalls
             else:
                 raise RuntimeError("Segment corruption. Max retries exceeded.")
 
-        r.close()
-        return written
+        return written, latency, 0
+
+    def _iter_chunks(self, r):
+        """Iterate over the body of ``r`` in chunks of ``http_chunk_size``
+
+        With a low-speed limit the body is read in small pieces, so that a
+        stalled transfer is noticed before a whole chunk has trickled in.
+
+        :raises StalledTransferError: if the transfer stalls
+        """
+        if not self.low_speed_limit:
+            yield from r.iter_content(chunk_size=self.http_chunk_size)
+            return
+
+        monitor = LowSpeedMonitor(self.low_speed_limit, self.low_speed_time)
+        read_size = min(const.STALL_READ_SIZE, self.http_chunk_size)
+        pieces, size = [], 0
+        for piece in r.iter_content(chunk_size=read_size):
+            monitor.update(len(piece))
+            pieces.append(piece)
+            size += len(piece)
+            if size >= self.http_chunk_size:
+                yield b"".join(pieces)
+                pieces, size = [], 0
+        if pieces:
+            yield b"".join(pieces)
 
     def print_download_information(self):
         self.log.debug(f"Starting download   : {self.url}")
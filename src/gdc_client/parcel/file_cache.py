@@ -0,0 +1,124 @@
+import logging
+import os
+import stat
+import threading
+
+from gdc_client.parcel import utils
+
+log = logging.getLogger("file-cache")
+
+
+class FileCache:
+    """Downloaded files kept in a directory shared by every download on a
+    node, keyed by file id and md5sum.
+
+    A file is stored as ``<directory>/<file id>/<md5sum>/data``. Files are
+    cloned in and out of the cache with :func:`utils.clone_file`, so on a
+    single file system a cache hit costs neither network nor disk space.
+    The modification time of the entry directory records when it was last
+    used, without touching the file shared with the download directories.
+    Once more than ``max_size`` bytes are cached, the least recently used
+    files are removed.
+    """
+
+    def __init__(self, directory, max_size):
+        self.directory = os.path.expanduser(directory)
+        self.max_size = max_size
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def path(self, file_id, md5sum):
+        return os.path.join(self.directory, file_id, md5sum, "data")
+
+    def contains(self, file_id, md5sum):
+        return bool(md5sum) and os.path.isfile(self.path(file_id, md5sum))
+
+    def link(self, file_id, md5sum, dst, size=None):
+        """Copy the cached file to ``dst``
+
+        The copy is checked against ``size`` and ``md5sum``, since a
+        hardlinked entry shares its data with every download directory it
+        was linked into. A corrupt entry is removed from the cache.
+
+        :param int size: optional. The expected size of the file
+        :returns: True on a cache hit, False if the file is not cached
+        """
+        if not self.contains(file_id, md5sum):
+            return False
+        path = self.path(file_id, md5sum)
+        try:
+            if size is not None and os.path.getsize(path) != size:
+                self.discard(file_id, md5sum, "has the wrong size")
+                return False
+            method = utils.clone_file(path, dst)
+            os.utime(os.path.dirname(path))
+            if utils.md5sum_whole_file(dst) != md5sum:
+                os.remove(dst)
+                self.discard(file_id, md5sum, "has an invalid md5sum")
+                return False
+        except OSError as e:
+            # evicted meanwhile, or unreadable
+            log.debug(f"Unable to use cached {file_id}: {str(e)}")
+            return False
+        log.debug(f"Cache hit for {file_id}, {method} from {path}")
+        return True
+
+    def add(self, file_id, md5sum, src):
+        """Cache the downloaded file ``src``, whose md5sum has been checked
+
+        The cached file is made read-only. When it is hardlinked, so is
+        ``src``, which keeps the entry from being modified through it.
+        """
+        if not md5sum or self.contains(file_id, md5sum):
+            return
+        path = self.path(file_id, md5sum)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            method = utils.clone_file(src, path)
+            # only drop the write bits, the umask decides who may read it
+            os.chmod(path, stat.S_IMODE(os.stat(path).st_mode) & ~0o222)
+        except OSError as e:
+            log.warning(f"Unable to cache {file_id}: {str(e)}")
+            return
+        log.debug(f"Cached {file_id} ({method})")
+        self.evict()
+
+    def discard(self, file_id, md5sum, reason):
+        """Remove a corrupt file from the cache"""
+        path = self.path(file_id, md5sum)
+        log.warning(f"Cached {file_id} {reason}, removing it from the cache")
+        try:
+            _remove_entry(path)
+        except OSError as e:
+            log.debug(f"Unable to remove {path}: {str(e)}")
+
+    def evict(self):
+        """Remove the least recently used files until the cache is below
+        its size limit"""
+        with self._lock:
+            removed, size = utils.evict_least_recently_used(
+                self._entries(), self.max_size, remove=_remove_entry
+            )
+        if removed:
+            log.debug(f"Evicted {removed} cached files, {size} bytes left")
+
+    def _entries(self):
+        """Yield the last use, size and path of the cached files"""
+        for file_id in os.listdir(self.directory):
+            try:
+                md5sums = os.listdir(os.path.join(self.directory, file_id))
+            except OSError:
+                continue
+            for md5sum in md5sums:
+                path = self.path(file_id, md5sum)
+                try:
+                    used = os.stat(os.path.dirname(path)).st_mtime
+                    size = os.stat(path).st_size
+                except OSError:
+                    continue
+                yield used, size, path
+
+
+def _remove_entry(path):
+    os.remove(path)
+    os.rmdir(os.path.dirname(path))
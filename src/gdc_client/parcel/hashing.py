@@ -0,0 +1,112 @@
+import hashlib
+import logging
+import threading
+
+from gdc_client.parcel.const import HASH_READ_SIZE
+from gdc_client.parcel.utils import fadvise
+
+log = logging.getLogger("hashing")
+
+
+class PrefixHasher:
+    """Whole-file MD5 of a file that is written out of order.
+
+    The producer reports every completed range with :meth:`add`. Whenever
+    the contiguous run of completed bytes starting at offset 0 grows, a
+    background thread reads the new bytes back (they were just written, so
+    they come from the page cache) and feeds them to the digest while the
+    download goes on. Once the download is over, :meth:`hexdigest` only has
+    to read whatever lies past that prefix, if anything. With ``drop_cache``
+    the hashed bytes are dropped from the page cache right away.
+    """
+
+    def __init__(self, path, read_size=HASH_READ_SIZE, drop_cache=False):
+        self.path = path
+        self.read_size = read_size
+        self.drop_cache = drop_cache
+        # end of the contiguous completed prefix, and how much of it is hashed
+        self.prefix = 0
+        self.hashed = 0
+        self._ahead = {}
+        self._md5 = hashlib.md5()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def add(self, begin, end):
+        """Account for the completed range ``[begin, end)``"""
+        if begin > self.prefix:
+            self._ahead[begin] = max(end, self._ahead.get(begin, end))
+            return
+
+        prefix = max(self.prefix, end)
+        while prefix in self._ahead:
+            prefix = max(prefix, self._ahead.pop(prefix))
+
+        if prefix != self.prefix:
+            with self._cond:
+                self.prefix = prefix
+                self._cond.notify()
+
+    def _run(self):
+        try:
+            # unbuffered, a read ahead could cache bytes not yet written
+            with open(self.path, "rb", buffering=0) as f:
+                fadvise(f.fileno(), 0, 0, "POSIX_FADV_SEQUENTIAL")
+                while True:
+                    with self._cond:
+                        while self.hashed >= self.prefix and not self._closed:
+                            self._cond.wait()
+                        if self._closed:
+                            return
+                        target = self.prefix
+
+                    while self.hashed < target:
+                        data = f.read(min(self.read_size, target - self.hashed))
+                        if not data:
+                            raise EOFError(f"{self.path} ends at {self.hashed}")
+                        self._md5.update(data)
+                        if self.drop_cache:
+                            fadvise(
+                                f.fileno(),
+                                self.hashed,
+                                len(data),
+                                "POSIX_FADV_DONTNEED",
+                            )
+                        self.hashed += len(data)
+        except Exception as e:
+            self._error = e
+
+    def close(self):
+        """Stop the background thread"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def hexdigest(self):
+        """Stop hashing in the background and finish the digest
+
+        :returns: the hex MD5 of the whole file
+        """
+        self.close()
+        if self._error is not None:
+            log.debug(f"Streaming md5 failed, hashing whole file: {self._error}")
+            self._md5 = hashlib.md5()
+            self.hashed = 0
+
+        streamed = self.hashed
+        with open(self.path, "rb") as f:
+            f.seek(self.hashed)
+            for data in iter(lambda: f.read(self.read_size), b""):
+                self._md5.update(data)
+                self.hashed += len(data)
+
+        log.debug(
+            "md5 streamed over {} bytes, read back {} bytes".format(
+                streamed, self.hashed - streamed
+            )
+        )
+        return self._md5.hexdigest()
@@ -0,0 +1,220 @@
+import logging
+import math
+import sys
+import threading
+
+from gdc_client.exceptions import retryable
+from gdc_client.parcel import utils
+from gdc_client.parcel.const import (
+    STALL_READ_SIZE,
+    STREAM_BUFFER_SIZE,
+    STREAM_SEGMENT_SIZE,
+)
+from gdc_client.parcel.throughput import LowSpeedMonitor
+
+log = logging.getLogger("ordered")
+
+
+class OrderedDownload:
+    """Stream a file in order to a file object with parallel range requests.
+
+    The file is cut into segments that ``connections`` threads download in
+    order. Segments that arrive before their turn wait in a reorder buffer
+    of about ``buffer_size`` bytes: a connection only starts a segment once
+    there is room for it, so the segment written next is always in flight
+    or buffered and memory stays bounded however the connections race.
+
+    Nothing touches the disk, which lets ``out`` be stdout or a named pipe.
+    The whole-file md5 is computed as the data is written out and checked
+    once the file is complete.
+    """
+
+    def __init__(
+        self,
+        stream,
+        out,
+        connections,
+        buffer_size=STREAM_BUFFER_SIZE,
+        retries=5,
+    ):
+        """
+        :param stream: an initialized :class:`DownloadStream`
+        :param out: binary file object the file is written to
+        :param int connections: number of concurrent range requests
+        :param int buffer_size: optional. Bytes of segments that may wait
+            for their turn to be written
+        :param int retries: optional. Times a segment is requested again
+            from where it stopped before the download fails
+        """
+        self.stream = stream
+        self.out = out
+        self.connections = max(1, connections)
+        self.retries = retries
+
+        # every connection gets two segments of whole chunks in the buffer,
+        # so it does not wait on the segment before it to start the next
+        chunk_size = stream.http_chunk_size
+        segment_size = min(STREAM_SEGMENT_SIZE, buffer_size // (2 * self.connections))
+        self.segment_size = max(chunk_size, segment_size // chunk_size * chunk_size)
+        self.window = max(2 * self.connections, buffer_size // self.segment_size)
+        self.n_segments = math.ceil((stream.size or 0) / self.segment_size)
+
+        self.cond = threading.Condition()
+        # downloaded segments waiting for their turn, by index
+        self.ready = {}
+        self.next_segment = 0
+        self.segments_written = 0
+        self.error = None
+        self.pbar = None
+
+    def download(self):
+        """Stream the file to ``self.out``
+
+        :raises MD5ValidationError: if the file checksum is invalid, after
+            the whole file has been written out
+        """
+        md5 = utils.md5() if self.stream.check_file_md5sum else None
+        if self.stream.show_progress and self.stream.size:
+            # the data itself may be going to stdout
+            self.pbar = utils.get_file_transfer_pbar(
+                self.stream.url, self.stream.size, fd=sys.stderr
+            )
+
+        if self.stream.size:
+            chunks = self._ordered_chunks()
+        else:
+            # without a size there are no ranges to request
+            chunks = self._whole_file()
+
+        size = 0
+        for chunk in chunks:
+            self.out.write(chunk)
+            size += len(chunk)
+            if md5 is not None:
+                md5.update(chunk)
+            if self.pbar:
+                self.pbar.update(size)
+        self.out.flush()
+
+        if self.pbar:
+            self.pbar.finish()
+        if md5 is not None:
+            utils.validate_file_md5sum(self.stream, None, md5sum=md5.hexdigest())
+        log.debug(f"Streamed {size} bytes in {self.n_segments} segments")
+
+    def _ordered_chunks(self):
+        """Yield the chunks of the file in order as the connections bring
+        them in"""
+        threads = [
+            threading.Thread(target=self._worker, daemon=True)
+            for _ in range(min(self.connections, self.n_segments))
+        ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            for index in range(self.n_segments):
+                with self.cond:
+                    while index not in self.ready and self.error is None:
+                        self.cond.wait()
+                    if self.error is not None:
+                        raise self.error
+                    chunks = self.ready.pop(index)
+
+                yield from chunks
+
+                with self.cond:
+                    self.segments_written += 1
+                    self.cond.notify_all()
+        finally:
+            with self.cond:
+                if self.segments_written < self.n_segments:
+                    # stop the connections, the reader is gone
+                    self.error = self.error or RuntimeError("Download stopped")
+                self.cond.notify_all()
+
+        for thread in threads:
+            thread.join()
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                while (
+                    self.error is None
+                    and self.next_segment < self.n_segments
+                    and self.next_segment - self.segments_written >= self.window
+                ):
+                    self.cond.wait()
+                if self.error is not None or self.next_segment >= self.n_segments:
+                    return
+                index = self.next_segment
+                self.next_segment += 1
+
+            try:
+                chunks = self._fetch_segment(index)
+            except Exception as e:
+                log.error(f"Download aborted: {str(e)}")
+                with self.cond:
+                    self.error = self.error or e
+                    self.cond.notify_all()
+                return
+
+            with self.cond:
+                self.ready[index] = chunks
+                self.cond.notify_all()
+
+    def _fetch_segment(self, index):
+        """Download segment ``index``, retrying from where it stopped
+
+        :returns: the list of chunks of the segment
+        """
+        begin = index * self.segment_size
+        end = min(begin + self.segment_size, self.stream.size)
+        chunks = []
+        received = 0
+        retries = self.retries
+        while True:
+            try:
+                self._read_range(begin + received, end, chunks)
+            except Exception as e:
+                if not retryable(e):
+                    raise
+                log.debug(f"Unable to download part of file: {str(e)}")
+            received = sum(len(chunk) for chunk in chunks)
+            if begin + received >= end:
+                return chunks
+            if not retries:
+                raise RuntimeError("Max retries exceeded.")
+            retries -= 1
+            log.debug(f"Retrying segment {index} from {begin + received}")
+
+    def _read_range(self, begin, end, chunks):
+        """Append the bytes of ``[begin, end)`` to ``chunks`` as they come in
+
+        :raises StalledTransferError: if the transfer stalls
+        """
+        r = self.stream.request(self.stream.header(begin, end - 1))
+        monitor = LowSpeedMonitor(
+            self.stream.low_speed_limit, self.stream.low_speed_time
+        )
+        read_size = self.stream.http_chunk_size
+        if self.stream.low_speed_limit:
+            read_size = min(read_size, STALL_READ_SIZE)
+        left = end - begin
+        try:
+            for chunk in r.iter_content(chunk_size=read_size):
+                monitor.update(len(chunk))
+                chunk = chunk[:left]
+                chunks.append(chunk)
+                left -= len(chunk)
+                if not left:
+                    break
+        finally:
+            r.close()
+
+    def _whole_file(self):
+        r = self.stream.request(self.stream.header())
+        try:
+            yield from r.iter_content(chunk_size=self.stream.http_chunk_size)
+        finally:
+            r.close()
@@ -0,0 +1,216 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import NamedTuple, Optional
+
+DIGEST_SIZE = 16
+
+
+class Range(NamedTuple):
+    """A half-open byte range ``[begin, end)``, with optional ``data``"""
+
+    begin: int
+    end: int
+    data: Optional[dict] = None
+
+
+class RangeSet:
+    """Set of byte ranges kept merged in sorted begin/end arrays.
+
+    Adjacent and overlapping ranges are merged as they are added, so a file
+    downloaded in a million chunks is usually covered by a handful of
+    ranges. Lookups bisect the arrays, and adding or chopping a range costs
+    a bisect plus, at worst, a memmove of the arrays. That is O(n) in the
+    number of ranges rather than the O(log n) of a balanced tree, but n
+    stays small and moving a few contiguous 8 byte integers is cheaper
+    than maintaining tree nodes.
+    """
+
+    def __init__(self, ranges=()):
+        self._begins = array("q")
+        self._ends = array("q")
+        self.size = 0
+        for begin, end, *_ in ranges:
+            self.add(begin, end)
+
+    def __len__(self):
+        return len(self._begins)
+
+    def __iter__(self):
+        return self.ranges()
+
+    def __repr__(self):
+        return f"{type(self).__name__}({list(self.ranges())})"
+
+    def ranges(self):
+        """Iterate over the merged ranges in order"""
+        return (Range(begin, end) for begin, end in zip(self._begins, self._ends))
+
+    def items(self):
+        return list(self.ranges())
+
+    def add(self, begin, end):
+        """Add ``[begin, end)``, merging it with the ranges it touches"""
+        if begin >= end:
+            return
+        # ranges i..j-1 overlap or are adjacent to the new one
+        i = bisect_left(self._ends, begin)
+        j = bisect_right(self._begins, end)
+        if j == i + 1:
+            # the usual case, growing a single range
+            old = self._ends[i] - self._begins[i]
+            self._begins[i] = min(begin, self._begins[i])
+            self._ends[i] = max(end, self._ends[i])
+            self.size += self._ends[i] - self._begins[i] - old
+            return
+        if i < j:
+            begin = min(begin, self._begins[i])
+            end = max(end, self._ends[j - 1])
+            for k in range(i, j):
+                self.size -= self._ends[k] - self._begins[k]
+        self._begins[i:j] = array("q", [begin])
+        self._ends[i:j] = array("q", [end])
+        self.size += end - begin
+
+    def chop(self, begin, end):
+        """Remove ``[begin, end)``, splitting the ranges it cuts through"""
+        if begin >= end:
+            return
+        # ranges i..j-1 overlap the removed one
+        i = bisect_right(self._ends, begin)
+        j = bisect_left(self._begins, end)
+        if i >= j:
+            return
+
+        begins, ends = array("q"), array("q")
+        if self._begins[i] < begin:
+            begins.append(self._begins[i])
+            ends.append(begin)
+        if self._ends[j - 1] > end:
+            begins.append(end)
+            ends.append(self._ends[j - 1])
+
+        for k in range(i, j):
+            self.size -= self._ends[k] - self._begins[k]
+        for b, e in zip(begins, ends):
+            self.size += e - b
+        self._begins[i:j] = begins
+        self._ends[i:j] = ends
+
+    def covers(self, begin, end):
+        """True if all of ``[begin, end)`` is in the set"""
+        if begin >= end:
+            return True
+        i = bisect_right(self._begins, begin) - 1
+        return i >= 0 and self._ends[i] >= end
+
+    def first(self):
+        """The lowest range, or None if the set is empty"""
+        if not self._begins:
+            return None
+        return Range(self._begins[0], self._ends[0])
+
+    def next_gap(self, offset, limit):
+        """The first range at or after ``offset`` and before ``limit`` that
+        is not in the set, or None"""
+        i = bisect_right(self._begins, offset) - 1
+        if i >= 0 and self._ends[i] > offset:
+            offset = self._ends[i]
+        if offset >= limit:
+            return None
+        i = bisect_right(self._begins, offset)
+        end = self._begins[i] if i < len(self._begins) else limit
+        return Range(offset, min(end, limit))
+
+
+class ChunkRangeSet(RangeSet):
+    """Completed chunks: merged coverage plus a side table of chunk digests.
+
+    Coverage is merged like in any :class:`RangeSet`. Chunks that come with
+    an md5 digest are also appended to a table of begin/end arrays and
+    packed 16 byte digests, about 32 bytes per chunk, so they can still be
+    verified and saved one by one. Chunks complete out of order, so the
+    table is only sorted when it is read. Iterating yields the chunks in
+    order, with ``{"md5sum": ...}`` data, and any covered range without a
+    recorded digest as a chunk without data.
+    """
+
+    def __init__(self, chunks=()):
+        self._chunk_begins = array("q")
+        self._chunk_ends = array("q")
+        self._digests = bytearray()
+        self._sorted = True
+        super().__init__()
+        for chunk in chunks:
+            self.add(chunk.begin, chunk.end, (chunk.data or {}).get("md5sum"))
+
+    def __len__(self):
+        # about the number of chunks, exact unless only some have digests
+        return max(len(self._begins), len(self._chunk_begins))
+
+    def __iter__(self):
+        return self.chunks()
+
+    def items(self):
+        return list(self.chunks())
+
+    def add(self, begin, end, md5sum=None):
+        """Add the chunk ``[begin, end)`` and its hex md5 digest, if any"""
+        super().add(begin, end)
+        if not md5sum or begin >= end:
+            return
+
+        if self._chunk_begins and begin <= self._chunk_begins[-1]:
+            self._sorted = False
+        self._chunk_begins.append(begin)
+        self._chunk_ends.append(end)
+        self._digests += bytes.fromhex(md5sum)
+
+    def _sort(self):
+        if self._sorted:
+            return
+        # the digest recorded last for a chunk wins, e.g. one replayed
+        # from the journal over the snapshot
+        latest = {begin: k for k, begin in enumerate(self._chunk_begins)}
+        order = [latest[begin] for begin in sorted(latest)]
+        self._chunk_begins = array("q", [self._chunk_begins[k] for k in order])
+        self._chunk_ends = array("q", [self._chunk_ends[k] for k in order])
+        self._digests = bytearray().join(
+            self._digests[k * DIGEST_SIZE : (k + 1) * DIGEST_SIZE] for k in order
+        )
+        self._sorted = True
+
+    def chop(self, begin, end):
+        """Remove ``[begin, end)`` and the digests of the chunks overlapping it
+
+        The digest of a chunk cut in two no longer matches what is left of
+        it, so that part is kept without one.
+        """
+        super().chop(begin, end)
+        self._sort()
+        i = bisect_left(self._chunk_begins, begin)
+        while i > 0 and self._chunk_ends[i - 1] > begin:
+            i -= 1
+        j = bisect_left(self._chunk_begins, end)
+        del self._chunk_begins[i:j]
+        del self._chunk_ends[i:j]
+        del self._digests[i * DIGEST_SIZE : j * DIGEST_SIZE]
+
+    def chunks(self):
+        """Iterate over the completed chunks in order"""
+        self._sort()
+        k, n = 0, len(self._chunk_begins)
+        for begin, end in zip(self._begins, self._ends):
+            position = begin
+            while k < n and self._chunk_begins[k] < end:
+                if self._chunk_begins[k] > position:
+                    yield Range(position, self._chunk_begins[k])
+                digest = self._digests[k * DIGEST_SIZE : (k + 1) * DIGEST_SIZE]
+                yield Range(
+                    self._chunk_begins[k],
+                    self._chunk_ends[k],
+                    {"md5sum": digest.hex()},
+                )
+                position = self._chunk_ends[k]
+                k += 1
+            if position < end:
+                yield Range(position, end)
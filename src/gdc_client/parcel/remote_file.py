@@ -0,0 +1,237 @@
+import collections
+import io
+import logging
+import threading
+from urllib import parse as urlparse
+
+from gdc_client.defaults import tcp_url
+from gdc_client.parcel.connection import SessionPool
+from gdc_client.parcel.const import (
+    REMOTE_BLOCK_SIZE,
+    REMOTE_CACHE_BLOCKS,
+    REMOTE_READAHEAD_BLOCKS,
+)
+from gdc_client.parcel.download_stream import DownloadStream
+
+log = logging.getLogger("remote")
+
+
+class MemoryBlockCache:
+    """Keep the last ``capacity`` blocks used in memory"""
+
+    def __init__(self, capacity):
+        self.capacity = max(1, capacity)
+        self._blocks = collections.OrderedDict()
+
+    def __contains__(self, index):
+        return index in self._blocks
+
+    def get(self, index):
+        """Return block ``index``, or None if it is not cached"""
+        block = self._blocks.get(index)
+        if block is not None:
+            self._blocks.move_to_end(index)
+        return block
+
+    def put(self, index, block):
+        self._blocks[index] = block
+        self._blocks.move_to_end(index)
+        while len(self._blocks) > self.capacity:
+            self._blocks.popitem(last=False)
+
+    def clear(self):
+        self._blocks.clear()
+
+
+class RemoteFile(io.RawIOBase):
+    """Seekable, read-only file object over range requests.
+
+    Reads are served from an LRU cache of fixed-size blocks, and missing
+    blocks are fetched with range requests on pooled keep-alive
+    connections. Sequential reads double the number of blocks fetched per
+    request, up to ``readahead`` blocks, so that streaming through the file
+    takes few requests while random access only fetches what it reads.
+
+    Any object with the ``get``, ``put``, ``clear`` and ``in`` operations of
+    :class:`MemoryBlockCache` can hold the blocks instead, for example to
+    share them on disk. :meth:`pread` can be called from several threads,
+    which only wait on each other to look up and add cached blocks.
+
+    Wrap it in :class:`io.BufferedReader` or :class:`io.TextIOWrapper` for
+    line-oriented readers::
+
+        with RemoteFile(uuid, token) as f:
+            header = f.read(1024)
+    """
+
+    def __init__(
+        self,
+        url,
+        token=None,
+        block_size=REMOTE_BLOCK_SIZE,
+        cache_blocks=REMOTE_CACHE_BLOCKS,
+        readahead=REMOTE_READAHEAD_BLOCKS,
+        session_pool=None,
+        verify=True,
+        cache=None,
+    ):
+        """
+        :param str url: The url of the file, or the GDC UUID of the file
+        :param str token: optional. The authentication token
+        :param int block_size: optional. Bytes per cached block
+        :param int cache_blocks: optional. Number of blocks kept in the cache
+        :param int readahead: optional. Most blocks fetched per request
+            during sequential reads
+        :param session_pool: optional. The :class:`SessionPool` to request
+            blocks from, a private one by default
+        :param bool verify: optional. Verify the server certificate
+        :param cache: optional. Where blocks are cached, the last
+            ``cache_blocks`` blocks are kept in memory by default
+        """
+        super().__init__()
+        if "/" not in url:
+            url = urlparse.urljoin(tcp_url, f"data/{url}")
+
+        self.block_size = block_size
+        self.readahead = max(1, readahead)
+        self.verify = verify
+        self._own_pool = session_pool is None
+        self.session_pool = SessionPool() if session_pool is None else session_pool
+
+        self.stream = DownloadStream(url, "", token, session_pool=self.session_pool)
+        self.stream.init(verify=verify)
+        self.name = self.stream.name
+        self.size = self.stream.size or 0
+
+        self.position = 0
+        self.requests = 0
+        self.hits = 0
+        self.misses = 0
+        self._cache = MemoryBlockCache(cache_blocks) if cache is None else cache
+        self._lock = threading.Lock()
+        # end of the last read, and blocks to fetch on a sequential miss
+        self._last_end = None
+        self._window = 1
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence ({whence})")
+        if position < 0:
+            raise ValueError(f"Negative seek position {position}")
+        self.position = position
+        return self.position
+
+    def readinto(self, b):
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+        data = self.pread(self.position, len(b))
+        b[: len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+    def close(self):
+        # also runs on garbage collection of a file that failed to open
+        if not self.closed and getattr(self, "_own_pool", False):
+            self.session_pool.close()
+        self._cache.clear()
+        super().close()
+
+    def stats(self):
+        return "remote file {} requests, {} block hits, {} block misses".format(
+            self.requests, self.hits, self.misses
+        )
+
+    def pread(self, offset, n):
+        """Return up to ``n`` bytes at ``offset`` of the file, without
+        moving the file position"""
+        n = min(n, self.size - offset)
+        if n <= 0:
+            return b""
+        first = offset // self.block_size
+        last = (offset + n - 1) // self.block_size
+
+        with self._lock:
+            if offset == self._last_end:
+                self._window = min(2 * self._window, self.readahead)
+            else:
+                self._window = 1
+            self._last_end = offset + n
+            blocks, stop = self._lookup(first, last)
+
+        missing = [index for index in range(first, last + 1) if index not in blocks]
+        if missing:
+            # other reads go on while the missing blocks are fetched
+            fetched = self._fetch(missing[0], stop)
+            with self._lock:
+                self.requests += 1
+                for index, block in fetched.items():
+                    if index <= last:
+                        blocks[index] = block
+                    self._cache.put(index, block)
+
+        data = b"".join(blocks[index] for index in range(first, last + 1))
+        start = offset - first * self.block_size
+        return data[start : start + n]
+
+    def _lookup(self, first, last):
+        """Look up blocks ``first`` to ``last`` in the cache
+
+        :returns: tuple of the dict of the cached blocks by index and the
+            block to stop fetching at: one request from the first missing
+            block reads ahead up to the window or the next block already
+            cached
+        """
+        blocks = {}
+        for index in range(first, last + 1):
+            block = self._cache.get(index)
+            if block is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                blocks[index] = block
+
+        n_blocks = -(-self.size // self.block_size)
+        stop = min(max(last + 1, first + self._window), n_blocks)
+        for index in range(last + 1, stop):
+            if index in self._cache:
+                stop = index
+                break
+        return blocks, stop
+
+    def _fetch(self, first, stop):
+        """Request blocks ``[first, stop)``
+
+        :returns: dict of the blocks by index
+        """
+        begin = first * self.block_size
+        end = min(stop * self.block_size, self.size)
+        r = self.stream.request(self.stream.header(begin, end - 1), verify=self.verify)
+        try:
+            data = r.content
+        finally:
+            r.close()
+        if len(data) != end - begin:
+            raise IOError(
+                f"Expected {end - begin} bytes at offset {begin}, got {len(data)}"
+            )
+
+        blocks = {}
+        for index in range(first, stop):
+            start = (index - first) * self.block_size
+            blocks[index] = data[start : start + self.block_size]
+        return blocks
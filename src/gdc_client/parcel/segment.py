@@ -8,46 +8,264 @@
 
 import logging
 import math
+from multiprocessing import Lock
+from multiprocessing.sharedctypes import RawArray, RawValue
 import os
-import pickle
+import queue
 import random
+import statistics
 import string
 import tempfile
 import time
 import sys
 
-from intervaltree import Interval, IntervalTree
-
+from gdc_client.parcel import state
+from gdc_client.parcel.channel import CompletionChannel
+from gdc_client.parcel.hashing import PrefixHasher
 from gdc_client.parcel.portability import OS_OSX, OS_WINDOWS
+from gdc_client.parcel.rangeset import ChunkRangeSet, Range, RangeSet
+from gdc_client.parcel.throughput import SegmentFailed, SegmentSizer, SegmentStats
+from gdc_client.parcel.verify import CorruptChunk, SegmentVerifier, VerifyDone
 from gdc_client.parcel.utils import (
     get_file_transfer_pbar,
-    get_percentage_pbar,
-    md5sum,
-    mmap_open,
     STRIP,
     check_file_existence_and_size,
     validate_file_md5sum,
 )
-from gdc_client.parcel.const import SAVE_INTERVAL
+from gdc_client.parcel.const import (
+    HEDGE_BUDGET,
+    HEDGE_INTERVAL,
+    HEDGE_MIN_AGE,
+    HEDGE_RATE_FACTOR,
+    JOURNAL_COMPACT_RECORDS,
+    MAX_SEGMENT_SIZE,
+    MIN_SEGMENT_SIZE,
+    REQUEUE_PASSES,
+    SAVE_INTERVAL,
+    SEGMENTS_PER_PROCESS,
+)
 
 if OS_WINDOWS or OS_OSX:
     WINDOWS = True
     from queue import Queue
 else:
     # if we are running on a posix system, then we will be
-    # communicating across processes, and will need
-    # multiprocessing manager
-    from multiprocessing import Manager
+    # communicating across processes. Work is handed out through a
+    # multiprocessing queue and completions come back over a pipe
+    from multiprocessing import Queue
 
     WINDOWS = False
 
 log = logging.getLogger("segment")
 
 
+class SegmentSlot:
+    """A worker's view of its entry in :class:`SegmentSlots`"""
+
+    def __init__(self, slots, index):
+        self.slots = slots
+        self.index = index
+
+    @property
+    def position(self):
+        return self.slots.position[self.index]
+
+    @property
+    def limit(self):
+        return self.slots.limit[self.index]
+
+    def start(self, segment):
+        return self.slots.start(self.index, segment)
+
+    def claim(self, offset, length):
+        return self.slots.claim(self.index, offset, length)
+
+    def release(self):
+        self.slots.release(self.index)
+
+
+class SegmentSlots:
+    """Shared bookkeeping of the segment each worker is downloading.
+
+    Every worker owns one slot holding the next offset it will write
+    (``position``) and the exclusive end of its segment (``limit``). Workers
+    claim each chunk before writing it, and the producer may lower a slot's
+    limit to steal the tail of a segment for an idle worker. Both happen
+    under one lock, so a byte is never claimed by two workers.
+
+    A hedged segment races the straggling slot it was cut from: both are
+    paired up with the same range and the straggler carries on until the
+    hedge delivers its first chunk. The straggler is then stopped where it
+    has got to and the hedge takes over from there, skipping what the
+    straggler wrote in the meantime. The race is only left to the
+    straggler if the hedge gives up first or the straggler finishes.
+    """
+
+    def __init__(self, n_slots):
+        self.lock = Lock()
+        self.position = RawArray("q", n_slots)
+        self.limit = RawArray("q", n_slots)
+        # where and when each slot started its segment
+        self.began = RawArray("q", n_slots)
+        self.started = RawArray("d", n_slots)
+        # the slot each one is racing for the same range, or -1
+        self.partner = RawArray("i", [-1] * n_slots)
+        # whether each slot is the hedge of its race
+        self.hedging = RawArray("b", n_slots)
+        # races the hedges won
+        self.won = RawValue("q", 0)
+
+    def slot(self, index):
+        return SegmentSlot(self, index)
+
+    def start(self, index, segment):
+        """Start downloading ``segment`` in slot ``index``
+
+        :returns: the :class:`Range` the slot may actually write, which is
+            narrowed for a hedged segment to what the straggler it races has
+            not written yet
+        """
+        begin, end = segment.begin, segment.end
+        with self.lock:
+            hedged = (segment.data or {}).get("hedge")
+            if hedged is not None:
+                begin = max(begin, self.position[hedged])
+                end = min(end, self.limit[hedged])
+                if hedged != index and begin < end and self.partner[hedged] < 0:
+                    self.partner[hedged] = index
+                    self.partner[index] = hedged
+                    self.hedging[index] = 1
+                else:
+                    # the straggler got there first
+                    end = begin
+
+            self.position[index] = begin
+            self.limit[index] = end
+            self.began[index] = begin
+            self.started[index] = time.monotonic()
+        return Range(begin, end)
+
+    def claim(self, index, offset, length):
+        """Claim the ``length`` bytes received at ``offset``
+
+        :returns: the :class:`Range` of them that may be written. It starts
+            past ``offset`` when a hedge skips bytes its straggler already
+            wrote, and ends short of ``offset + length`` once the slot has
+            to stop
+        """
+        with self.lock:
+            partner = self.partner[index]
+            if partner >= 0 and self.hedging[index]:
+                # the hedge delivered first, stop the straggler where it
+                # has got to
+                self.limit[partner] = self.position[partner]
+                self._take_over(index, partner)
+                self.won.value += 1
+
+            if self.position[index] >= self.limit[index]:
+                return Range(offset, offset)
+            begin = min(max(offset, self.position[index]), offset + length)
+            end = max(begin, min(offset + length, self.limit[index]))
+            self.position[index] = max(self.position[index], end)
+            return Range(begin, end)
+
+    def release(self, index):
+        with self.lock:
+            self.limit[index] = self.position[index]
+            partner = self.partner[index]
+            if partner >= 0:
+                if self.hedging[index]:
+                    # the straggler carries on alone
+                    self._end_race(index, partner)
+                else:
+                    self._take_over(partner, index)
+
+    def _take_over(self, hedge, straggler):
+        """End a race with the hedge skipping what the straggler wrote"""
+        self.position[hedge] = min(
+            max(self.position[hedge], self.position[straggler]), self.limit[hedge]
+        )
+        self._end_race(hedge, straggler)
+
+    def _end_race(self, hedge, straggler):
+        self.partner[hedge] = self.partner[straggler] = -1
+        self.hedging[hedge] = 0
+
+    def stop(self):
+        """Stop every slot at its next claim"""
+        with self.lock:
+            for i in range(len(self.limit)):
+                self.limit[i] = self.position[i]
+
+    def split(self, min_size, align=1):
+        """Steal the back half of the largest segment still in flight
+
+        :param int min_size: minimum size of either half after the split
+        :param int align: the split point is rounded up to a multiple of
+            this many bytes past the current position of the worker
+        :returns: the stolen :class:`Range` or None
+        """
+        with self.lock:
+            remaining = [
+                self.limit[i] - self.position[i] for i in range(len(self.limit))
+            ]
+            index = max(range(len(remaining)), key=remaining.__getitem__)
+            if remaining[index] < 2 * min_size:
+                return None
+
+            half = remaining[index] // 2
+            mid = self.position[index] + math.ceil(half / align) * align
+            end = self.limit[index]
+            if mid >= end:
+                return None
+
+            self.limit[index] = mid
+            partner = self.partner[index]
+            if partner >= 0:
+                # both copies of a hedged range give up the tail
+                self.limit[partner] = min(self.limit[partner], mid)
+            return Range(mid, end)
+
+    def progress(self, now):
+        """The segments in flight
+
+        :param float now: the current :func:`time.monotonic` time
+        :returns: list of tuples of the slot index, its transfer rate in
+            bytes/sec, the seconds since it started and the bytes it has
+            left, for every busy slot that is not racing a hedge
+        """
+        busy = []
+        with self.lock:
+            for i in range(len(self.limit)):
+                remaining = self.limit[i] - self.position[i]
+                if remaining <= 0 or self.partner[i] >= 0:
+                    continue
+                age = now - self.started[i]
+                rate = (self.position[i] - self.began[i]) / max(age, 1e-3)
+                busy.append((i, rate, age, remaining))
+        return busy
+
+
 class SegmentProducer:
     save_interval = SAVE_INTERVAL
+    # straggling segments requested again per file, 0 to never hedge
+    max_hedges = HEDGE_BUDGET
 
-    def __init__(self, download, n_procs):
+    def __init__(self, download, n_procs, q_work=None, pool=None):
+        """
+        :param download: the initialized :class:`DownloadStream`
+        :param int n_procs: the number of workers downloading segments
+        :param q_work:
+            optional. The queue segments are put on for the workers. By
+            default one that can be shared with worker processes is created
+            and completions come back over :attr:`q_complete`. Engines that
+            run their workers in this process pass their own queue and feed
+            completions to :meth:`handle_report` directly.
+        :param pool:
+            optional. The :class:`WorkerPool` downloading the segments. Its
+            queues and slots are used instead, and its workers are left
+            running once the file is done.
+        """
         assert (
             download.size is not None
         ), "Segment producer passed uninitizalied Download!"
@@ -56,71 +274,137 @@ class SegmentProducer:
         self.n_procs = n_procs
         self.pbar = None
         self.done = False
+        self.q_work = q_work
+        self.q_complete = None
+        self.pool = pool
+        self.hasher = None
 
         # Initialize producer
         self.load_state()
         if not self.done:
+            self._setup_hasher()
             self._setup_pbar()
             self._setup_queues()
             self._setup_work()
             self.schedule()
 
+    def _setup_hasher(self):
+        # Hash the file as its completed prefix grows instead of reading
+        # it all again once the download is over
+        if not self.download.hashes_while_downloading:
+            return
+        self.hasher = PrefixHasher(
+            self.download.temp_path, drop_cache=self.download.preallocate
+        )
+        for interval in self.completed.ranges():
+            self.hasher.add(interval.begin, interval.end)
+
     def _setup_pbar(self):
+        if not self.download.show_progress:
+            return
         self.pbar = get_file_transfer_pbar(self.download.url, self.download.size)
 
     def _setup_work(self):
+        # Cut the work pool into several segments per process, they are
+        # handed out on demand as workers become free
         work_size = self.integrate(self.work_pool)
-        self.block_size = work_size // self.n_procs
+        self.block_size = math.ceil(work_size / (self.n_procs * SEGMENTS_PER_PROCESS))
+        self.block_size = min(max(self.block_size, MIN_SEGMENT_SIZE), MAX_SEGMENT_SIZE)
         self.total_tasks = math.ceil(work_size / self.block_size)
+        self.idle = self.n_procs
+        self.splits = 0
+        self.hedges = 0
+        # races won by hedges before this file, the slots may be shared
+        self.hedges_won_before = self.slots.won.value
+        # (slot, start time) of the segments already hedged
+        self.hedged = set()
+        # requests restarted by the workers because they stalled
+        self.stalls = 0
+        # times the bytes left over by failed segments were put back
+        self.requeues = 0
+        # segments failed on a transient error since then
+        self.failures = 0
+        # why the file was given up, see give_up
+        self.error = None
+        self.since_save = 0
+        # later segments are resized from the observed throughput
+        self.sizer = SegmentSizer(self.block_size, align=self.download.http_chunk_size)
         log.debug(f"Total number of tasks: {self.total_tasks}")
 
     def _setup_queues(self):
+        if self.pool is not None:
+            self.slots = self.pool.slots
+            self.q_work = self.pool.tasks(self.download)
+            self.q_complete = self.pool.q_complete
+            return
+        self.slots = SegmentSlots(self.n_procs)
+        if self.q_work is not None:
+            return
+        self.q_work = Queue()
         if WINDOWS:
-            self.q_work = Queue()
             self.q_complete = Queue()
         else:
-            manager = Manager()
-            self.q_work = manager.Queue()
-            self.q_complete = manager.Queue()
+            self.q_complete = CompletionChannel()
 
-    def integrate(self, itree):
-        return sum([i.end - i.begin for i in itree.items()])
+    def integrate(self, ranges):
+        return ranges.size
 
-    def validate_segment_md5sums(self, path=None):
+    def segments_to_verify(self):
+        """The resumed segments whose md5 sums have to be checked"""
         if not self.download.check_segment_md5sums:
-            return True
-        corrupt_segments = 0
-        intervals = sorted(self.completed.items())
-
-        log.debug(f"Checksumming {self.download.url}:")
-
-        pbar = get_percentage_pbar(len(intervals))
-
-        with mmap_open(path or self.download.path) as data:
-            for interval in pbar(intervals):
-                log.debug(f"Checking segment md5: {interval}")
-                if not interval.data or "md5sum" not in interval.data:
-                    log.error(
-                        STRIP(
-                            """User opted to check segment md5sums on restart.
-                        Previous download did not record segment
-                        md5sums (--no-segment-md5sums)."""
-                        )
-                    )
-                    return
-                chunk = data[interval.begin : interval.end]
-                checksum = md5sum(chunk)
-                if checksum != interval.data.get("md5sum"):
-                    log.debug(
-                        "Redownloading corrupt segment {}, {}.".format(
-                            interval, checksum
-                        )
-                    )
-                    corrupt_segments += 1
-                    self.completed.remove(interval)
+            return []
+
+        intervals = list(self.completed)
+        if any(not i.data or "md5sum" not in i.data for i in intervals):
+            log.error(
+                STRIP(
+                    """User opted to check segment md5sums on restart.
+                Previous download did not record segment
+                md5sums (--no-segment-md5sums)."""
+                )
+            )
+            return []
+        return intervals
 
-        if corrupt_segments:
-            log.warning(f"Redownloading {corrupt_segments} corrupt segments.")
+    def verify_resumed(self, report):
+        """Start checking the md5 sums of the resumed segments
+
+        The check runs in the background while the remaining work is
+        downloaded. Corrupt segments are fed back through ``report`` and
+        downloaded again.
+
+        :param report:
+            called from a background thread with every
+            :class:`CorruptChunk`, then :class:`VerifyDone`. Reports have to
+            end up in :meth:`handle_report`.
+        """
+        if not self.unverified:
+            return
+
+        log.debug(
+            "Checksumming {} resumed segments of {}".format(
+                len(self.unverified), self.download.url
+            )
+        )
+        self.verifying = True
+        self.verifier = SegmentVerifier(
+            self.download.temp_path, self.unverified, report
+        )
+        self.unverified = []
+        self.verifier.start()
+
+    def redownload(self, chunk):
+        """Put a corrupt resumed chunk back into the work pool"""
+        self.completed.chop(chunk.begin, chunk.end)
+        self.work_pool.add(chunk.begin, chunk.end)
+        self.size_complete -= chunk.end - chunk.begin
+        self.print_progress()
+
+        if self.hasher:
+            # the corrupt bytes may have been hashed already, start over
+            self.hasher.close()
+            self._setup_hasher()
+        self.schedule()
 
     def recover_intervals(self) -> bool:
         """Recreate list of completed intervals and calculate remaining work pool
@@ -155,10 +439,10 @@ class SegmentProducer:
         # Attempt to load completed segments from state file
         try:
             with open(self.download.state_path, "rb") as f:
-                self.completed = pickle.load(f)
-            assert isinstance(
-                self.completed, IntervalTree
-            ), f"Bad save state: {self.download.state_path}"
+                self.completed = state.load(f)
+            replayed = state.replay(self.download.journal_path, self.completed)
+            self.journal.records = replayed
+            log.debug(f"Replayed {replayed} records from progress journal")
         except Exception as e:
             # An error has occured while loading state file.
             # Treat as entire file download and recreate temporary file
@@ -198,7 +482,7 @@ class SegmentProducer:
             log.debug("File is complete, will not attempt to re-download file.")
             # downloaded file is correct, set done flag in SegmentProducer
             self.done = True
-            self.work_pool = IntervalTree()
+            self.work_pool = RangeSet()
             return True
 
         if not temporary_file_exists:
@@ -216,29 +500,39 @@ class SegmentProducer:
         )
 
         # If temporary file exists, means that a previous download of the file
-        # failed or was interrupted.
-        # Check completed segments md5 sums of each completed segment
-        self.validate_segment_md5sums(self.download.temp_path)
-        log.debug("Segments checksum validation complete")
+        # failed or was interrupted. The md5 sums of the completed segments
+        # are checked while the remaining work is downloaded
+        self.unverified = self.segments_to_verify()
         self.size_complete = self.integrate(self.completed)
         log.debug(f"size complete: {self.size_complete}")
         # Remove already completed intervals from work_pool
-        for interval in self.completed:
+        for interval in self.completed.ranges():
             self.work_pool.chop(interval.begin, interval.end)
 
         return True
 
     def load_state(self):
         # Establish default intervals
-        self.work_pool = IntervalTree([Interval(0, self.download.size)])
-        self.completed = IntervalTree()
+        self.work_pool = RangeSet([Range(0, self.download.size)])
+        self.completed = ChunkRangeSet()
         self.size_complete = 0
         self.total_tasks = 0
+        # chunks completed since the last checkpoint
+        self.unsaved = []
+        # resumed chunks whose md5 sums still have to be checked
+        self.unverified = []
+        self.verifying = False
+        self.verifier = None
+        self.journal = state.Journal(self.download.journal_path)
 
         if not self.recover_intervals():
             # Recovery failed, treat as new download
             self.download.setup_file()
-            self.completed = IntervalTree()
+            self.completed = ChunkRangeSet()
+            self.journal.reset()
+            # Resuming replays the journal over a snapshot, so start one
+            # right away instead of at the first compaction
+            self.save_state()
             return
 
         log.debug("State loaded successfully")
@@ -253,7 +547,7 @@ class SegmentProducer:
                 delete=False,
             )
             # Write completed state
-            pickle.dump(self.completed, temp)
+            state.dump(self.completed, temp)
             # Make sure all data is written to disk
             temp.flush()
             os.fsync(temp.fileno())
@@ -291,6 +585,10 @@ class SegmentProducer:
                 # atomically rename the file
                 os.rename(temp.name, self.download.state_path)
 
+            # Everything journaled is part of the snapshot now
+            self.journal.reset()
+            self.unsaved = []
+
         except KeyboardInterrupt:
             log.warning(f"Keyboard interrupt. removing temp save file")
             temp.close()
@@ -299,23 +597,115 @@ class SegmentProducer:
             log.error(f"Unable to save state: {str(e)}")
             raise
 
+    def checkpoint(self):
+        """Persist the chunks completed since the last checkpoint
+
+        They are appended to the progress journal, unless the journal has
+        grown past the snapshot it is replayed over, in which case both are
+        compacted into a new snapshot.
+        """
+        records = self.journal.records + len(self.unsaved)
+        if records > max(JOURNAL_COMPACT_RECORDS, len(self.completed)):
+            log.debug(f"Compacting {records} journal records into state file")
+            self.save_state()
+            return
+
+        try:
+            self.journal.append(self.unsaved)
+            self.unsaved = []
+        except Exception as e:
+            log.error(f"Unable to append to progress journal: {str(e)}")
+            raise
+
     def schedule(self):
-        while True:
-            interval = self._get_next_interval()
+        """Hand out segments to idle workers
+
+        Segments come from the work pool first. Once it is empty, the rest
+        of a straggling segment is hedged, or else the largest segment still
+        in flight is split, and goes to the idle worker.
+        """
+        while self.idle and self.error is None:
+            interval = (
+                self._get_next_interval()
+                or self._hedge_segment()
+                or self._split_segment()
+            )
             log.debug(f"Returning interval: {interval}")
             if not interval:
                 return
             self.q_work.put(interval)
+            self.idle -= 1
+
+    def _hedge_segment(self):
+        """Request the rest of the slowest straggling segment again
+
+        A segment straggles once it has been running for ``HEDGE_MIN_AGE``
+        seconds at less than ``HEDGE_RATE_FACTOR`` times the median rate of
+        the connections. Both copies race for the range from the offset the
+        straggler has reached, see :class:`SegmentSlots`.
+        """
+        if self.hedges >= self.max_hedges:
+            return None
+
+        now = time.monotonic()
+        busy = self.slots.progress(now)
+        reference = self.sizer.rate
+        if reference is None and busy:
+            reference = statistics.median(rate for _, rate, _, _ in busy)
+        if not reference:
+            return None
+
+        stragglers = [
+            (remaining / max(rate, 1), index)
+            for index, rate, age, remaining in busy
+            if age >= HEDGE_MIN_AGE
+            and rate < HEDGE_RATE_FACTOR * reference
+            and (index, self.slots.started[index]) not in self.hedged
+        ]
+        if not stragglers:
+            return None
+
+        _, index = max(stragglers)
+        self.hedged.add((index, self.slots.started[index]))
+        self.hedges += 1
+        interval = Range(
+            self.slots.position[index], self.slots.limit[index], {"hedge": index}
+        )
+        log.debug(f"Hedging straggling segment of connection {index}: {interval}")
+        return interval
+
+    def _split_segment(self):
+        interval = self.slots.split(MIN_SEGMENT_SIZE, self.download.http_chunk_size)
+        if interval:
+            self.splits += 1
+            log.debug(f"Split in-flight segment, stealing {interval}")
+        return interval
 
     def _get_next_interval(self):
-        intervals = sorted(self.work_pool.items())
-        if not intervals:
+        interval = self.work_pool.first()
+        if not interval:
             return None
-        interval = intervals[0]
         start = interval.begin
         end = min(interval.end, start + self.block_size)
         self.work_pool.chop(start, end)
-        return Interval(start, end)
+        return Range(start, end)
+
+    def summary(self):
+        return (
+            "{}; split {} in-flight segments; hedged {} straggling segments, "
+            "{} won; restarted {} stalled requests".format(
+                self.sizer.summary(),
+                self.splits,
+                self.hedges,
+                self.hedges_won,
+                self.stalls,
+            )
+        )
+
+    @property
+    def hedges_won(self):
+        """Hedged segments that delivered before their straggler finished"""
+        return self.slots.won.value - self.hedges_won_before
 
     def print_progress(self):
         if not self.pbar:
@@ -336,53 +726,208 @@ class SegmentProducer:
             return os.path.exists(file_path)
 
     def is_complete(self, file_path):
-        return self.integrate(
-            self.completed
-        ) == self.download.size and self.check_file_exists_and_size(file_path)
+        return self.completed.covers(
+            0, self.download.size
+        ) and self.check_file_exists_and_size(file_path)
 
     def finish_download(self):
+        if self.pool is not None:
+            # the workers go on with the next file
+            self.close()
+            return
+
         # Tell the children there is no more work, each child should
-        # pull one NoneType from the queue and exit
+        # pull one NoneType from the queue and exit. Whoever started them
+        # joins them. A child still writing once the completion channel is
+        # closed drops its reports
         for i in range(self.n_procs):
             self.q_work.put(None)
 
-        # Wait for all the children to exit by checking to make sure
-        # that everyone has taken their NoneType from the queue.
-        # Otherwise, the segment producer will exit before the
-        # children return, causing them to read from a closed queue
-        log.debug("Waiting for children to report")
-        while not self.q_work.empty():
-            time.sleep(0.1)
+        self.close()
+
+    def finish_md5sum(self):
+        """Finish the streamed whole-file md5 and record it on the download"""
+        if self.hasher:
+            self.download.streamed_md5sum = self.hasher.hexdigest()
+
+    def close(self):
+        if self.verifier:
+            self.verifier.close()
+
+        if isinstance(self.q_complete, CompletionChannel) and self.pool is None:
+            self.q_complete.close()
+
+        if self.hasher:
+            self.hasher.close()
+
+        self.journal.close()
 
         # Finish the progressbar
-        self.pbar.finish()
+        if self.pbar:
+            self.pbar.finish()
+
+    @property
+    def finished(self):
+        """True once every worker is idle, there is no work left to hand out
+        and the resumed segments are verified"""
+        return self.idle == self.n_procs and not self.verifying
+
+    @property
+    def downloaded(self):
+        """True once every byte is downloaded and the resumed segments are
+        verified, even if some workers have not reported back yet"""
+        return not self.verifying and self.completed.size >= self.download.size
+
+    def handle_report(self, interval):
+        """Account for one report from a worker
+
+        :param interval:
+            a completed chunk :class:`Interval`, the
+            :class:`SegmentStats` (:class:`SegmentFailed` or None on
+            failure) of a finished task, or
+            a :class:`CorruptChunk` or :class:`VerifyDone` from the
+            verification of resumed segments
+        """
+        # Once a process completes a tasks (sucess or failure),
+        # it will return its segment stats (or None) to main process
+        # to indicate that it is free for more work
+        if isinstance(interval, CorruptChunk):
+            log.debug(f"Redownloading corrupt segment {interval}")
+            self.redownload(interval)
+            return
+
+        if isinstance(interval, VerifyDone):
+            self.verifying = False
+            if interval.corrupt:
+                log.warning(f"Redownloading {interval.corrupt} corrupt segments.")
+            log.debug(f"Checked {interval.checked} resumed segments")
+            return
+
+        if interval is None or isinstance(interval, (SegmentStats, SegmentFailed)):
+            if self.pool is not None:
+                self.pool.account(interval)
+            if isinstance(interval, SegmentStats):
+                self.block_size = self.sizer.record(interval)
+                self.stalls += interval.stalls
+            elif isinstance(interval, SegmentFailed):
+                if interval.retryable:
+                    self.failures += 1
+                else:
+                    self.give_up(interval.error)
+            self.idle += 1
+            if self.idle == self.n_procs and not self.work_pool:
+                self.requeue_missing()
+            self.schedule()
+            return
+
+        self.completed.add(
+            interval.begin, interval.end, (interval.data or {}).get("md5sum")
+        )
+        self.unsaved.append(interval)
+        if self.hasher:
+            self.hasher.add(interval.begin, interval.end)
+
+        # Get bytes downloaded and update progress bar
+        this_size = interval.end - interval.begin
+        self.size_complete += this_size
+        self.since_save += this_size
+
+        self.print_progress()
+
+        if self.since_save >= self.save_interval:
+            self.since_save = 0
+            self.checkpoint()
+
+    def give_up(self, error):
+        """Stop downloading the file, the server refused it
+
+        No more segments are handed out and the busy workers stop at their
+        next chunk. :meth:`check_failure` then raises ``error``.
+        """
+        if self.error is not None:
+            return
+        log.debug(f"Giving up the file: {error}")
+        self.error = error
+        self.work_pool = RangeSet()
+        self.slots.stop()
+
+    def check_failure(self):
+        """Raise the error the file was given up on, if any
+
+        Nothing is left behind of a file given up before any of it was
+        downloaded.
+        """
+        if self.error is None:
+            return
+        if not self.completed:
+            for path in (
+                self.download.temp_path,
+                self.download.state_path,
+                self.download.journal_path,
+            ):
+                if os.path.isfile(path):
+                    os.remove(path)
+        raise RuntimeError(self.error)
+
+    def requeue_missing(self):
+        """Put the bytes no worker has written back into the work pool
+
+        Once every worker is idle, whatever is missing was left over by
+        segments that ran out of retries. Only the bytes of segments that
+        failed on a transient error are downloaded again, up to
+        ``REQUEUE_PASSES`` times per file. A file the server refuses is
+        given up instead.
+        """
+        if (
+            self.verifying
+            or self.error is not None
+            or not self.failures
+            or self.requeues >= REQUEUE_PASSES
+        ):
+            return
+        missing = []
+        gap = self.completed.next_gap(0, self.download.size)
+        while gap:
+            missing.append(gap)
+            gap = self.completed.next_gap(gap.end, self.download.size)
+        if not missing:
+            return
+
+        self.requeues += 1
+        self.failures = 0
+        size = sum(gap.end - gap.begin for gap in missing)
+        log.warning(f"Downloading {size} missing bytes again")
+        for gap in missing:
+            self.work_pool.add(gap.begin, gap.end)
 
     def wait_for_completion(self):
         try:
-            since_save = 0
-            num_tasks_completed = 0
-            while num_tasks_completed != self.total_tasks:
-                while since_save < self.save_interval:
-                    interval = self.q_complete.get()
-                    # Once a process completes a tasks (sucess or failure),
-                    # it will return a sentinel value (None) to main process
-                    # to indicate that a task was completed
-                    if interval is None:
-                        num_tasks_completed += 1
-                        if num_tasks_completed == self.total_tasks:
-                            break
-                        continue
-
-                    self.completed.add(interval)
-
-                    # Get bytes downloaded and update progress bar
-                    this_size = interval.end - interval.begin
-                    self.size_complete += this_size
-                    since_save += this_size
-
-                    self.print_progress()
-
-                since_save = 0
-                self.save_state()
+            self.verify_resumed(self.q_complete.put)
+            deadline = None
+            next_check = time.monotonic() + HEDGE_INTERVAL
+            while not self.finished:
+                now = time.monotonic()
+                if self.downloaded:
+                    # The busy workers have nothing left to write, but one
+                    # that lost a hedged race may be stuck on a stalled
+                    # connection. Give them a moment to report
+                    deadline = deadline or now + HEDGE_INTERVAL
+                    if now >= deadline:
+                        log.debug(f"Not waiting for {self.n_procs - self.idle} workers")
+                        break
+                if now >= next_check:
+                    # look for stragglers now and then, not only when a
+                    # worker becomes idle
+                    next_check = now + HEDGE_INTERVAL
+                    self.schedule()
+                try:
+                    report = self.q_complete.get(timeout=next_check - now)
+                except queue.Empty:
+                    continue
+                self.handle_report(report)
+
+            self.save_state()
+            self.finish_md5sum()
         finally:
             self.finish_download()
+        self.check_failure()
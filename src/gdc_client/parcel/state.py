@@ -0,0 +1,163 @@
+import logging
+import os
+import pickle
+import struct
+
+from intervaltree import IntervalTree
+
+from gdc_client.exceptions import StateError
+from gdc_client.parcel.rangeset import ChunkRangeSet
+
+# The resume state (``<name>.parcel``) is the set of completed chunks with
+# their md5 digests, written as a fixed header and one fixed-size record
+# per chunk:
+#   header: magic (8 bytes), version (2), reserved (2), record count (8)
+#   record: offset (8), length (8), md5 digest (16, all zero if unknown)
+# Older clients pickled an IntervalTree instead. Those files are still read
+# and are rewritten in this format on the next save.
+# Chunks completed since the last snapshot are appended as the same records
+# to a journal (``<name>.parcel.journal``) after a header of magic (8 bytes),
+# version (2) and reserved (2).
+MAGIC = b"GDCPRCL\x00"
+VERSION = 1
+HEADER = struct.Struct("<8sHHQ")
+RECORD = struct.Struct("<QQ16s")
+NO_DIGEST = bytes(16)
+JOURNAL_MAGIC = b"GDCPRCLJ"
+JOURNAL_HEADER = struct.Struct("<8sHH")
+
+log = logging.getLogger("state")
+
+
+def _digest(interval):
+    if interval.data and interval.data.get("md5sum"):
+        return bytes.fromhex(interval.data["md5sum"])
+    return NO_DIGEST
+
+
+def _md5sum(digest):
+    return None if digest == NO_DIGEST else digest.hex()
+
+
+def dump(completed, f):
+    """Write the completed chunks to the binary file object ``f``"""
+    intervals = list(completed)
+    f.write(HEADER.pack(MAGIC, VERSION, 0, len(intervals)))
+    f.write(
+        b"".join(RECORD.pack(i.begin, i.end - i.begin, _digest(i)) for i in intervals)
+    )
+
+
+def load(f):
+    """Read the completed chunks from the binary file object ``f``
+
+    :returns: a :class:`ChunkRangeSet` of the completed chunks
+    :raises StateError: if the file is not a valid state file
+    """
+    header = f.read(HEADER.size)
+    if not header.startswith(MAGIC):
+        f.seek(0)
+        return _load_legacy(f)
+
+    if len(header) < HEADER.size:
+        raise StateError("Truncated state file header")
+    _, version, _, count = HEADER.unpack(header)
+    if version != VERSION:
+        raise StateError(f"Unsupported state file version {version}")
+
+    data = f.read(count * RECORD.size)
+    if len(data) != count * RECORD.size:
+        raise StateError(
+            f"Truncated state file, expected {count} records, "
+            f"found {len(data) // RECORD.size}"
+        )
+
+    completed = ChunkRangeSet()
+    for offset, length, digest in RECORD.iter_unpack(data):
+        completed.add(offset, offset + length, _md5sum(digest))
+    return completed
+
+
+def _load_legacy(f):
+    completed = pickle.load(f)
+    if not isinstance(completed, IntervalTree):
+        raise StateError("Bad save state")
+    log.debug("Read legacy pickled state, it will be migrated on the next save")
+    return ChunkRangeSet(sorted(completed))
+
+
+class Journal:
+    """Append-only log of the chunks completed since the last snapshot.
+
+    A checkpoint only appends the newly completed chunks as state records,
+    so its cost does not grow with the progress of the download. The
+    producer writes a full snapshot instead, which resets the journal, once
+    the journal holds more records than the snapshot would.
+    """
+
+    def __init__(self, path, records=0):
+        self.path = path
+        self.records = records
+        self._f = None
+
+    def append(self, intervals):
+        """Durably record ``intervals`` as completed"""
+        if not intervals:
+            return
+        if self._f is None:
+            self._f = open(self.path, "ab")
+            if not self._f.tell():
+                self._f.write(JOURNAL_HEADER.pack(JOURNAL_MAGIC, VERSION, 0))
+
+        self._f.write(
+            b"".join(
+                RECORD.pack(i.begin, i.end - i.begin, _digest(i)) for i in intervals
+            )
+        )
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self.records += len(intervals)
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def reset(self):
+        """Drop the journal once everything in it is part of a snapshot"""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.records = 0
+
+
+def replay(path, completed):
+    """Add the chunks recorded in the journal at ``path`` to ``completed``
+
+    A record torn by a crash is cut off so that later appends stay aligned.
+
+    :returns: the number of records replayed
+    """
+    if not os.path.isfile(path):
+        return 0
+
+    with open(path, "r+b") as f:
+        header = f.read(JOURNAL_HEADER.size)
+        if len(header) < JOURNAL_HEADER.size:
+            f.truncate(0)
+            return 0
+        magic, version, _ = JOURNAL_HEADER.unpack(header)
+        if magic != JOURNAL_MAGIC or version != VERSION:
+            raise StateError(f"Bad journal {path}")
+
+        data = f.read()
+        usable = len(data) - len(data) % RECORD.size
+        if usable != len(data):
+            log.debug(f"Dropping torn journal record from {path}")
+            f.truncate(JOURNAL_HEADER.size + usable)
+
+    records = 0
+    for offset, length, digest in RECORD.iter_unpack(data[:usable]):
+        completed.add(offset, offset + length, _md5sum(digest))
+        records += 1
+    return records
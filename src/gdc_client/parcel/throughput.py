@@ -0,0 +1,177 @@
+import logging
+import math
+import statistics
+import time
+from typing import NamedTuple
+
+from gdc_client.exceptions import StalledTransferError
+from gdc_client.parcel.const import (
+    LATENCY_FACTOR,
+    MAX_SEGMENT_SIZE,
+    MB,
+    MIN_SEGMENT_SIZE,
+    SEGMENT_TARGET_DURATION,
+)
+
+log = logging.getLogger("throughput")
+
+
+class SegmentStats(NamedTuple):
+    """What a worker reports back once it is done with a segment"""
+
+    slot: int
+    written: int
+    elapsed: float
+    latency: float
+    # requests restarted because they stalled
+    stalls: int = 0
+    # requests a forked worker made through its copy of the session pool
+    session_hits: int = 0
+    session_misses: int = 0
+
+
+class SegmentFailed(NamedTuple):
+    """What a worker reports back when a segment failed"""
+
+    slot: int
+    error: str
+    # False when requesting the bytes again will fail the same way
+    retryable: bool = True
+    session_hits: int = 0
+    session_misses: int = 0
+
+
+class LowSpeedMonitor:
+    """Detect a transfer running below ``limit`` bytes/sec.
+
+    The bytes received are counted over consecutive windows of ``window``
+    seconds. A window that ends with less than ``limit`` bytes/sec raises
+    :class:`StalledTransferError`. A ``limit`` of 0 never does.
+    """
+
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self.window_start = time.monotonic()
+        self.window_bytes = 0
+
+    def update(self, n_bytes):
+        """Account for ``n_bytes`` more bytes received
+
+        :raises StalledTransferError: if the transfer has stalled
+        """
+        if not self.limit:
+            return
+        self.window_bytes += n_bytes
+        now = time.monotonic()
+        elapsed = now - self.window_start
+        if elapsed < self.window:
+            return
+
+        rate = self.window_bytes / elapsed
+        self.window_start = now
+        self.window_bytes = 0
+        if rate < self.limit:
+            raise StalledTransferError(
+                "Transfer stalled at {:.0f} B/s over {:.0f} s".format(rate, elapsed)
+            )
+
+
+class SegmentSizer:
+    """Choose segment sizes from the throughput observed on each connection.
+
+    Every finished segment updates a moving average of the transfer rate and
+    request latency of the connection (worker slot) that downloaded it. The
+    next segments are sized so that a connection running at the median rate
+    stays busy for ``target_duration`` seconds, and for at least
+    ``LATENCY_FACTOR`` request round trips, which keeps segments small on
+    slow or lossy links and large on fast, clean ones.
+    """
+
+    alpha = 0.3
+
+    def __init__(
+        self,
+        initial_size,
+        target_duration=SEGMENT_TARGET_DURATION,
+        min_size=MIN_SEGMENT_SIZE,
+        max_size=MAX_SEGMENT_SIZE,
+        align=1,
+    ):
+        self.size = initial_size
+        self.target_duration = target_duration
+        self.min_size = min_size
+        self.max_size = max_size
+        self.align = align
+        self.rates = {}
+        self.latencies = {}
+        self.segments = 0
+        self.chosen = [initial_size]
+
+    def _average(self, averages, slot, value):
+        previous = averages.get(slot)
+        if previous is None:
+            averages[slot] = value
+        else:
+            averages[slot] = self.alpha * value + (1 - self.alpha) * previous
+
+    def record(self, stats):
+        """Fold a finished segment into the averages and resize the next ones
+
+        :param SegmentStats stats: the report of the worker
+        :returns: the size to use for the next segments
+        """
+        if stats.written <= 0 or stats.elapsed <= 0:
+            return self.size
+
+        transfer_time = max(stats.elapsed - stats.latency, 1e-3)
+        rate = stats.written / transfer_time
+        self._average(self.rates, stats.slot, rate)
+        self._average(self.latencies, stats.slot, stats.latency)
+        self.segments += 1
+
+        self.size = self._next_size()
+        self.chosen.append(self.size)
+        log.debug(
+            "Connection {}: {} B at {:.2f} MB/s, {:.0f} ms latency; "
+            "next segment size {} B".format(
+                stats.slot,
+                stats.written,
+                rate / MB,
+                stats.latency * 1000,
+                self.size,
+            )
+        )
+        return self.size
+
+    @property
+    def rate(self):
+        """Median per-connection transfer rate in bytes/sec"""
+        return statistics.median(self.rates.values()) if self.rates else None
+
+    @property
+    def latency(self):
+        """Median per-connection request latency in seconds"""
+        return statistics.median(self.latencies.values()) if self.latencies else None
+
+    def _next_size(self):
+        duration = max(self.target_duration, LATENCY_FACTOR * self.latency)
+        size = self.rate * duration
+        size = math.ceil(size / self.align) * self.align
+        return int(min(max(size, self.min_size), self.max_size))
+
+    def summary(self):
+        if not self.segments:
+            return "No segment throughput recorded"
+        return (
+            "{} segments over {} connections: median {:.2f} MB/s per connection, "
+            "{:.0f} ms latency, segment sizes {}-{} B (last {} B)".format(
+                self.segments,
+                len(self.rates),
+                self.rate / MB,
+                self.latency * 1000,
+                min(self.chosen),
+                max(self.chosen),
+                self.size,
+            )
+        )
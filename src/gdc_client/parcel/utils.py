@@ -7,11 +7,13 @@
 # ***************************************************************************************
 
 from contextlib import contextmanager
+import errno
 import hashlib
 import logging
 import mmap
 import os
 import requests
+import shutil
 import stat
 import sys
 
@@ -27,6 +29,12 @@ from gdc_client.exceptions import MD5ValidationError
 from gdc_client.parcel.download_stream import DownloadStream
 from gdc_client.parcel import utils
 
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows
+    fcntl = None
+
 # Logging
 log = logging.getLogger("utils")
 
@@ -53,6 +61,7 @@ def get_file_transfer_pbar(
     maxval: int,
     start_val: int = 0,
     desc: str = "Downloading",
+    fd=None,
 ) -> ProgressBar:
     """Create and initialize a custom progressbar
 
@@ -61,6 +70,7 @@ def get_file_transfer_pbar(
         maxval: maximum value for the progress bar
         start_val: initial value for the progress bar
         desc: additional debug message before the file_id
+        fd: stream the progress bar is drawn on, stdout by default
 
     Returns:
         ProgressBar: progress bar instance
@@ -80,7 +90,7 @@ def get_file_transfer_pbar(
         ],
         max_value=maxval,
         initial_value=start_val,
-        fd=sys.stdout,
+        fd=fd or sys.stdout,
     )
     pbar.start()
     return pbar
@@ -116,6 +126,34 @@ def write_offset(path, data, offset):
         f.write(data)
 
 
+def open_for_positional_writes(path):
+    """Open ``path`` for positional writes and return the raw file descriptor
+
+    The descriptor is meant to be held for the lifetime of a segment so that
+    every chunk can be written with :func:`pwrite` instead of reopening the
+    file for each write.
+    """
+    return os.open(path, os.O_RDWR | getattr(os, "O_BINARY", 0))
+
+
+def pwrite(fd, data, offset):
+    """Write all of ``data`` to ``fd`` starting at ``offset``
+
+    Uses ``os.pwrite`` where available so that the shared file position is
+    never moved, and falls back to seek + write on platforms without it
+    (Windows).
+    """
+    view = memoryview(data)
+    while view:
+        if hasattr(os, "pwrite"):
+            written = os.pwrite(fd, view, offset)
+        else:
+            os.lseek(fd, offset, os.SEEK_SET)
+            written = os.write(fd, view)
+        view = view[written:]
+        offset += written
+
+
 def read_offset(path, offset, size):
     with open(path, "r+b") as f:
         f.seek(offset)
@@ -132,6 +170,131 @@ def set_file_length(path, length):
         f.truncate()
 
 
+def preallocate_file(path, length):
+    """Create ``path`` with ``length`` bytes of disk space reserved up front
+
+    Unlike :func:`set_file_length`, which leaves a sparse file behind, this
+    allocates real extents with ``posix_fallocate`` so that writes at random
+    offsets do not fragment the file and a full disk is noticed before the
+    download starts. Falls back to :func:`set_file_length` where the
+    platform or filesystem cannot preallocate.
+
+    :raises OSError: with ``errno.ENOSPC`` if there is not enough space
+    """
+    if not hasattr(os, "posix_fallocate"):
+        log.debug("Preallocation is not supported on this platform")
+        return set_file_length(path, length)
+
+    fd = os.open(path, os.O_RDWR | os.O_CREAT)
+    try:
+        os.posix_fallocate(fd, 0, length)
+        os.ftruncate(fd, length)
+    except OSError as e:
+        if e.errno == errno.ENOSPC:
+            os.close(fd)
+            os.remove(path)
+            raise OSError(
+                errno.ENOSPC,
+                f"Not enough disk space to preallocate {length} bytes",
+                path,
+            )
+        log.debug(f"Unable to preallocate {path}: {str(e)}")
+        os.close(fd)
+        return set_file_length(path, length)
+    os.close(fd)
+
+
+# ioctl cloning a whole file on Linux file systems with copy-on-write extents
+FICLONE = 0x40049409
+
+
+def clone_file(src, dst):
+    """Make ``dst`` a copy of ``src`` that takes no extra disk space if
+    possible
+
+    ``src`` is reflinked where the file system supports copy-on-write
+    clones, otherwise hardlinked, and copied as a last resort, e.g. across
+    file systems. ``dst`` is replaced atomically.
+
+    :returns: how the file was copied, ``reflink``, ``hardlink`` or ``copy``
+    """
+    temp_path = f"{dst}.{os.getpid()}.clone"
+    try:
+        method = _clone(src, temp_path)
+        os.replace(temp_path, dst)
+    finally:
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+    return method
+
+
+def _clone(src, dst):
+    if fcntl is not None:
+        try:
+            with open(src, "rb") as s, open(dst, "wb") as d:
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+            return "reflink"
+        except OSError as e:
+            log.debug(f"Unable to reflink {src}: {str(e)}")
+            if os.path.lexists(dst):
+                os.remove(dst)
+
+    try:
+        os.link(src, dst)
+        return "hardlink"
+    except OSError as e:
+        log.debug(f"Unable to hardlink {src}: {str(e)}")
+
+    shutil.copyfile(src, dst)
+    return "copy"
+
+
+# Eviction removes entries until a cache is down to this fraction of its size
+EVICT_TO = 0.9
+
+
+def evict_least_recently_used(entries, max_size, remove=os.remove):
+    """Remove the least recently used entries of a cache holding more than
+    ``max_size`` bytes, until it is down to ``EVICT_TO`` of it
+
+    :param entries: the last use, size and path of every cached entry
+    :param remove: optional. Removes the entry at a path, an entry it
+        raises :class:`OSError` for is kept
+    :returns: the number of entries removed and the bytes left cached
+    """
+    entries = sorted(entries)
+    size = sum(entry_size for _, entry_size, _ in entries)
+    removed = 0
+    if size <= max_size:
+        return removed, size
+
+    target = max_size * EVICT_TO
+    for _, entry_size, path in entries:
+        if size <= target:
+            break
+        try:
+            remove(path)
+        except OSError:
+            continue
+        size -= entry_size
+        removed += 1
+    return removed, size
+
+
+def fadvise(fd, offset, length, advice):
+    """Give the kernel a hint about how a range of a file will be accessed
+
+    :param str advice: name of the ``os.POSIX_FADV_*`` constant. The hint
+        is silently skipped on platforms without ``posix_fadvise``.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        os.posix_fadvise(fd, offset, length, getattr(os, advice))
+    except OSError as e:
+        log.debug(f"Unable to set {advice}: {str(e)}")
+
+
 def remove_partial_extension(path):
     try:
         if not path.endswith(".partial"):
@@ -195,12 +358,16 @@ def md5sum_whole_file(fname):
     return hash_md5.hexdigest()
 
 
-def validate_file_md5sum(stream: DownloadStream, file_path: str) -> None:
+def validate_file_md5sum(
+    stream: DownloadStream, file_path: str, md5sum: str = None
+) -> None:
     """Function to validate md5sum for given file if prerequisite checks pass
 
     Args:
         stream: initialized DownloadStream object
         file_path: file to validate
+        md5sum: md5sum of the file computed while it was downloaded, the
+                file is only read again if not given
     Raises:
         MD5ValidationError: if correct DownloadStream flags are not set or
                             md5sum does not have given md5sum
@@ -217,7 +384,7 @@ def validate_file_md5sum(stream: DownloadStream, file_path: str) -> None:
         raise MD5ValidationError(
             "Cannot validate this file since the server did not provide an md5sum. Use the '--no-file-md5sum' option to ignore this error."
         )
-    if md5sum_whole_file(file_path) != stream.md5sum:
+    if (md5sum or md5sum_whole_file(file_path)) != stream.md5sum:
         raise MD5ValidationError("File checksum is invalid")
 
 
@@ -0,0 +1,117 @@
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import threading
+from typing import NamedTuple
+
+from gdc_client.parcel.const import VERIFY_THREADS
+from gdc_client.parcel.utils import fadvise, md5sum
+
+log = logging.getLogger("verify")
+
+
+class CorruptChunk(NamedTuple):
+    """A resumed chunk whose content does not match its recorded md5sum"""
+
+    begin: int
+    end: int
+
+
+class VerifyDone(NamedTuple):
+    """Reported once every resumed chunk has been checked"""
+
+    checked: int
+    corrupt: int
+
+
+class SegmentVerifier:
+    """Check the md5sums of resumed chunks while the download goes on.
+
+    The chunks recorded by an interrupted download are read in offset order,
+    with a sequential read-ahead hint, and hashed on a thread pool (hashlib
+    releases the GIL on large buffers). Every chunk that does not match is
+    passed to ``report`` as a :class:`CorruptChunk`, followed by a single
+    :class:`VerifyDone`. ``report`` is called from a background thread.
+    """
+
+    def __init__(self, path, intervals, report, threads=VERIFY_THREADS):
+        self.path = path
+        self.intervals = intervals
+        self.report = report
+        self.threads = threads
+        self._stopped = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def join(self):
+        """Wait until every chunk has been checked"""
+        self._thread.join()
+
+    def close(self):
+        """Stop checking and wait for the background thread to exit"""
+        self._stopped = True
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _read(self, fd, length, offset):
+        if hasattr(os, "pread"):
+            return os.pread(fd, length, offset)
+        with self._lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            return os.read(fd, length)
+
+    def _check(self, fd, interval):
+        data = self._read(fd, interval.end - interval.begin, interval.begin)
+        return md5sum(data) == interval.data["md5sum"]
+
+    def _run(self):
+        try:
+            fd = os.open(self.path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        except OSError as e:
+            # nothing can be read back, download it all again
+            log.error(f"Unable to check resumed segments: {str(e)}")
+            for interval in self.intervals:
+                self.report(CorruptChunk(interval.begin, interval.end))
+            self.report(VerifyDone(0, len(self.intervals)))
+            return
+
+        try:
+            fadvise(fd, 0, 0, "POSIX_FADV_SEQUENTIAL")
+            checked, corrupt = self._check_all(fd)
+        finally:
+            os.close(fd)
+
+        if not self._stopped:
+            self.report(VerifyDone(checked, corrupt))
+
+    def _check_all(self, fd):
+        checked = corrupt = 0
+        intervals = iter(self.intervals)
+        pending = collections.deque()
+        with ThreadPoolExecutor(self.threads) as pool:
+            while not self._stopped:
+                # keep a bounded window of reads in flight, in offset order
+                while len(pending) < 4 * self.threads:
+                    interval = next(intervals, None)
+                    if interval is None:
+                        break
+                    pending.append((interval, pool.submit(self._check, fd, interval)))
+                if not pending:
+                    break
+
+                interval, future = pending.popleft()
+                try:
+                    ok = future.result()
+                except Exception as e:
+                    log.debug(f"Unable to check segment {interval}: {str(e)}")
+                    ok = False
+                checked += 1
+                if not ok:
+                    log.debug(f"Redownloading corrupt segment {interval}")
+                    corrupt += 1
+                    self.report(CorruptChunk(interval.begin, interval.end))
+        return checked, corrupt
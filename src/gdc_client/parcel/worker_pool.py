@@ -0,0 +1,186 @@
+import logging
+import os
+import queue
+import time
+
+from gdc_client.exceptions import retryable
+from gdc_client.parcel.channel import CompletionChannel
+from gdc_client.parcel.const import HEDGE_INTERVAL
+from gdc_client.parcel.portability import Process
+from gdc_client.parcel.segment import WINDOWS, Queue, SegmentProducer, SegmentSlots
+from gdc_client.parcel.throughput import SegmentFailed, SegmentStats
+
+log = logging.getLogger("worker_pool")
+
+
+class _FileTasks:
+    """Gives the pool's work queue the ``put`` interface the producer of one
+    file hands its segments to"""
+
+    def __init__(self, q_work, stream):
+        self.q_work = q_work
+        self.stream = stream
+
+    def put(self, segment):
+        self.q_work.put((self.stream, segment))
+
+    def empty(self):
+        return self.q_work.empty()
+
+
+class WorkerPool:
+    """Download workers reused for the segments of every file.
+
+    The workers are started once and take ``(stream, segment)`` tasks for
+    any file from a shared queue. Each one owns a slot of the pool's
+    :class:`SegmentSlots` and keeps its keep-alive connections in the
+    client's session pool from one file to the next. Completions come back
+    over a single :class:`CompletionChannel`, which only one file uses at a
+    time.
+
+    A forked worker counts its requests in its own copy of the session pool,
+    so it sends the hits and misses of each task along with the task's report
+    and the pool adds them to the client's, see :meth:`account`.
+
+    A worker that lost a hedged race may still be stuck on a stalled
+    connection once its file is done. Its late reports would be taken for
+    the next file's, so the pool is retired instead, see :meth:`settle`.
+    """
+
+    def __init__(self, n_procs, session_pool, debug=False):
+        """
+        :param int n_procs: the number of workers
+        :param session_pool: the :class:`SessionPool` the workers request
+            segments through
+        :param bool debug: optional. Let a worker die on the first error
+        """
+        self.n_procs = n_procs
+        self.session_pool = session_pool
+        self.debug = debug
+        self.slots = SegmentSlots(n_procs)
+        self.q_work = Queue()
+        self.q_complete = queue.Queue() if WINDOWS else CompletionChannel()
+        self.retired = False
+        self._pid = os.getpid()
+        self.workers = [
+            Process(target=self._work, args=(self.slots.slot(i),))
+            for i in range(n_procs)
+        ]
+        for worker in self.workers:
+            worker.start()
+        log.debug(f"Started {n_procs} download workers")
+
+    @property
+    def usable(self):
+        """True while every worker is alive and none is stuck"""
+        return not self.retired and all(w.is_alive() for w in self.workers)
+
+    def producer(self, stream, n_procs):
+        """A :class:`SegmentProducer` handing the segments of ``stream`` to
+        at most ``n_procs`` of the workers at a time"""
+        return SegmentProducer(stream, min(n_procs, self.n_procs), pool=self)
+
+    def tasks(self, stream):
+        """The queue the segments of ``stream`` are put on"""
+        return _FileTasks(self.q_work, stream)
+
+    def settle(self, outstanding, timeout=HEDGE_INTERVAL):
+        """Wait for the tasks of a finished file to be reported
+
+        :param int outstanding: tasks handed out that were not reported
+        :param float timeout: seconds to wait for them
+        :returns: True if every worker is idle, otherwise the pool is
+            retired
+        """
+        deadline = time.monotonic() + timeout
+        while outstanding > 0:
+            try:
+                report = self.q_complete.get(
+                    timeout=max(0, deadline - time.monotonic())
+                )
+            except queue.Empty:
+                log.debug(f"Retiring the workers, {outstanding} are stuck")
+                self.close()
+                return False
+            # chunks completed after the file was done are not needed
+            if report is None or isinstance(report, (SegmentStats, SegmentFailed)):
+                self.account(report)
+                outstanding -= 1
+        return True
+
+    def account(self, report):
+        """Add the session pool counts of a worker's task report to the
+        client's session pool"""
+        if report is not None:
+            self.session_pool.add(report.session_hits, report.session_misses)
+
+    def _session_counts(self, reported):
+        """The session pool hits and misses of this worker since
+        ``reported``, and the counts to compare the next task's with"""
+        pool = self.session_pool
+        if os.getpid() == self._pid:
+            # threaded workers count in the client's session pool already
+            return (0, 0), reported
+        counts = (pool.hits, pool.misses)
+        return (counts[0] - reported[0], counts[1] - reported[1]), counts
+
+    def _work(self, slot):
+        reported = (self.session_pool.hits, self.session_pool.misses)
+        while True:
+            task = self.q_work.get()
+            if task is None:
+                log.debug(f"Worker {self.session_pool.stats()}")
+                return
+            stream, segment = task
+            # streams are pickled without their sessions
+            stream.session_pool = self.session_pool
+            try:
+                began = time.time()
+                written, latency, stalls = stream.write_segment(
+                    segment, self.q_complete, slot=slot
+                )
+                counts, reported = self._session_counts(reported)
+                # report how it went to the producer, which also tells it the
+                # worker is free for more work
+                self.q_complete.put(
+                    SegmentStats(
+                        slot.index,
+                        written,
+                        time.time() - began,
+                        latency,
+                        stalls,
+                        *counts,
+                    )
+                )
+            except Exception as e:
+                # the task is "finished" even though write_segment failed
+                counts, reported = self._session_counts(reported)
+                self.q_complete.put(
+                    SegmentFailed(slot.index, str(e), retryable(e), *counts)
+                )
+                if self.debug:
+                    raise
+                log.error(f"Download aborted: {str(e)}")
+
+    def close(self):
+        """Stop the workers, without waiting for one stuck on a stalled
+        connection"""
+        if self.retired:
+            return
+        self.retired = True
+        for _ in self.workers:
+            self.q_work.put(None)
+        # idle workers exit at once, the stuck ones get HEDGE_INTERVAL
+        # seconds between them
+        deadline = time.monotonic() + HEDGE_INTERVAL
+        for worker in self.workers:
+            worker.join(max(0, deadline - time.monotonic()))
+            if worker.is_alive() and hasattr(worker, "terminate"):
+                log.debug("Stopping a worker stuck on a stalled connection")
+                worker.terminate()
+                worker.join()
+        if hasattr(self.q_work, "close"):
+            self.q_work.close()
+            self.q_work.join_thread()
+        if isinstance(self.q_complete, CompletionChannel):
+            self.q_complete.close()
@@ -32,6 +32,11 @@ class GDCIndexClient:
         if uuid in self.metadata.keys():
             return self.metadata[uuid]["md5sum"]
 
+    def get_filename(self, uuid):
+        # type: (str) -> str
+        if uuid in self.metadata.keys():
+            return self.metadata[uuid]["file_name"]
+
     def get_filesize(self, uuid):
         # type: (str) -> int
         if uuid in self.metadata.keys():
@@ -86,6 +91,7 @@ class GDCIndexClient:
             self.metadata = {
                 str file_id: {
                     str       access
+                    str       file_name
                     str       file_size
                     str       md5sum
                     List[str] annotations
@@ -109,7 +115,7 @@ class GDCIndexClient:
         }
 
         metadata_query = {
-            "fields": "file_id,file_size,md5sum,annotations.annotation_id,"
+            "fields": "file_id,file_name,file_size,md5sum,annotations.annotation_id,"
             "metadata_files.file_id,index_files.file_id,access",
             "filters": dumps(filters),
             "from": "0",
@@ -142,6 +148,7 @@ class GDCIndexClient:
                 # don't want to overwrite
                 self.metadata[h["id"]] = {
                     "access": h["access"],
+                    "file_name": h.get("file_name"),
                     "file_size": h["file_size"],
                     "md5sum": h["md5sum"],
                     "annotations": annotations,
@@ -0,0 +1 @@
+from gdc_client.serve import parser
@@ -0,0 +1,72 @@
+import logging
+from urllib import parse as urlparse
+
+from gdc_client.serve.server import BlockStore, GDCProxyServer
+
+log = logging.getLogger("gdc-serve")
+
+
+def serve(args):
+    """Serve GDC files over HTTP until interrupted."""
+    store = BlockStore(args.cache_dir, args.block_size, args.cache_size)
+    server = GDCProxyServer(
+        (args.host, args.port),
+        urlparse.urljoin(args.server, "data/"),
+        args.token_file,
+        store,
+        verify=not args.no_verify,
+    )
+
+    host, port = server.server_address[:2]
+    log.info(f"Serving GDC files at http://{host}:{port}/data/<file_id>")
+    log.info(f"Caching blocks in {store.directory}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def config(parser, serve_defaults):
+    """Configure a parser for serve."""
+    serve_defaults["func"] = serve
+
+    parser.set_defaults(**serve_defaults)
+
+    parser.add_argument(
+        "-s",
+        "--server",
+        metavar="server",
+        type=str,
+        help="The TCP server address server[:port]",
+    )
+    parser.add_argument(
+        "--host",
+        help="Address to listen on. Defaults to localhost only",
+    )
+    parser.add_argument("--port", type=int, help="Port to listen on")
+    parser.add_argument(
+        "--cache-dir",
+        dest="cache_dir",
+        help="Directory of the block cache, shared by every server using it",
+    )
+    parser.add_argument(
+        "--cache-size",
+        dest="cache_size",
+        type=int,
+        help="Size in bytes of the block cache. The least recently used "
+        "blocks are removed once it is full",
+    )
+    parser.add_argument(
+        "--block-size",
+        dest="block_size",
+        type=int,
+        help="Size in bytes of the blocks fetched from the GDC and cached",
+    )
+    parser.add_argument(
+        "-k",
+        "--no-verify",
+        dest="no_verify",
+        action="store_true",
+        help="Perform insecure SSL connection and transfer",
+    )
+    parser.add_argument("--config", help="Path to INI-type config file", metavar="FILE")
@@ -0,0 +1,264 @@
+import argparse
+import http.server
+import logging
+import os
+import re
+import tempfile
+import threading
+from urllib import parse as urlparse
+
+from gdc_client.download.parser import byte_range
+from gdc_client.parcel import RemoteFile, utils
+from gdc_client.parcel.connection import SessionPool
+
+log = logging.getLogger("gdc-serve")
+
+DATA_PATH = re.compile(r"/data/([\w-]+)/?")
+
+# Bytes read from the cache and sent to the client at a time
+SEND_SIZE = 1024 * 1024
+
+
+class BlockStore:
+    """Blocks of remote files cached on disk.
+
+    Every server using the same ``directory`` shares the blocks. A block is
+    written to a temporary file and renamed into place, so no server ever
+    reads part of a block. Once more than ``max_size`` bytes are cached,
+    the least recently used blocks are removed.
+    """
+
+    def __init__(self, directory, block_size, max_size):
+        self.block_size = block_size
+        self.max_size = max_size
+        # blocks of different sizes never mix
+        self.directory = os.path.join(
+            os.path.expanduser(directory), f"blocks-{block_size}"
+        )
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self.size = sum(size for _, size, _ in self._blocks())
+
+    def for_file(self, file_id):
+        """The cache of ``file_id`` to hand to its :class:`RemoteFile`"""
+        return FileBlockCache(self, file_id)
+
+    def path(self, file_id, index):
+        return os.path.join(self.directory, file_id, str(index))
+
+    def get(self, file_id, index):
+        """Return a block, or None if it is not cached"""
+        path = self.path(file_id, index)
+        try:
+            with open(path, "rb") as f:
+                block = f.read()
+            # file systems mounted noatime never update the access time,
+            # the modification time orders the blocks for eviction instead
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return block
+
+    def put(self, file_id, index, block):
+        path = self.path(file_id, index)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".")
+        with os.fdopen(fd, "wb") as f:
+            f.write(block)
+        os.replace(temp_path, path)
+
+        with self._lock:
+            self.size += len(block)
+            full = self.size > self.max_size
+        if full:
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used blocks, including the ones other
+        servers cached, until the cache is below its size limit"""
+        with self._lock:
+            removed, size = utils.evict_least_recently_used(
+                self._blocks(), self.max_size
+            )
+            self.size = size
+        log.debug(f"Evicted {removed} cached blocks, {size} bytes left")
+
+    def _blocks(self):
+        """Yield the modification time, size and path of the cached blocks"""
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.startswith("."):
+                    # a block being written
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield st.st_mtime, st.st_size, path
+
+
+class FileBlockCache:
+    """The blocks of one file in a :class:`BlockStore`, as the cache of its
+    :class:`RemoteFile`"""
+
+    def __init__(self, store, file_id):
+        self.store = store
+        self.file_id = file_id
+
+    def __contains__(self, index):
+        return os.path.exists(self.store.path(self.file_id, index))
+
+    def get(self, index):
+        return self.store.get(self.file_id, index)
+
+    def put(self, index, block):
+        self.store.put(self.file_id, index, block)
+
+    def clear(self):
+        # the blocks stay cached for the other readers
+        pass
+
+
+class GDCProxyServer(http.server.ThreadingHTTPServer):
+    """Serve GDC files at ``/data/<file_id>`` to local readers that cannot
+    authenticate with the GDC themselves.
+
+    Range requests are answered from a shared :class:`BlockStore`. Missing
+    blocks are fetched by a :class:`RemoteFile` per file, over pooled
+    connections that carry the token.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, data_uri, token, store, verify=True):
+        """
+        :param tuple address: ``(host, port)`` to listen on
+        :param str data_uri: The url of the GDC data endpoint
+        :param str token: The authentication token
+        :param store: The :class:`BlockStore` caching the blocks
+        :param bool verify: optional. Verify the GDC server certificate
+        """
+        super().__init__(address, RangeRequestHandler)
+        self.data_uri = data_uri
+        self.token = token
+        self.store = store
+        self.verify = verify
+        self.session_pool = SessionPool()
+        self.files = {}
+        self._files_lock = threading.Lock()
+
+    def open(self, file_id):
+        """Return the :class:`RemoteFile` of ``file_id``, opened on first use"""
+        with self._files_lock:
+            remote_file = self.files.get(file_id)
+        if remote_file is not None:
+            return remote_file
+
+        remote_file = RemoteFile(
+            urlparse.urljoin(self.data_uri, file_id),
+            self.token,
+            block_size=self.store.block_size,
+            session_pool=self.session_pool,
+            verify=self.verify,
+            cache=self.store.for_file(file_id),
+        )
+        with self._files_lock:
+            return self.files.setdefault(file_id, remote_file)
+
+    def server_close(self):
+        super().server_close()
+        for remote_file in self.files.values():
+            remote_file.close()
+        self.session_pool.close()
+
+
+class RequestedRangeNotSatisfiable(Exception):
+    pass
+
+
+class RangeRequestHandler(http.server.BaseHTTPRequestHandler):
+    # keep-alive connections, readers like htslib send many range requests
+    protocol_version = "HTTP/1.1"
+    server_version = "gdc-client"
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def log_message(self, format, *args):
+        log.debug("%s - %s", self.address_string(), format % args)
+
+    def _serve(self, send_body):
+        match = DATA_PATH.fullmatch(urlparse.urlparse(self.path).path)
+        if not match:
+            self.send_error(404, "Not Found", "Files are served at /data/<file_id>")
+            return
+        file_id = match.group(1)
+
+        try:
+            remote_file = self.server.open(file_id)
+        except Exception as e:
+            log.error(f"{file_id}: {e}")
+            self.send_error(502, "Bad Gateway", str(e))
+            return
+
+        try:
+            requested = self._requested_range(remote_file.size)
+        except RequestedRangeNotSatisfiable:
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{remote_file.size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if requested is None:
+            start, stop = 0, remote_file.size
+            self.send_response(200)
+        else:
+            start, stop = requested
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", f"bytes {start}-{stop - 1}/{remote_file.size}"
+            )
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(stop - start))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header(
+            "Content-Disposition", f"attachment; filename={remote_file.name}"
+        )
+        self.end_headers()
+
+        if not send_body:
+            return
+        offset = start
+        try:
+            while offset < stop:
+                data = remote_file.pread(offset, min(SEND_SIZE, stop - offset))
+                self.wfile.write(data)
+                offset += len(data)
+        except Exception as e:
+            # the headers are gone already, all that is left is to hang up
+            log.error(f"{file_id}: {e}")
+            self.close_connection = True
+
+    def _requested_range(self, size):
+        """The ``(start, stop)`` of the requested range, or None for the
+        whole file
+
+        :raises RequestedRangeNotSatisfiable: if the range is outside of the file
+        """
+        header = self.headers.get("Range", "").strip()
+        if not header.startswith("bytes=") or "," in header:
+            # no range, or several of them: answer with the whole file
+            return None
+        try:
+            start, stop, _ = slice(*byte_range(header[len("bytes=") :])).indices(size)
+        except argparse.ArgumentTypeError:
+            raise RequestedRangeNotSatisfiable()
+        if start >= stop:
+            raise RequestedRangeNotSatisfiable()
+        return start, stop
@@ -23,6 +23,10 @@ class SettingsResolver:
         logger.info(self.config.to_display_string("upload"))
         return self.config.to_display_string("upload")
 
+    def serve(self):
+        logger.info(self.config.to_display_string("serve"))
+        return self.config.to_display_string("serve")
+
 
 def resolve(config_file, args):
     resolver = SettingsResolver(config_file)
@@ -42,3 +46,7 @@ def config(parser, config_file=None):
     upload_choice = choices.add_parser("upload", help="Display upload settings")
     upload_choice.add_argument("--config", help=HELP, metavar="FILE")
     upload_choice.set_defaults(func=partial(resolve, config_file))
+
+    serve_choice = choices.add_parser("serve", help="Display serve settings")
+    serve_choice.add_argument("--config", help=HELP, metavar="FILE")
+    serve_choice.set_defaults(func=partial(resolve, config_file))
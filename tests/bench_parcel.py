@@ -0,0 +1,427 @@
+"""Benchmarks for the parcel download engine.
+
+These are not collected by pytest. Run them by hand from the repository root,
+e.g.::
+
+    python tests/bench_parcel.py write-segment --size 512
+
+Benchmarks that need a data server start the local flask mock server from
+``tests/mock_server.py`` on a separate port with the artificial range request
+delays disabled.
+"""
+
+import argparse
+import itertools
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from multiprocessing import Manager, Process
+
+import requests
+from intervaltree import Interval, IntervalTree
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import conftest  # noqa: E402
+from gdc_client.parcel import utils  # noqa: E402
+from gdc_client.parcel.channel import CompletionChannel  # noqa: E402
+from gdc_client.parcel.const import MB  # noqa: E402
+from gdc_client.parcel.download_stream import DownloadStream  # noqa: E402
+from gdc_client.parcel.http_client import HTTPClient  # noqa: E402
+from gdc_client.parcel.rangeset import ChunkRangeSet, RangeSet  # noqa: E402
+from gdc_client.parcel.segment import SegmentProducer  # noqa: E402
+from gdc_client.parcel.throughput import SegmentStats  # noqa: E402
+
+BENCH_PORT = 5001
+BENCH_UUID = "bench"
+
+
+class _Discard:
+    """Completion queue stand-in that drops every reported interval"""
+
+    def put(self, item):
+        pass
+
+
+def _run_server(port):
+    import mock_server
+
+    mock_server.generator = itertools.repeat(0)
+    mock_server.app.run(port=port)
+
+
+def start_mock_server(size, port=BENCH_PORT):
+    """Register a ``size`` byte file with the mock server and start it"""
+    conftest.uuids[BENCH_UUID] = conftest.generate_metadata_dict(
+        "open", "0" * size, [], []
+    )
+    server = Process(target=_run_server, args=(port,), daemon=True)
+    server.start()
+
+    url = f"http://127.0.0.1:{port}/data/{BENCH_UUID}"
+    for _ in range(100):
+        try:
+            requests.get(url, headers={"Range": "bytes=0-0"}).close()
+            break
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    return server, url
+
+
+def _legacy_write_segment(stream, segment):
+    """The pre-pwrite write path: open, seek, write and close per chunk"""
+    start, end = segment
+    written = 0
+    r = stream.request(stream.header(start, end - 1))
+    for chunk in r.iter_content(chunk_size=stream.http_chunk_size):
+        if not chunk:
+            continue
+        utils.write_offset(stream.temp_path, chunk, start + written)
+        utils.md5sum(chunk)
+        written += len(chunk)
+    r.close()
+    return written
+
+
+def bench_write_segment(args):
+    size = args.size * MB
+    server, url = start_mock_server(size)
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            stream = DownloadStream(url, directory)
+            stream.name = "bench.bin"
+            stream.size = size
+            DownloadStream.http_chunk_size = args.chunk_size
+            stream.setup_file()
+
+            paths = {
+                "open/seek/write/close per chunk": lambda: _legacy_write_segment(
+                    stream, (0, size)
+                ),
+                "persistent fd + pwrite": lambda: stream.write_segment(
+                    Interval(0, size), _Discard()
+                ),
+            }
+            for name, run in paths.items():
+                timings = []
+                for _ in range(args.repeat):
+                    began = time.perf_counter()
+                    run()
+                    timings.append(time.perf_counter() - began)
+                best = min(timings)
+                print(
+                    "{:<34} best {:7.3f}s  {:8.1f} MB/s  ({} chunks)".format(
+                        name,
+                        best,
+                        size / MB / best,
+                        -(-size // args.chunk_size),
+                    )
+                )
+    finally:
+        server.terminate()
+
+
+def _report_chunks(q_complete, start, count, chunk_size, digest):
+    for i in range(start, start + count):
+        offset = i * chunk_size
+        q_complete.put(Interval(offset, offset + chunk_size, {"md5sum": digest}))
+    q_complete.put(None)
+
+
+def bench_completion_channel(args):
+    digest = utils.md5sum(b"")
+    per_worker = args.records // args.workers
+
+    channels = {
+        "multiprocessing.Manager queue": lambda: Manager().Queue(),
+        "pipe CompletionChannel": CompletionChannel,
+    }
+    for name, make_channel in channels.items():
+        q_complete = make_channel()
+        workers = [
+            Process(
+                target=_report_chunks,
+                args=(q_complete, i * per_worker, per_worker, args.chunk_size, digest),
+            )
+            for i in range(args.workers)
+        ]
+
+        began = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        done = received = 0
+        while done < args.workers:
+            # the end of a task comes back as SegmentStats over the channel
+            report = q_complete.get()
+            if report is None or isinstance(report, SegmentStats):
+                done += 1
+            else:
+                received += 1
+        elapsed = time.perf_counter() - began
+        for worker in workers:
+            worker.join()
+
+        print(
+            "{:<34} {:9.0f} reports/s  ~{:7.1f} GB/s of {} KB chunks".format(
+                name,
+                received / elapsed,
+                received * args.chunk_size / elapsed / 1e9,
+                args.chunk_size // 1024,
+            )
+        )
+
+
+def _completion_order(chunks, workers):
+    """Chunk indexes in the order ``workers`` parallel segments finish them"""
+    per_worker = -(-chunks // workers)
+    return [
+        w * per_worker + i
+        for i in range(per_worker)
+        for w in range(workers)
+        if w * per_worker + i < chunks
+    ]
+
+
+class _IntervalTreeProducer:
+    """The producer bookkeeping as done with intervaltree"""
+
+    def __init__(self, size):
+        self.work_pool = IntervalTree([Interval(0, size)])
+        self.completed = IntervalTree()
+
+    def next_segment(self, block_size):
+        intervals = sorted(self.work_pool.items())
+        if not intervals:
+            return None
+        start = intervals[0].begin
+        end = min(intervals[0].end, start + block_size)
+        self.work_pool.chop(start, end)
+        return start, end
+
+    def complete(self, begin, end, md5sum):
+        self.completed.add(Interval(begin, end, {"md5sum": md5sum}))
+
+    def integrate(self):
+        return sum([i.end - i.begin for i in self.completed.items()])
+
+    def chunks(self):
+        return sorted(self.completed)
+
+
+class _RangeSetProducer:
+    """The producer bookkeeping as done with the array-backed range sets"""
+
+    def __init__(self, size):
+        self.work_pool = RangeSet([(0, size)])
+        self.completed = ChunkRangeSet()
+
+    def next_segment(self, block_size):
+        interval = self.work_pool.first()
+        if not interval:
+            return None
+        end = min(interval.end, interval.begin + block_size)
+        self.work_pool.chop(interval.begin, end)
+        return interval.begin, end
+
+    def complete(self, begin, end, md5sum):
+        self.completed.add(begin, end, md5sum)
+
+    def integrate(self):
+        return self.completed.size
+
+    def chunks(self):
+        return self.completed.items()
+
+
+def _run_producer(producer, order, chunk_size, block_size, repeat):
+    md5sum = utils.md5sum(b"")
+    timings = {}
+
+    began = time.perf_counter()
+    while producer.next_segment(block_size):
+        pass
+    timings["hand out segments"] = time.perf_counter() - began
+
+    began = time.perf_counter()
+    for i in order:
+        producer.complete(i * chunk_size, (i + 1) * chunk_size, md5sum)
+    timings["record chunks"] = time.perf_counter() - began
+
+    began = time.perf_counter()
+    for _ in range(repeat):
+        producer.integrate()
+    timings[f"integrate x{repeat}"] = time.perf_counter() - began
+
+    began = time.perf_counter()
+    producer.chunks()
+    timings["list chunks"] = time.perf_counter() - began
+    return timings
+
+
+def bench_rangeset(args):
+    order = _completion_order(args.chunks, args.workers)
+    size = args.chunks * args.chunk_size
+    block_size = args.block_chunks * args.chunk_size
+    segments = -(-size // block_size)
+
+    implementations = {
+        "intervaltree": _IntervalTreeProducer,
+        "RangeSet/ChunkRangeSet": _RangeSetProducer,
+    }
+    print(f"{args.chunks} chunks of {args.chunk_size} B, {segments} segments")
+    for name, make_producer in implementations.items():
+        timings = _run_producer(
+            make_producer(size), order, args.chunk_size, block_size, args.repeat
+        )
+
+        tracemalloc.start()
+        producer = make_producer(size)
+        _run_producer(producer, order, args.chunk_size, block_size, 1)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        print(f"{name}: {memory / MB:.1f} MB after recording every chunk")
+        for phase, elapsed in timings.items():
+            print(f"    {phase:<20} {elapsed:8.3f}s")
+
+
+def _timed_chunks(log_fd, iter_chunks):
+    """Wrap DownloadStream._iter_chunks to log when each request received
+    its first and last byte. Workers inherit it when they are forked"""
+
+    def timed(stream, r):
+        first = None
+        try:
+            for chunk in iter_chunks(stream, r):
+                if first is None:
+                    first = time.time()
+                yield chunk
+        finally:
+            if first is not None:
+                line = f"{stream.url} {first} {time.time()}\n"
+                os.write(log_fd, line.encode())
+
+    return timed
+
+
+def _file_gaps(log_path):
+    """Seconds from the last byte of each file to the first byte of the next"""
+    files = {}
+    with open(log_path) as f:
+        for line in f:
+            url, first, last = line.split()
+            began, ended = files.get(url, (float(first), float(last)))
+            files[url] = min(began, float(first)), max(ended, float(last))
+    spans = sorted(files.values())
+    return [nxt[0] - prev[1] for prev, nxt in zip(spans, spans[1:])]
+
+
+def bench_file_overhead(args):
+    size = args.size * MB
+    urls = [f"http://127.0.0.1:{BENCH_PORT}/data/{BENCH_UUID}"]
+    for i in range(1, args.files):
+        conftest.uuids[f"{BENCH_UUID}-{i}"] = conftest.generate_metadata_dict(
+            "open", "0" * size, [], []
+        )
+        urls.append(f"http://127.0.0.1:{BENCH_PORT}/data/{BENCH_UUID}-{i}")
+    server, _ = start_mock_server(size)
+
+    # one progress bar per file would drown the results
+    SegmentProducer._setup_pbar = lambda producer: None
+    iter_chunks = DownloadStream._iter_chunks
+    try:
+        runs = {
+            "a worker pool per file": lambda client: [
+                client.download_files([url]) for url in urls
+            ],
+            "one worker pool for every file": lambda client: client.download_files(
+                urls
+            ),
+        }
+        for name, run in runs.items():
+            with tempfile.TemporaryDirectory() as directory:
+                log_path = os.path.join(directory, "requests.log")
+                log_fd = os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND)
+                DownloadStream._iter_chunks = _timed_chunks(log_fd, iter_chunks)
+                client = HTTPClient(
+                    urls[0], None, args.processes, os.path.join(directory, "out")
+                )
+                os.makedirs(client.directory)
+
+                began = time.perf_counter()
+                run(client)
+                elapsed = time.perf_counter() - began
+                os.close(log_fd)
+                gaps = _file_gaps(log_path)
+
+            print(
+                "{:<32} {:7.2f}s for {} files  per-file overhead: median "
+                "{:6.1f} ms  mean {:6.1f} ms  max {:6.1f} ms".format(
+                    name,
+                    elapsed,
+                    len(urls),
+                    statistics.median(gaps) * 1e3,
+                    statistics.mean(gaps) * 1e3,
+                    max(gaps) * 1e3,
+                )
+            )
+    finally:
+        DownloadStream._iter_chunks = iter_chunks
+        server.terminate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    write_segment = subparsers.add_parser(
+        "write-segment",
+        help="DownloadStream.write_segment against the per-chunk open/close path",
+    )
+    write_segment.add_argument("--size", type=int, default=256, help="File size in MB")
+    write_segment.add_argument(
+        "--chunk-size", type=int, default=64 * 1024, help="HTTP chunk size in bytes"
+    )
+    write_segment.add_argument("--repeat", type=int, default=3)
+    write_segment.set_defaults(func=bench_write_segment)
+
+    completion_channel = subparsers.add_parser(
+        "completion-channel",
+        help="Chunk completion reports from workers to the segment producer",
+    )
+    completion_channel.add_argument("--records", type=int, default=200000)
+    completion_channel.add_argument("--workers", type=int, default=8)
+    completion_channel.add_argument("--chunk-size", type=int, default=MB)
+    completion_channel.set_defaults(func=bench_completion_channel)
+
+    rangeset = subparsers.add_parser(
+        "rangeset",
+        help="Producer work pool and completed chunk bookkeeping",
+    )
+    rangeset.add_argument("--chunks", type=int, default=1000000)
+    rangeset.add_argument("--chunk-size", type=int, default=MB)
+    rangeset.add_argument("--workers", type=int, default=8)
+    rangeset.add_argument(
+        "--block-chunks", type=int, default=64, help="Segment size in chunks"
+    )
+    rangeset.add_argument("--repeat", type=int, default=10)
+    rangeset.set_defaults(func=bench_rangeset)
+
+    file_overhead = subparsers.add_parser(
+        "file-overhead",
+        help="Time from the last byte of a file to the first byte of the next",
+    )
+    file_overhead.add_argument("--files", type=int, default=100)
+    file_overhead.add_argument("--size", type=int, default=1, help="File size in MB")
+    file_overhead.add_argument("--processes", type=int, default=4)
+    file_overhead.set_defaults(func=bench_file_overhead)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
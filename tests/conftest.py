@@ -50,6 +50,7 @@ def generate_metadata_dict(
     return {
         "access": access,
         "contents": contents,
+        "file_name": None if contents is None else "test_file.txt",
         "file_size": None if contents is None else len(contents),
         "md5sum": None if contents is None else md5(contents),
         "annotations": annotations,
@@ -111,6 +112,14 @@ uuids = {
         [],
         [],
     ),
+    # big enough to be downloaded by several processes, the mock server
+    # throttles the connection serving the start of this file
+    "big_throttled": generate_metadata_dict(
+        "open",
+        "5" * (12 * 1024 * 1024),
+        [],
+        [],
+    ),
     "annotations.txt": {"contents": "id\tsubmitter_id\t\n123\t456\n"},
 }
 
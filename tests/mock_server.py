@@ -21,6 +21,12 @@ def generate_sleep_intervals(num_exceptions: int = 6) -> int:
 
 generator = generate_sleep_intervals()
 
+# Range requests for this file starting at offset 0 trickle data, simulating
+# one throttled connection among several fast ones
+THROTTLED_UUID = "big_throttled"
+THROTTLED_PIECE_SIZE = 16 * 1024
+THROTTLED_PIECE_DELAY = 0.05
+
 
 @app.route("/files/versions", methods=["POST"])
 @app.route("/v0/files/versions", methods=["POST"])
@@ -74,6 +80,7 @@ def files():
     [{
         'access':      'access level',
         'md5sum':      'md5.,
+        'file_name':   'name',
         'file_size':   1,
         'id':          'id.,
         'file_id':     'id.
@@ -114,6 +121,9 @@ def files():
             if "access" in fields and node.get("access"):
                 hit["access"] = node["access"]
 
+            if "file_name" in fields and node.get("file_name"):
+                hit["file_name"] = node["file_name"]
+
             if "file_size" in fields and node.get("file_size"):
                 hit["file_size"] = node["file_size"]
 
@@ -212,14 +222,26 @@ def handle_range_request(
     start = int(interval[0])
     end = int(interval[1]) + 1
 
-    sleep_time = next(generator)
-    # Long sleep times purposefully set to cause ReadTimeout in client
-    time.sleep(sleep_time)
-
     data = uuids[ids[0]]["contents"][start:end]
+    size = len(data)
+
+    if ids[0] == THROTTLED_UUID:
+        if start == 0:
+            data = throttle(data)
+    else:
+        sleep_time = next(generator)
+        # Long sleep times purposefully set to cause ReadTimeout in client
+        time.sleep(sleep_time)
+
     resp = Response(data)
     resp.headers["Content-Disposition"] = f"attachment; filename={filename}"
     resp.headers["Content-Type"] = "application/octet-stream"
-    resp.headers["Content-Length"] = len(data)
+    resp.headers["Content-Length"] = size
 
     return resp
+
+
+def throttle(data: str) -> typing.Iterator[str]:
+    for i in range(0, len(data), THROTTLED_PIECE_SIZE):
+        time.sleep(THROTTLED_PIECE_DELAY)
+        yield data[i : i + THROTTLED_PIECE_SIZE]
@@ -0,0 +1,50 @@
+import os
+from pathlib import Path
+
+from gdc_client.download.catalog import Catalog
+
+
+def write_file(tmp_path: Path, contents: bytes = b"A" * 100) -> Path:
+    path = tmp_path / "id1" / "file.txt"
+    path.parent.mkdir(exist_ok=True)
+    path.write_bytes(contents)
+    return path
+
+
+def test_recorded_file_is_complete(tmp_path: Path) -> None:
+    catalog = Catalog(str(tmp_path))
+    catalog.record("id1", str(write_file(tmp_path)), "md5")
+
+    assert catalog.is_complete("id1")
+    assert catalog.is_complete("id1", "md5")
+    assert not catalog.is_complete("id2")
+
+
+def test_catalog_persists(tmp_path: Path) -> None:
+    catalog = Catalog(str(tmp_path))
+    catalog.record("id1", str(write_file(tmp_path)), "md5")
+    catalog.close()
+
+    assert Catalog(str(tmp_path)).completed(["id1", "id2"]) == ["id1"]
+
+
+def test_md5sum_mismatch_is_not_complete(tmp_path: Path) -> None:
+    catalog = Catalog(str(tmp_path))
+    catalog.record("id1", str(write_file(tmp_path)), "md5")
+
+    assert not catalog.is_complete("id1", "other md5")
+    assert catalog.completed(["id1"], {"id1": "other md5"}) == []
+
+
+def test_changed_file_is_not_complete(tmp_path: Path) -> None:
+    catalog = Catalog(str(tmp_path))
+    path = write_file(tmp_path)
+    catalog.record("id1", str(path), "md5")
+    st = path.stat()
+
+    # same size, different modification time
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+    assert not catalog.is_complete("id1")
+
+    path.unlink()
+    assert not catalog.is_complete("id1")
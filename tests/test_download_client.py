@@ -1,19 +1,30 @@
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import logging
 from multiprocessing import cpu_count
 import os
 from pathlib import Path
 import pytest
+import queue
+import re
 import tarfile
+import threading
 from typing import List
 from unittest.mock import patch
 
+from intervaltree import Interval
+
 from gdc_client.common.config import GDCClientArgumentParser
+from gdc_client.exceptions import MD5ValidationError
 from gdc_client.parcel.const import HTTP_CHUNK_SIZE, SAVE_INTERVAL
 from gdc_client.parcel.download_stream import DownloadStream
+from gdc_client.parcel import ordered_stream, segment, worker_pool
 
 from conftest import make_tarfile, uuids
 from gdc_client.download.client import GDCHTTPDownloadClient, fix_url
-from gdc_client.download.parser import download
+from gdc_client.download import parser as download_parser, preflight
+from gdc_client.download.parser import byte_range, download
 from gdc_client.query.index import GDCIndexClient
 
 BASE_URL = "http://127.0.0.1:5000"
@@ -51,11 +62,22 @@ class TestDownloadClient:
         cmd_line_args = {
             "server": BASE_URL,
             "n_processes": 1,
+            "concurrent_files": 1,
+            "engine": "process",
+            "hedge_budget": 4,
+            "low_speed_limit": 0,
+            "low_speed_time": 30,
+            "stdout": False,
+            "byte_ranges": None,
+            "file_cache": None,
+            "file_cache_size": None,
+            "trust_catalog": False,
             "dir": path,
             "save_interval": SAVE_INTERVAL,
             "http_chunk_size": HTTP_CHUNK_SIZE,
             "no_segment_md5sums": False,
             "no_file_md5sum": False,
+            "preallocate": False,
             "no_verify": False,
             "no_related_files": False,
             "no_annotations": False,
@@ -182,6 +204,500 @@ class TestDownloadClient:
             not temp_file_path.exists()
         ), "test_file.txt.partial should not exist on successful download"
 
+    def test_download_refused_without_disk_space(self, monkeypatch) -> None:
+        monkeypatch.setattr(preflight, "free_space", lambda directory: 0)
+        self.argparse_args.file_ids = ["big_no_friends", "small_no_friends"]
+        parser = GDCClientArgumentParser()
+
+        refused = download(parser, self.argparse_args)
+
+        assert sorted(refused) == ["big_no_friends", "small_no_friends"]
+        assert not (self.tmp_path / "big_no_friends").exists()
+        assert not (self.tmp_path / "small_no_friends").exists()
+
+    def test_download_skips_files_in_catalog(self, monkeypatch) -> None:
+        self.argparse_args.file_ids = ["big_no_friends", "small_no_friends"]
+        parser = GDCClientArgumentParser()
+        assert download(parser, self.argparse_args) == []
+
+        def download_again(*args, **kwargs):
+            raise AssertionError("downloaded files should be skipped")
+
+        monkeypatch.setattr(segment.SegmentProducer, "__init__", download_again)
+        monkeypatch.setattr(
+            GDCHTTPDownloadClient, "download_small_groups", download_again
+        )
+
+        assert download(parser, self.argparse_args) == []
+
+    def test_download_trusts_catalog(self, monkeypatch) -> None:
+        self.argparse_args.file_ids = ["big_no_friends"]
+        parser = GDCClientArgumentParser()
+        download(parser, self.argparse_args)
+
+        def query(*args, **kwargs):
+            raise AssertionError("the API should not be asked about the file")
+
+        monkeypatch.setattr(download_parser, "get_latest_versions", query)
+        self.argparse_args.trust_catalog = True
+
+        assert download(parser, self.argparse_args) == []
+
+    def test_download_trusts_catalog_for_latest_versions(self, monkeypatch) -> None:
+        self.argparse_args.file_ids = ["big_no_friends"]
+        parser = GDCClientArgumentParser()
+        download(parser, self.argparse_args)
+
+        def download_again(*args, **kwargs):
+            raise AssertionError("the latest version is already downloaded")
+
+        monkeypatch.setattr(
+            download_parser,
+            "get_latest_versions",
+            lambda *args, **kwargs: {"superseded": "big_no_friends"},
+        )
+        monkeypatch.setattr(segment.SegmentProducer, "__init__", download_again)
+        self.argparse_args.file_ids = ["superseded"]
+        self.argparse_args.latest = True
+        self.argparse_args.trust_catalog = True
+
+        assert download(parser, self.argparse_args) == []
+
+    def test_download_closes_catalog(self, monkeypatch) -> None:
+        closed = []
+        close = download_parser.Catalog.close
+
+        def record_close(catalog):
+            closed.append(catalog)
+            close(catalog)
+
+        monkeypatch.setattr(download_parser.Catalog, "close", record_close)
+        self.argparse_args.file_ids = ["big_no_friends"]
+
+        download(GDCClientArgumentParser(), self.argparse_args)
+
+        assert len(closed) == 1
+
+    def test_download_modified_file_again(self) -> None:
+        self.argparse_args.file_ids = ["big_no_friends"]
+        parser = GDCClientArgumentParser()
+        download(parser, self.argparse_args)
+        file_path = self.tmp_path / "big_no_friends" / "test_file.txt"
+        file_path.write_text("modified")
+
+        assert download(parser, self.argparse_args) == []
+        assert file_path.read_text() == uuids["big_no_friends"]["contents"]
+
+    def test_download_seeded_from_index_metadata(self, monkeypatch) -> None:
+        def probe(stream):
+            raise AssertionError("file information should come from the index")
+
+        monkeypatch.setattr(DownloadStream, "get_information", probe)
+        monkeypatch.setattr(DownloadStream, "get_name", probe)
+        client = self.get_download_client(["big_no_friends"])
+
+        _, errors = client.download_files([f"{BASE_URL}/data/big_no_friends"])
+
+        file_path = self.tmp_path / "big_no_friends" / "test_file.txt"
+        assert errors == {}
+        assert file_path.read_text() == uuids["big_no_friends"]["contents"]
+
+    def test_seeded_name_is_a_basename(self, monkeypatch) -> None:
+        client = self.get_download_client(["big_no_friends"])
+        known_file_information = client.known_file_information
+
+        def s3_key(url):
+            information = known_file_information(url)
+            information["name"] = "bucket/prefix/test_file.txt"
+            return information
+
+        monkeypatch.setattr(client, "known_file_information", s3_key)
+
+        _, errors = client.download_files([f"{BASE_URL}/data/big_no_friends"])
+
+        file_path = self.tmp_path / "big_no_friends" / "test_file.txt"
+        assert errors == {}
+        assert file_path.read_text() == uuids["big_no_friends"]["contents"]
+        assert not (self.tmp_path / "big_no_friends" / "bucket").exists()
+
+    @pytest.mark.parametrize("engine", ["process", "async"])
+    def test_refused_file_is_given_up(self, monkeypatch, engine) -> None:
+        # the file information comes from the index, so the range requests
+        # are the first to learn that the server refuses the file
+        if engine == "async":
+            pytest.importorskip("aiohttp")
+        self.client_kwargs["engine"] = engine
+        self.client_kwargs["debug"] = False
+        client = self.get_download_client()
+        monkeypatch.setattr(
+            client,
+            "known_file_information",
+            lambda url: {"name": "f", "size": 20 * 1024 * 1024, "md5sum": "0" * 32},
+        )
+
+        _, errors = client.download_files([f"{BASE_URL}/data/missing_file"])
+
+        error = errors[f"{BASE_URL}/data/missing_file"]
+        assert "404" in error and "missing_file not found" in error
+        assert not (self.tmp_path / "missing_file" / "f.partial").exists()
+
+    def test_write_segment_returns_its_stats(self) -> None:
+        # threaded workers share the stream, the stats of each segment are
+        # returned instead of kept on it
+        stream = DownloadStream(
+            f"{BASE_URL}/data/small_no_friends", str(self.tmp_path)
+        ).init()
+        stream.setup_file()
+        q_complete = queue.Queue()
+
+        written, latency, stalls = stream.write_segment(
+            Interval(0, stream.size), q_complete
+        )
+
+        assert written == stream.size
+        assert latency > 0
+        assert stalls == 0
+        assert sum(r.end - r.begin for r in q_complete.queue) == stream.size
+
+    def test_stream_file_in_order(self) -> None:
+        # the throttled first segment arrives last, the ones after it wait
+        # in the reorder buffer
+        stream = DownloadStream(
+            f"{BASE_URL}/data/big_throttled", str(self.tmp_path)
+        ).init()
+        stream.http_chunk_size = 64 * 1024
+        out = BytesIO()
+
+        ordered_stream.OrderedDownload(
+            stream, out, connections=3, buffer_size=1024 * 1024
+        ).download()
+
+        assert out.getvalue().decode() == uuids["big_throttled"]["contents"]
+        assert not (self.tmp_path / "big_throttled").exists()
+
+    def test_stream_file_invalid_md5sum(self, monkeypatch) -> None:
+        client = self.get_download_client()
+        contents = uuids["small_no_friends"]["contents"]
+        monkeypatch.setattr(
+            client,
+            "known_file_information",
+            lambda url: {"name": "f", "size": len(contents), "md5sum": "0" * 32},
+        )
+
+        with pytest.raises(MD5ValidationError):
+            client.stream_file(f"{BASE_URL}/data/small_no_friends", BytesIO())
+
+    def test_download_to_stdout(self, monkeypatch) -> None:
+        class Stdout:
+            buffer = BytesIO()
+
+        monkeypatch.setattr("sys.stdout", Stdout)
+        monkeypatch.setattr(ordered_stream, "STREAM_SEGMENT_SIZE", 1024 * 1024)
+        self.argparse_args.file_ids = ["big_no_friends"]
+        self.argparse_args.stdout = True
+        parser = GDCClientArgumentParser()
+
+        errors = download(parser, self.argparse_args)
+
+        assert errors == []
+        contents = uuids["big_no_friends"]["contents"]
+        assert Stdout.buffer.getvalue().decode() == contents
+        assert not (self.tmp_path / "big_no_friends").exists()
+
+    @pytest.mark.parametrize("engine", ["process", "async"])
+    def test_download_byte_ranges(self, engine) -> None:
+        if engine == "async":
+            pytest.importorskip("aiohttp")
+        contents = uuids["big_no_friends"]["contents"]
+        size = len(contents)
+        self.client_kwargs["engine"] = engine
+        self.client_kwargs["byte_ranges"] = [(100, 200), (-50, None)]
+        client = self.get_download_client(["big_no_friends"])
+
+        _, errors = client.download_files([f"{BASE_URL}/data/big_no_friends"])
+
+        directory = self.tmp_path / "big_no_friends"
+        assert errors == {}
+        assert not (directory / "test_file.txt").exists()
+        assert (directory / "test_file.txt.100-199").read_text() == contents[100:200]
+        last = directory / f"test_file.txt.{size - 50}-{size - 1}"
+        assert last.read_text() == contents[-50:]
+
+    def test_download_from_file_cache(self, monkeypatch) -> None:
+        self.client_kwargs["file_cache"] = str(self.tmp_path / "cache")
+        self.client_kwargs["download_related_files"] = False
+        self.client_kwargs["download_annotations"] = False
+        url = f"{BASE_URL}/data/big_no_friends"
+        contents = uuids["big_no_friends"]["contents"]
+        client = self.get_download_client(["big_no_friends"])
+        client.download_files([url])
+
+        def download(*args, **kwargs):
+            raise AssertionError("the file should come from the cache")
+
+        monkeypatch.setattr(segment.SegmentProducer, "__init__", download)
+        (self.tmp_path / "other").mkdir()
+        self.client_kwargs["directory"] = str(self.tmp_path / "other")
+        client = self.get_download_client(["big_no_friends"])
+
+        _, errors = client.download_files([url])
+
+        file_path = self.tmp_path / "other" / "big_no_friends" / "test_file.txt"
+        assert errors == {}
+        assert file_path.read_text() == contents
+        assert not (self.tmp_path / "other" / "big_no_friends" / "logs").exists()
+
+    def test_throttled_segment_is_split(self, monkeypatch, caplog) -> None:
+        # one connection trickles data, the idle worker should take over
+        # the tail of its segment instead of waiting for it
+        monkeypatch.setattr(segment, "MIN_SEGMENT_SIZE", 256 * 1024)
+        self.client_kwargs["n_procs"] = 2
+        self.client_kwargs["http_chunk_size"] = 64 * 1024
+        self.client_kwargs["hedge_budget"] = 0
+        client = self.get_download_client()
+
+        with caplog.at_level(logging.DEBUG, logger="segment"):
+            _, errors = client.download_files([BASE_URL + "/data/big_throttled"])
+
+        file_path = self.tmp_path / "big_throttled" / "test_file.txt"
+        assert errors == {}
+        assert file_path.read_text() == uuids["big_throttled"]["contents"]
+        assert any(
+            "Split in-flight segment" in record.message for record in caplog.records
+        )
+
+    @pytest.mark.parametrize("engine", ["process", "async"])
+    def test_throttled_segment_is_hedged(self, monkeypatch, caplog, engine) -> None:
+        # once the throttled connection straggles, the idle worker requests
+        # the rest of its segment again
+        if engine == "async":
+            pytest.importorskip("aiohttp")
+        monkeypatch.setattr(segment, "MIN_SEGMENT_SIZE", 256 * 1024)
+        monkeypatch.setattr(segment, "HEDGE_MIN_AGE", 0.5)
+        self.client_kwargs["engine"] = engine
+        self.client_kwargs["n_procs"] = 2
+        self.client_kwargs["http_chunk_size"] = 64 * 1024
+        client = self.get_download_client()
+
+        with caplog.at_level(logging.DEBUG, logger="segment"), caplog.at_level(
+            logging.DEBUG, logger="client"
+        ):
+            _, errors = client.download_files([BASE_URL + "/data/big_throttled"])
+
+        file_path = self.tmp_path / "big_throttled" / "test_file.txt"
+        assert errors == {}
+        assert file_path.read_text() == uuids["big_throttled"]["contents"]
+        assert any(
+            "Hedging straggling segment" in record.message for record in caplog.records
+        )
+        # the hedge took over from the throttled connection
+        summary = next(
+            record.message
+            for record in caplog.records
+            if "straggling segments" in record.message
+        )
+        hedges, won = re.search(
+            r"hedged (\d+) straggling segments, (\d+) won", summary
+        ).groups()
+        assert int(hedges) > 0 and won == hedges
+
+    @pytest.mark.parametrize("engine", ["process", "async"])
+    def test_stalled_request_is_restarted(self, caplog, engine) -> None:
+        # the throttled connection falls below the low-speed limit and is
+        # restarted from where it stopped
+        if engine == "async":
+            pytest.importorskip("aiohttp")
+        self.client_kwargs["engine"] = engine
+        self.client_kwargs["http_chunk_size"] = 64 * 1024
+        self.client_kwargs["hedge_budget"] = 0
+        self.client_kwargs["low_speed_limit"] = 1024 * 1024
+        self.client_kwargs["low_speed_time"] = 1
+        client = self.get_download_client()
+
+        with caplog.at_level(logging.DEBUG, logger="client"):
+            _, errors = client.download_files([BASE_URL + "/data/big_throttled"])
+
+        file_path = self.tmp_path / "big_throttled" / "test_file.txt"
+        assert errors == {}
+        assert file_path.read_text() == uuids["big_throttled"]["contents"]
+        assert any(
+            "restarted 1 stalled requests" in record.message
+            for record in caplog.records
+        )
+
+    @pytest.mark.parametrize("file_id", ["big_no_friends", "big_throttled"])
+    def test_async_engine_download(self, monkeypatch, file_id: str) -> None:
+        pytest.importorskip("aiohttp")
+        monkeypatch.setattr(segment, "MIN_SEGMENT_SIZE", 256 * 1024)
+        self.client_kwargs["engine"] = "async"
+        self.client_kwargs["n_procs"] = 2
+        self.client_kwargs["http_chunk_size"] = 64 * 1024
+        client = self.get_download_client()
+
+        _, errors = client.download_files([f"{BASE_URL}/data/{file_id}"])
+
+        file_path = self.tmp_path / file_id / "test_file.txt"
+        assert errors == {}
+        assert file_path.read_text() == uuids[file_id]["contents"]
+        assert not (self.tmp_path / file_id / "test_file.txt.partial").exists()
+
+    def test_async_engine_retried_segment(self, monkeypatch) -> None:
+        # a request dies halfway, the retry picks up where it stopped
+        # without writing or reporting any chunk twice
+        async_engine = pytest.importorskip("gdc_client.parcel.async_engine")
+        pytest.importorskip("aiohttp")
+        self.client_kwargs["engine"] = "async"
+        self.client_kwargs["n_procs"] = 1
+        self.client_kwargs["http_chunk_size"] = 64 * 1024
+        client = self.get_download_client()
+
+        fetch = async_engine.AsyncDownloadEngine._fetch
+        failed = []
+
+        async def fail_once(engine, session, begin, end, slot):
+            if failed:
+                return await fetch(engine, session, begin, end, slot)
+            failed.append(begin)
+            await fetch(engine, session, begin, begin + 2 * 64 * 1024, slot)
+            raise ConnectionResetError("connection reset by peer")
+
+        reported = []
+        handle_report = segment.SegmentProducer.handle_report
+
+        def spy_report(producer, report):
+            if hasattr(report, "begin"):
+                reported.append(report.end - report.begin)
+            handle_report(producer, report)
+
+        monkeypatch.setattr(async_engine.AsyncDownloadEngine, "_fetch", fail_once)
+        monkeypatch.setattr(segment.SegmentProducer, "handle_report", spy_report)
+
+        _, errors = client.download_files([f"{BASE_URL}/data/big_no_friends"])
+
+        contents = uuids["big_no_friends"]["contents"]
+        file_path = self.tmp_path / "big_no_friends" / "test_file.txt"
+        assert errors == {}
+        assert failed
+        assert file_path.read_text() == contents
+        assert sum(reported) == len(contents)
+
+    def test_preallocated_download(self) -> None:
+        self.client_kwargs["preallocate"] = True
+        client = self.get_download_client()
+
+        _, errors = client.download_files([f"{BASE_URL}/data/big_no_friends"])
+
+        file_path = self.tmp_path / "big_no_friends" / "test_file.txt"
+        assert errors == {}
+        assert file_path.read_text() == uuids["big_no_friends"]["contents"]
+
+    def test_workers_reused_across_files(self, monkeypatch) -> None:
+        file_ids = ["big_no_friends", "big_rel", "big_ann"]
+        self.client_kwargs["n_procs"] = 2
+        self.client_kwargs["download_related_files"] = False
+        self.client_kwargs["download_annotations"] = False
+        client = self.get_download_client()
+
+        pools = []
+        start_pool = worker_pool.WorkerPool.__init__
+
+        def spy_pool(pool, *args, **kwargs):
+            pools.append(pool)
+            start_pool(pool, *args, **kwargs)
+
+        monkeypatch.setattr(worker_pool.WorkerPool, "__init__", spy_pool)
+
+        _, errors = client.download_files(
+            [f"{BASE_URL}/data/{file_id}" for file_id in file_ids]
+        )
+
+        assert errors == {}
+        for file_id in file_ids:
+            file_path = self.tmp_path / file_id / "test_file.txt"
+            assert file_path.read_text() == uuids[file_id]["contents"]
+        assert len(pools) == 1
+        assert not any(worker.is_alive() for worker in pools[0].workers)
+
+    def test_client_session_pool_counts_worker_requests(self, monkeypatch) -> None:
+        self.client_kwargs["n_procs"] = 2
+        client = self.get_download_client(["big_no_friends"])
+        session_pool = client.session_pool
+        get = session_pool.get
+        parent, requests = os.getpid(), []
+
+        def spy_get(url):
+            if os.getpid() == parent:
+                requests.append(url)
+            return get(url)
+
+        monkeypatch.setattr(session_pool, "get", spy_get)
+
+        _, errors = client.download_files([f"{BASE_URL}/data/big_no_friends"])
+
+        # the segments were requested by the forked workers
+        assert errors == {}
+        assert session_pool.hits + session_pool.misses > len(requests)
+
+    def test_download_files_concurrently(self, monkeypatch) -> None:
+        file_ids = ["big_no_friends", "big_rel", "big_ann"]
+        self.client_kwargs["n_procs"] = 6
+        self.client_kwargs["concurrent_files"] = 3
+        self.client_kwargs["download_related_files"] = False
+        self.client_kwargs["download_annotations"] = False
+        client = self.get_download_client()
+
+        # record the connections each file was given
+        connections = []
+        download = client._download
+
+        def spy_download(nprocs, stream):
+            connections.append(nprocs)
+            return download(nprocs, stream)
+
+        monkeypatch.setattr(client, "_download", spy_download)
+
+        downloaded, errors = client.download_files(
+            [f"{BASE_URL}/data/{file_id}" for file_id in file_ids]
+        )
+
+        assert errors == {}
+        assert len(downloaded) == len(file_ids)
+        assert connections == [2, 2, 2]
+        for file_id in file_ids:
+            file_path = self.tmp_path / file_id / "test_file.txt"
+            assert file_path.read_text() == uuids[file_id]["contents"]
+            assert not (self.tmp_path / file_id / "test_file.txt.partial").exists()
+
+    def test_concurrent_files_share_connections(self) -> None:
+        file_ids = ["big_no_friends", "big_rel", "big_ann"]
+        self.client_kwargs["n_procs"] = 2
+        self.client_kwargs["concurrent_files"] = 4
+        self.client_kwargs["download_related_files"] = False
+        self.client_kwargs["download_annotations"] = False
+        client = self.get_download_client()
+
+        _, errors = client.download_files(
+            [f"{BASE_URL}/data/{file_id}" for file_id in file_ids]
+        )
+
+        assert errors == {}
+        # never more files in flight than connections
+        assert client.files_in_flight == 2
+        # the progress bar setting of other clients is left alone
+        assert DownloadStream.show_progress
+
+        # the remainder of the connections goes to the first files
+        client.n_procs = 5
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            barrier = threading.Barrier(2)
+
+            def connections():
+                barrier.wait()
+                return client._connections()
+
+            shares = [executor.submit(connections) for _ in range(2)]
+        assert sorted(share.result() for share in shares) == [2, 3]
+
 
 def test_fix_url() -> None:
     fixed_url = "https://api.gdc.cancer.gov/"
@@ -189,3 +705,54 @@ def test_fix_url() -> None:
     assert fix_url("api.gdc.cancer.gov") == fixed_url
     assert fix_url(fixed_url) == fixed_url
     assert fix_url("api.gdc.cancer.gov/") == fixed_url
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("100-199", (100, 200)),
+        ("0-0", (0, 1)),
+        ("100-", (100, None)),
+        ("-500", (-500, None)),
+    ],
+)
+def test_byte_range(value: str, expected: tuple) -> None:
+    assert byte_range(value) == expected
+
+
+@pytest.mark.parametrize("value", ["", "-", "-0", "200-100", "a-b", "1-2-3"])
+def test_invalid_byte_range(value: str) -> None:
+    with pytest.raises(argparse.ArgumentTypeError):
+        byte_range(value)
+
+
+def test_download_stream_select_byte_range() -> None:
+    url = "https://api.gdc.cancer.gov/data/file_id"
+    stream = DownloadStream(url, "/tmp", name="f.bam", size=1000, md5sum="0" * 32)
+
+    stream.select_byte_range(-100)
+
+    assert stream.name == "f.bam.900-999"
+    assert stream.size == 100
+    assert stream.md5sum is None
+    assert not stream.check_file_md5sum
+    assert stream.header(0, 99)["Range"] == "bytes=900-999"
+
+    with pytest.raises(ValueError):
+        DownloadStream(url, "/tmp", size=1000).select_byte_range(1000, 2000)
+
+
+def test_download_stream_learns_name_from_range_request(requests_mock) -> None:
+    url = "https://api.gdc.cancer.gov/data/file_id"
+    requests_mock.get(
+        url,
+        content=b"A",
+        headers={"Content-Disposition": "attachment; filename=test_file.txt"},
+    )
+    stream = DownloadStream(url, "/tmp", size=1024, md5sum="0" * 32)
+
+    stream.init()
+
+    assert stream.name == "test_file.txt"
+    assert stream.size == 1024
+    assert requests_mock.last_request.headers["Range"] == "bytes=0-0"
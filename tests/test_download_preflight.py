@@ -0,0 +1,111 @@
+from collections import namedtuple
+import os
+from pathlib import Path
+
+import pytest
+
+from gdc_client.download import preflight
+from gdc_client.parcel import state
+from gdc_client.parcel.file_cache import FileCache
+from gdc_client.parcel.rangeset import ChunkRangeSet
+
+DiskUsage = namedtuple("DiskUsage", ["total", "used", "free"])
+
+
+class FakeIndexClient:
+    def __init__(self, sizes):
+        self.sizes = sizes
+
+    def get_filesize(self, uuid):
+        return self.sizes.get(uuid)
+
+    def get_md5sum(self, uuid):
+        return f"md5 of {uuid}"
+
+
+@pytest.fixture
+def free(monkeypatch):
+    def set_free(n_bytes):
+        monkeypatch.setattr(
+            preflight.shutil,
+            "disk_usage",
+            lambda path: DiskUsage(n_bytes, 0, n_bytes),
+        )
+
+    return set_free
+
+
+def write_state(tmp_path: Path, file_id: str, name: str, chunks) -> None:
+    logs = tmp_path / file_id / "logs"
+    logs.mkdir(parents=True)
+    completed = ChunkRangeSet()
+    for begin, end in chunks:
+        completed.add(begin, end, "00" * 16)
+    with open(logs / f"{name}.parcel", "wb") as f:
+        state.dump(completed, f)
+
+
+def test_remaining_bytes_new_file(tmp_path: Path) -> None:
+    assert preflight.remaining_bytes(str(tmp_path), "id1", 1000) == 1000
+
+
+def test_remaining_bytes_completed_file(tmp_path: Path) -> None:
+    write_state(tmp_path, "id1", "file.txt", [(0, 1000)])
+    (tmp_path / "id1" / "file.txt").write_bytes(b"x" * 1000)
+
+    assert preflight.remaining_bytes(str(tmp_path), "id1", 1000) == 0
+
+
+def test_remaining_bytes_resumable_partial(tmp_path: Path) -> None:
+    write_state(tmp_path, "id1", "file.txt", [(0, 300), (500, 600)])
+    temp_path = tmp_path / "id1" / "file.txt.partial"
+    with open(temp_path, "wb") as f:
+        f.truncate(1000)
+
+    assert preflight.remaining_bytes(str(tmp_path), "id1", 1000) == 600
+
+
+def test_plan_downloads_everything_fits(tmp_path: Path, free) -> None:
+    free(1000)
+    index_client = FakeIndexClient({"a": 600, "b": 400})
+
+    planned, refused = preflight.plan_downloads(str(tmp_path), ["a", "b"], index_client)
+
+    assert planned == ["a", "b"]
+    assert refused == []
+
+
+def test_plan_downloads_reorders_to_fit(tmp_path: Path, free) -> None:
+    free(1000)
+    index_client = FakeIndexClient({"a": 900, "b": 400, "c": 500, "d": None})
+
+    planned, refused = preflight.plan_downloads(
+        str(tmp_path), ["a", "b", "c", "d"], index_client
+    )
+
+    assert planned == ["d", "b", "c"]
+    assert refused == ["a"]
+
+
+def test_plan_downloads_linked_from_file_cache(tmp_path: Path, free) -> None:
+    free(1000)
+    index_client = FakeIndexClient({"a": 900, "b": 400})
+    cache = FileCache(str(tmp_path / "cache"), max_size=10000)
+    cached = tmp_path / "cached"
+    cached.write_bytes(b"A" * 900)
+    cache.add("a", "md5 of a", str(cached))
+
+    planned, refused = preflight.plan_downloads(
+        str(tmp_path), ["a", "b"], index_client, file_cache=cache
+    )
+
+    assert planned == ["a", "b"]
+    assert refused == []
+
+
+def test_free_space_of_missing_directory(tmp_path: Path) -> None:
+    missing = os.path.join(str(tmp_path), "not", "created", "yet")
+
+    assert (
+        preflight.free_space(missing) == preflight.shutil.disk_usage(str(tmp_path)).free
+    )
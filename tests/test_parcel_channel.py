@@ -0,0 +1,77 @@
+from multiprocessing import Process
+
+from intervaltree import Interval
+
+from gdc_client.parcel import channel, utils
+from gdc_client.parcel.throughput import SegmentFailed, SegmentStats
+from gdc_client.parcel.verify import CorruptChunk, VerifyDone
+
+
+def report_chunks(q_complete, start, count):
+    for offset in range(start, start + count):
+        data = {"md5sum": utils.md5sum(str(offset).encode())}
+        q_complete.put(Interval(offset, offset + 1, data))
+    q_complete.put(None)
+
+
+def test_completion_channel_round_trip():
+    q_complete = channel.CompletionChannel()
+
+    q_complete.put(Interval(0, 10, {"md5sum": utils.md5sum(b"A" * 10)}))
+    q_complete.put(Interval(10, 20, None))
+    q_complete.put(SegmentStats(3, 20, 1.5, 0.25, 2, 5, 1))
+    q_complete.put(None)
+    q_complete.put(CorruptChunk(20, 30))
+    q_complete.put(VerifyDone(12, 1))
+
+    assert q_complete.get() == Interval(0, 10, {"md5sum": utils.md5sum(b"A" * 10)})
+    assert q_complete.get() == Interval(10, 20, None)
+    assert q_complete.get() == SegmentStats(3, 20, 1.5, 0.25, 2, 5, 1)
+    assert q_complete.get() == SegmentStats(0, 0, 0, 0)
+    assert q_complete.get() == CorruptChunk(20, 30)
+    assert q_complete.get() == VerifyDone(12, 1)
+    q_complete.close()
+
+
+def test_completion_channel_reports_failures():
+    q_complete = channel.CompletionChannel()
+    error = "403 Client Error: Forbidden: " + "x" * 2 * channel.MAX_ERROR_SIZE
+
+    q_complete.put(Interval(0, 10, None))
+    q_complete.put(SegmentFailed(2, "Max retries exceeded."))
+    q_complete.put(SegmentFailed(1, error, False, 3, 2))
+
+    assert q_complete.get() == Interval(0, 10, None)
+    assert q_complete.get() == SegmentFailed(2, "Max retries exceeded.")
+    assert q_complete.get() == SegmentFailed(
+        1, error[: channel.MAX_ERROR_SIZE], False, 3, 2
+    )
+    q_complete.close()
+
+
+def test_completion_channel_across_processes():
+    q_complete = channel.CompletionChannel()
+    count = channel.BATCH_RECORDS * 3 + 1
+    workers = [
+        Process(target=report_chunks, args=(q_complete, i * count, count))
+        for i in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+
+    received, done = [], 0
+    while done < len(workers):
+        interval = q_complete.get()
+        if isinstance(interval, SegmentStats):
+            done += 1
+            continue
+        received.append(interval)
+
+    for worker in workers:
+        worker.join()
+    q_complete.close()
+
+    assert sorted(i.begin for i in received) == list(range(4 * count))
+    for interval in received:
+        expected = utils.md5sum(str(interval.begin).encode())
+        assert interval.data["md5sum"] == expected
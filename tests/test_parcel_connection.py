@@ -0,0 +1,50 @@
+import threading
+
+from gdc_client.parcel.connection import SessionPool
+
+
+def test_session_pool_reuses_sessions_per_host():
+    pool = SessionPool()
+
+    first = pool.get("https://api.gdc.cancer.gov/data/a")
+    second = pool.get("https://api.gdc.cancer.gov/data/b")
+    other = pool.get("https://example.com/data/a")
+
+    assert first is second
+    assert first is not other
+    assert (pool.hits, pool.misses) == (1, 2)
+    assert pool.stats() == "session pool 1 hits, 2 misses"
+
+
+def test_session_pool_close():
+    pool = SessionPool()
+    first = pool.get("https://api.gdc.cancer.gov/data/a")
+
+    pool.close()
+
+    assert pool.get("https://api.gdc.cancer.gov/data/a") is not first
+    assert (pool.hits, pool.misses) == (0, 2)
+
+
+def test_session_pool_closes_sessions_of_exited_threads():
+    pool = SessionPool()
+    sessions = []
+    thread = threading.Thread(
+        target=lambda: sessions.append(pool.get("https://api.gdc.cancer.gov/data/a"))
+    )
+    thread.start()
+    thread.join()
+
+    pool.get("https://example.com/data/a")
+
+    assert sessions[0] not in pool._sessions.values()
+    assert len(pool._sessions) == 1
+
+
+def test_session_pool_adds_worker_counts():
+    pool = SessionPool()
+    pool.get("https://api.gdc.cancer.gov/data/a")
+
+    pool.add(4, 2)
+
+    assert pool.stats() == "session pool 4 hits, 3 misses"
@@ -0,0 +1,92 @@
+import os
+from pathlib import Path
+import stat
+
+from gdc_client.parcel import utils
+from gdc_client.parcel.file_cache import FileCache
+
+MD5 = utils.md5sum(b"A" * 100)
+
+
+def test_clone_file(tmp_path: Path) -> None:
+    src = tmp_path / "src"
+    src.write_bytes(b"A" * 100)
+    dst = tmp_path / "dst"
+    dst.write_bytes(b"old")
+
+    method = utils.clone_file(str(src), str(dst))
+
+    assert method in ("reflink", "hardlink", "copy")
+    assert dst.read_bytes() == b"A" * 100
+    assert sorted(os.listdir(tmp_path)) == ["dst", "src"]
+
+
+def test_file_cache_hit(tmp_path: Path) -> None:
+    cache = FileCache(str(tmp_path / "cache"), max_size=1000)
+    downloaded = tmp_path / "a" / "file.txt"
+    downloaded.parent.mkdir()
+    downloaded.write_bytes(b"A" * 100)
+
+    cache.add("file_id", MD5, str(downloaded))
+
+    target = tmp_path / "b" / "file.txt"
+    target.parent.mkdir()
+    assert cache.link("file_id", MD5, str(target))
+    assert target.read_bytes() == b"A" * 100
+    assert not cache.link("file_id", "other md5", str(target))
+    assert not os.stat(cache.path("file_id", MD5)).st_mode & stat.S_IWUSR
+    assert not cache.link("other_id", MD5, str(target))
+
+
+def test_file_cache_evicts_least_recently_used_files(tmp_path: Path) -> None:
+    cache = FileCache(str(tmp_path / "cache"), max_size=250)
+    for file_id in ("a", "b"):
+        src = tmp_path / file_id
+        src.write_bytes(b"A" * 100)
+        cache.add(file_id, MD5, str(src))
+    os.utime(os.path.dirname(cache.path("a", MD5)), (0, 0))
+    os.utime(os.path.dirname(cache.path("b", MD5)), (1, 1))
+    # using a makes b the least recently used file
+    assert cache.link("a", MD5, str(tmp_path / "copy"))
+
+    src = tmp_path / "c"
+    src.write_bytes(b"A" * 100)
+    cache.add("c", MD5, str(src))
+
+    assert cache.contains("a", MD5)
+    assert not cache.contains("b", MD5)
+    assert cache.contains("c", MD5)
+
+
+def test_file_cache_discards_corrupt_files(tmp_path: Path) -> None:
+    cache = FileCache(str(tmp_path / "cache"), max_size=1000)
+    src = tmp_path / "src"
+    src.write_bytes(b"A" * 100)
+    cache.add("a", MD5, str(src))
+    cache.add("b", MD5, str(tmp_path / "src"))
+    target = tmp_path / "target"
+
+    # modified in place through a hardlink
+    os.chmod(cache.path("a", MD5), stat.S_IRUSR | stat.S_IWUSR)
+    with open(cache.path("a", MD5), "r+b") as f:
+        f.write(b"B")
+    assert not cache.link("a", MD5, str(target))
+    assert not target.exists()
+    assert not cache.contains("a", MD5)
+
+    # truncated
+    os.chmod(cache.path("b", MD5), stat.S_IRUSR | stat.S_IWUSR)
+    os.truncate(cache.path("b", MD5), 50)
+    assert not cache.link("b", MD5, str(target), size=100)
+    assert not cache.contains("b", MD5)
+
+
+def test_file_cache_keeps_read_permissions(tmp_path: Path) -> None:
+    cache = FileCache(str(tmp_path / "cache"), max_size=1000)
+    downloaded = tmp_path / "file.txt"
+    downloaded.write_bytes(b"A" * 100)
+    downloaded.chmod(0o600)
+
+    cache.add("file_id", MD5, str(downloaded))
+
+    assert stat.S_IMODE(os.stat(cache.path("file_id", MD5)).st_mode) == 0o400
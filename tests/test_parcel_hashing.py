@@ -0,0 +1,50 @@
+import hashlib
+
+from gdc_client.parcel.hashing import PrefixHasher
+
+
+def write_ranges(path, data, ranges, hasher=None):
+    with open(path, "r+b") as f:
+        for begin, end in ranges:
+            f.seek(begin)
+            f.write(data[begin:end])
+            f.flush()
+            if hasher:
+                hasher.add(begin, end)
+
+
+def test_prefix_hasher_out_of_order(tmp_path):
+    data = bytes(range(256)) * 64
+    path = tmp_path / "file.partial"
+    path.write_bytes(b"\0" * len(data))
+
+    hasher = PrefixHasher(str(path), read_size=1000)
+    write_ranges(
+        path, data, [(4096, 8192), (12288, 16384), (0, 4096), (8192, 12288)], hasher
+    )
+
+    assert hasher.prefix == len(data)
+    assert hasher.hexdigest() == hashlib.md5(data).hexdigest()
+
+
+def test_prefix_hasher_reads_back_tail(tmp_path):
+    data = b"0123456789" * 1000
+    path = tmp_path / "file.partial"
+    path.write_bytes(data)
+
+    hasher = PrefixHasher(str(path))
+    # the range past the gap is never part of the streamed prefix
+    hasher.add(0, 4000)
+    hasher.add(6000, 10000)
+
+    assert hasher.prefix == 4000
+    assert hasher.hexdigest() == hashlib.md5(data).hexdigest()
+
+
+def test_prefix_hasher_missing_file(tmp_path):
+    path = tmp_path / "file.partial"
+    hasher = PrefixHasher(str(path))
+    path.write_bytes(b"data")
+    hasher.add(0, 4)
+
+    assert hasher.hexdigest() == hashlib.md5(b"data").hexdigest()
@@ -0,0 +1,83 @@
+from gdc_client.parcel.rangeset import ChunkRangeSet, Range, RangeSet
+
+MD5_A = "a" * 32
+MD5_B = "b" * 32
+
+
+def test_rangeset_merges_adjacent_and_overlapping_ranges():
+    ranges = RangeSet()
+    ranges.add(10, 20)
+    ranges.add(30, 40)
+    ranges.add(20, 25)
+    assert ranges.items() == [Range(10, 25), Range(30, 40)]
+
+    ranges.add(0, 35)
+    assert ranges.items() == [Range(0, 40)]
+    assert ranges.size == 40
+    assert len(ranges) == 1
+
+
+def test_rangeset_chop():
+    ranges = RangeSet([Range(0, 100), Range(200, 300)])
+    ranges.chop(50, 250)
+    assert ranges.items() == [Range(0, 50), Range(250, 300)]
+    assert ranges.size == 100
+
+    ranges.chop(0, 10)
+    ranges.chop(290, 400)
+    ranges.chop(100, 200)
+    assert ranges.items() == [Range(10, 50), Range(250, 290)]
+    assert ranges.size == 80
+
+
+def test_rangeset_queries():
+    ranges = RangeSet([Range(10, 20), Range(30, 40)])
+    assert ranges.first() == Range(10, 20)
+    assert ranges.covers(12, 20)
+    assert not ranges.covers(15, 35)
+    assert not ranges.covers(0, 5)
+    assert ranges.covers(5, 5)
+
+    assert ranges.next_gap(0, 100) == Range(0, 10)
+    assert ranges.next_gap(15, 100) == Range(20, 30)
+    assert ranges.next_gap(35, 100) == Range(40, 100)
+    assert ranges.next_gap(35, 40) is None
+    assert RangeSet().first() is None
+
+
+def test_chunk_rangeset_keeps_digests():
+    completed = ChunkRangeSet()
+    completed.add(10, 20, MD5_B)
+    completed.add(0, 10, MD5_A)
+    completed.add(20, 30)
+    completed.add(40, 50, MD5_A)
+    # a chunk recorded twice is kept once
+    completed.add(10, 20, MD5_B)
+
+    assert completed.size == 40
+    assert next(completed.ranges()) == Range(0, 30)
+    assert completed.items() == [
+        Range(0, 10, {"md5sum": MD5_A}),
+        Range(10, 20, {"md5sum": MD5_B}),
+        Range(20, 30),
+        Range(40, 50, {"md5sum": MD5_A}),
+    ]
+
+    completed.chop(10, 20)
+    assert completed.items() == [
+        Range(0, 10, {"md5sum": MD5_A}),
+        Range(20, 30),
+        Range(40, 50, {"md5sum": MD5_A}),
+    ]
+
+
+def test_chunk_rangeset_chop_drops_digests_of_cut_chunks():
+    completed = ChunkRangeSet()
+    completed.add(0, 10, MD5_A)
+    completed.add(10, 20, MD5_B)
+    completed.add(20, 30, MD5_A)
+
+    # both chunks cut in two lose their digest
+    completed.chop(5, 25)
+    assert completed.items() == [Range(0, 5), Range(25, 30)]
+    assert completed.size == 10
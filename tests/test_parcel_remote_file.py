@@ -0,0 +1,121 @@
+import io
+import re
+import threading
+
+import pytest
+
+from gdc_client.parcel import RemoteFile
+
+URL = "https://api.gdc.cancer.gov/data/file_id"
+CONTENTS = bytes(range(256)) * 40
+
+
+@pytest.fixture
+def remote(requests_mock):
+    def respond(request, context):
+        context.headers["Content-Disposition"] = "attachment; filename=test.bam"
+        context.headers["Content-Length"] = str(len(CONTENTS))
+        context.headers["content-md5"] = "0" * 32
+        match = re.fullmatch(r"bytes=(\d+)-(\d+)", request.headers.get("Range", ""))
+        if not match:
+            return CONTENTS
+        begin, end = map(int, match.groups())
+        context.status_code = 206
+        return CONTENTS[begin : end + 1]
+
+    requests_mock.get(URL, content=respond)
+
+    def open_file(**kwargs):
+        kwargs.setdefault("block_size", 1000)
+        return RemoteFile(URL, "token", **kwargs)
+
+    return open_file
+
+
+def test_remote_file_random_access(remote):
+    with remote() as f:
+        assert f.name == "test.bam"
+        assert f.size == len(CONTENTS)
+
+        f.seek(-10, io.SEEK_END)
+        assert f.read() == CONTENTS[-10:]
+        f.seek(2990)
+        assert f.read(20) == CONTENTS[2990:3010]
+        assert f.tell() == 3010
+        assert f.read(0) == b""
+
+        f.seek(len(CONTENTS) + 5)
+        assert f.read(10) == b""
+
+
+def test_remote_file_caches_blocks(remote):
+    with remote() as f:
+        f.seek(1500)
+        f.read(100)
+        f.seek(1000)
+        f.read(1000)
+
+        assert f.requests == 1
+        assert (f.hits, f.misses) == (1, 1)
+
+
+def test_remote_file_reads_ahead_sequential_access(remote):
+    with remote(readahead=4) as f:
+        data = b"".join(iter(lambda: f.read(100), b""))
+
+        assert data == CONTENTS
+        # the first block, then windows of 4 blocks: 1-4, 5-8 and the last one
+        assert f.requests == 4
+
+
+def test_remote_file_evicts_least_recently_used_blocks(remote):
+    with remote(cache_blocks=2) as f:
+        for offset in (0, 5000, 0, 9000, 5000):
+            f.seek(offset)
+            f.read(1)
+
+        # the block at 5000 was the least recently used one when 9000 came in
+        assert f.requests == 4
+
+
+def test_remote_file_line_reader(remote):
+    with io.BufferedReader(remote(), buffer_size=300) as f:
+        assert f.readline() == CONTENTS[: CONTENTS.index(b"\n") + 1]
+        f.seek(-5, io.SEEK_END)
+        assert f.read() == CONTENTS[-5:]
+
+
+def test_remote_file_without_certificate_verification(remote, requests_mock):
+    with remote(verify=False) as f:
+        f.read(10)
+
+    assert [r.verify for r in requests_mock.request_history] == [False, False]
+
+
+def test_remote_file_cached_reads_do_not_wait_for_fetches(remote):
+    with remote() as f:
+        f.pread(0, 10)
+        fetch = f._fetch
+        fetching, release = threading.Event(), threading.Event()
+
+        def slow_fetch(first, stop):
+            fetching.set()
+            release.wait(5)
+            return fetch(first, stop)
+
+        f._fetch = slow_fetch
+        miss = threading.Thread(target=f.pread, args=(5000, 10))
+        miss.start()
+        assert fetching.wait(5)
+
+        # the cached block is served while the miss waits on the server
+        cached = []
+        hit = threading.Thread(target=lambda: cached.append(f.pread(0, 10)))
+        hit.start()
+        hit.join(2)
+        served = list(cached)
+        release.set()
+        miss.join()
+        hit.join()
+
+        assert served == [CONTENTS[:10]]
@@ -0,0 +1,89 @@
+import io
+import pickle
+
+import pytest
+from intervaltree import Interval, IntervalTree
+
+from gdc_client.exceptions import StateError
+from gdc_client.parcel import state
+from gdc_client.parcel.rangeset import ChunkRangeSet, Range
+
+
+def dumped(completed):
+    f = io.BytesIO()
+    state.dump(completed, f)
+    f.seek(0)
+    return f
+
+
+def test_state_round_trip():
+    chunks = [
+        Range(0, 1024, {"md5sum": "d47b127bc2de2d687ddc82dac354c415"}),
+        Range(1024, 2048, {"md5sum": "0f343b0931126a20f133d67c2b018a3b"}),
+        Range(4096, 5000),
+    ]
+    f = dumped(ChunkRangeSet(chunks))
+
+    assert len(f.getvalue()) == state.HEADER.size + 3 * state.RECORD.size
+    assert state.load(f).items() == chunks
+
+
+def test_state_reads_legacy_pickle():
+    completed = IntervalTree([Interval(0, 10, {"md5sum": "a" * 32})])
+    f = io.BytesIO(pickle.dumps(completed))
+
+    assert state.load(f).items() == [Range(0, 10, {"md5sum": "a" * 32})]
+
+
+@pytest.mark.parametrize(
+    "corrupt",
+    [
+        lambda data: data[:-1],
+        lambda data: data[:10],
+        lambda data: data[:8] + b"\x09\x00" + data[10:],
+        lambda data: pickle.dumps({"not": "a tree"}),
+    ],
+)
+def test_state_rejects_bad_files(corrupt):
+    data = dumped(ChunkRangeSet([Range(0, 10)])).getvalue()
+
+    with pytest.raises(StateError):
+        state.load(io.BytesIO(corrupt(data)))
+
+
+def test_journal_append_and_replay(tmp_path):
+    path = str(tmp_path / "test.txt.parcel.journal")
+    journal = state.Journal(path)
+    journal.append([Interval(0, 10, {"md5sum": "a" * 32})])
+    journal.append([Interval(10, 20), Interval(30, 40)])
+    journal.close()
+    assert journal.records == 3
+
+    completed = ChunkRangeSet([Range(50, 60)])
+    assert state.replay(path, completed) == 3
+    assert completed.items() == [
+        Range(0, 10, {"md5sum": "a" * 32}),
+        Range(10, 20),
+        Range(30, 40),
+        Range(50, 60),
+    ]
+
+    journal.reset()
+    assert state.replay(path, ChunkRangeSet()) == 0
+
+
+def test_journal_replay_drops_torn_record(tmp_path):
+    path = tmp_path / "test.txt.parcel.journal"
+    journal = state.Journal(str(path))
+    journal.append([Interval(0, 10), Interval(10, 20)])
+    journal.close()
+    with path.open("ab") as f:
+        f.write(b"\x01" * (state.RECORD.size // 2))
+
+    assert state.replay(str(path), ChunkRangeSet()) == 2
+    # appends after a replay stay aligned on records
+    journal.append([Interval(20, 30)])
+    journal.close()
+    completed = ChunkRangeSet()
+    assert state.replay(str(path), completed) == 3
+    assert completed.items() == [Range(0, 30)]
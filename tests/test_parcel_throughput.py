@@ -0,0 +1,80 @@
+import pytest
+
+from gdc_client.exceptions import StalledTransferError
+from gdc_client.parcel import throughput
+from gdc_client.parcel.const import MB
+from gdc_client.parcel.throughput import LowSpeedMonitor, SegmentSizer, SegmentStats
+
+
+def test_segment_sizer_follows_connection_rate():
+    sizer = SegmentSizer(
+        16 * MB, target_duration=10, min_size=1 * MB, max_size=1024 * MB, align=MB
+    )
+
+    # 4 MB/s connections after subtracting 0.5 s of request latency
+    for slot in range(3):
+        sizer.record(SegmentStats(slot, 20 * MB, 5.5, 0.5))
+
+    assert sizer.size == 40 * MB
+
+    # a fast, clean link gets large segments, capped at max_size
+    for slot in range(3):
+        for _ in range(20):
+            sizer.record(SegmentStats(slot, 1000 * MB, 1.0, 0.001))
+
+    assert sizer.size == 1024 * MB
+
+
+def test_segment_sizer_slow_lossy_link():
+    sizer = SegmentSizer(
+        64 * MB, target_duration=10, min_size=1 * MB, max_size=1024 * MB, align=MB
+    )
+
+    # 100 KB/s with 2 s latency: latency dominates the segment duration
+    sizer.record(SegmentStats(0, 1 * MB, 2 + 1 * MB / (100 * 1024), 2.0))
+
+    assert sizer.size == 2 * MB
+    assert "1 segments over 1 connections" in sizer.summary()
+
+
+def test_segment_sizer_ignores_failed_segments():
+    sizer = SegmentSizer(8 * MB)
+
+    assert sizer.record(SegmentStats(0, 0, 0, 0)) == 8 * MB
+    assert sizer.summary() == "No segment throughput recorded"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_low_speed_monitor_raises_on_slow_window(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(throughput.time, "monotonic", clock)
+    monitor = LowSpeedMonitor(1000, window=10)
+
+    # 2000 B/s over the first window
+    for _ in range(10):
+        clock.now += 1
+        monitor.update(2000)
+
+    # 500 B/s over the second one
+    for _ in range(9):
+        clock.now += 1
+        monitor.update(500)
+    with pytest.raises(StalledTransferError):
+        clock.now += 1
+        monitor.update(500)
+
+
+def test_low_speed_monitor_disabled(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(throughput.time, "monotonic", clock)
+    monitor = LowSpeedMonitor(0, window=1)
+
+    clock.now += 100
+    monitor.update(0)
@@ -1,4 +1,6 @@
+import errno
 import logging
+import os
 from unittest import mock
 
 import pytest
@@ -88,3 +90,64 @@ def test__md5sum_whole_file():
             "d47b127bc2de2d687ddc82dac354c415"  # pragma: allowlist secret
         )
         mock_file.assert_called_once_with("test.txt", "rb")
+
+
+def test__pwrite_writes_at_offsets(tmp_path):
+    path = tmp_path / "test.txt.partial"
+    utils.set_file_length(str(path), 8)
+
+    fd = utils.open_for_positional_writes(str(path))
+    try:
+        utils.pwrite(fd, b"CD", 2)
+        utils.pwrite(fd, b"AB", 0)
+        utils.pwrite(fd, b"GH", 6)
+    finally:
+        os.close(fd)
+
+    assert path.read_bytes() == b"AB" + b"CD" + b"\0\0" + b"GH"
+
+
+@pytest.mark.skipif(
+    not hasattr(os, "posix_fallocate"), reason="posix_fallocate not available"
+)
+def test__preallocate_file_reserves_space(tmp_path):
+    path = tmp_path / "test.txt.partial"
+    utils.preallocate_file(str(path), 1024 * 1024)
+
+    assert path.stat().st_size == 1024 * 1024
+    assert path.stat().st_blocks * 512 >= 1024 * 1024
+
+
+@pytest.mark.skipif(
+    not hasattr(os, "posix_fallocate"), reason="posix_fallocate not available"
+)
+@pytest.mark.parametrize(
+    "error, raises",
+    [(errno.ENOSPC, True), (errno.EOPNOTSUPP, False)],
+)
+def test__preallocate_file_errors(tmp_path, error, raises):
+    path = tmp_path / "test.txt.partial"
+    with mock.patch("os.posix_fallocate", side_effect=OSError(error, "error")):
+        if raises:
+            with pytest.raises(OSError) as e:
+                utils.preallocate_file(str(path), 1024)
+            assert e.value.errno == errno.ENOSPC
+            assert not path.exists()
+        else:
+            # falls back to a sparse file
+            utils.preallocate_file(str(path), 1024)
+            assert path.stat().st_size == 1024
+
+
+def test__evict_least_recently_used():
+    entries = [(3, 40, "c"), (1, 40, "a"), (2, 40, "b"), (4, 40, "d")]
+    removed = []
+
+    def remove(path):
+        if path == "a":
+            raise OSError(errno.EBUSY, "busy")
+        removed.append(path)
+
+    assert utils.evict_least_recently_used(entries, 200, remove) == (0, 160)
+    assert utils.evict_least_recently_used(entries, 100, remove) == (2, 80)
+    assert removed == ["b", "c"]
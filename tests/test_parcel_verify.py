@@ -0,0 +1,32 @@
+from intervaltree import Interval
+
+from gdc_client.parcel import utils
+from gdc_client.parcel.verify import CorruptChunk, SegmentVerifier, VerifyDone
+
+
+def test_segment_verifier_reports_corrupt_chunks(tmp_path):
+    path = tmp_path / "test.txt.partial"
+    data = bytes(range(256)) * 40
+    path.write_bytes(data[:5000] + b"X" * 100 + data[5100:])
+    intervals = [
+        Interval(begin, begin + 1000, {"md5sum": utils.md5sum(data[begin:][:1000])})
+        for begin in range(0, len(data), 1000)
+    ]
+
+    reports = []
+    verifier = SegmentVerifier(str(path), intervals, reports.append, threads=3)
+    verifier.start()
+    verifier.join()
+
+    assert reports == [CorruptChunk(5000, 6000), VerifyDone(len(intervals), 1)]
+
+
+def test_segment_verifier_missing_file(tmp_path):
+    intervals = [Interval(0, 10, {"md5sum": utils.md5sum(b"A" * 10)})]
+
+    reports = []
+    verifier = SegmentVerifier(str(tmp_path / "missing"), intervals, reports.append)
+    verifier.start()
+    verifier.join()
+
+    assert reports == [CorruptChunk(0, 10), VerifyDone(0, 1)]
@@ -20,6 +20,7 @@ class TestQueryIndex:
 
     def assert_index_with_uuids(self, uuid: str) -> None:
         assert self.index.get_access(uuid) == uuids[uuid]["access"]
+        assert self.index.get_filename(uuid) == uuids[uuid]["file_name"]
         assert self.index.get_filesize(uuid) == uuids[uuid]["file_size"]
         assert self.index.get_md5sum(uuid) == uuids[uuid]["md5sum"]
         assert self.index.get_related_files(uuid) == uuids[uuid]["related_files"]
@@ -1,5 +1,4 @@
 import collections
-import logging
 import os
 import pathlib
 import pickle
@@ -9,6 +8,8 @@ import intervaltree
 import pytest
 
 import gdc_client.parcel.segment as segment
+import gdc_client.parcel.state as state
+import gdc_client.parcel.throughput as throughput
 import gdc_client.parcel.download_stream as stream
 import gdc_client.parcel.utils as utils
 
@@ -191,3 +192,241 @@ def test_load_state_state_temp_exist(
     assert intervals[0].begin == len(incomplete_data.data)
     assert intervals[0].end == len(complete_data.data)
     assert producer.done == False
+
+
+@pytest.mark.usefixtures("mock_incomplete_state_file", "mock_temporary_file")
+def test_save_state_migrates_legacy_state(
+    mock_download_stream: stream.DownloadStream,
+    incomplete_data: NamedTuple,
+):
+    producer = segment.SegmentProducer(mock_download_stream, 2)
+    producer.save_state()
+
+    with open(mock_download_stream.state_path, "rb") as f:
+        assert f.read(len(state.MAGIC)) == state.MAGIC
+        f.seek(0)
+        intervals = list(state.load(f).items())
+    assert len(intervals) == 1
+    assert intervals[0].end == len(incomplete_data.data)
+    assert intervals[0].data["md5sum"] == incomplete_data.md5sum
+
+
+@pytest.mark.usefixtures("mock_incomplete_state_file", "mock_temporary_file")
+def test_checkpoint_journals_completed_chunks(
+    mock_download_stream: stream.DownloadStream,
+    complete_data: NamedTuple,
+):
+    producer = segment.SegmentProducer(mock_download_stream, 2)
+    with open(mock_download_stream.state_path, "rb") as f:
+        snapshot = f.read()
+
+    chunk = complete_data.data[512:]
+    interval = intervaltree.Interval(512, 1024, {"md5sum": utils.md5sum(chunk)})
+    with open(mock_download_stream.temp_path, "r+b") as f:
+        f.seek(512)
+        f.write(chunk)
+    producer.handle_report(interval)
+    producer.checkpoint()
+    producer.close()
+
+    # the snapshot is left alone, the chunk is replayed from the journal
+    with open(mock_download_stream.state_path, "rb") as f:
+        assert f.read() == snapshot
+    resumed = segment.SegmentProducer(mock_download_stream, 2)
+    assert sorted(resumed.completed)[-1] == interval
+    assert resumed.size_complete == len(complete_data.data)
+    assert not resumed.work_pool
+
+    resumed.save_state()
+    assert not os.path.exists(mock_download_stream.journal_path)
+
+
+def test_resume_before_first_compaction(
+    mock_download_stream: stream.DownloadStream,
+    complete_data: NamedTuple,
+):
+    # a new download is interrupted while its chunks are only journaled
+    producer = segment.SegmentProducer(mock_download_stream, 2)
+    chunk = complete_data.data[:512]
+    interval = intervaltree.Interval(0, 512, {"md5sum": utils.md5sum(chunk)})
+    with open(mock_download_stream.temp_path, "r+b") as f:
+        f.write(chunk)
+    producer.handle_report(interval)
+    producer.checkpoint()
+    producer.close()
+    assert os.path.isfile(mock_download_stream.journal_path)
+
+    resumed = segment.SegmentProducer(mock_download_stream, 2)
+
+    assert resumed.size_complete == 512
+    assert list(resumed.work_pool.items()) == [intervaltree.Interval(512, 1024)]
+
+
+@pytest.mark.usefixtures("mock_incomplete_state_file")
+def test_resumed_corrupt_segment_is_redownloaded(
+    setup_directories: NamedTuple,
+    mock_download_stream: stream.DownloadStream,
+    incomplete_data: NamedTuple,
+):
+    write_data_file(
+        setup_directories.data_directory,
+        "test.txt.partial",
+        b"B" * len(incomplete_data.data),
+    )
+    producer = segment.SegmentProducer(mock_download_stream, 2)
+    # downloading the missing range does not wait for the verification
+    assert sorted(producer.work_pool) == [intervaltree.Interval(512, 1024)]
+
+    reports = []
+    producer.verify_resumed(reports.append)
+    assert not producer.finished
+    producer.verifier.join()
+    for report in reports:
+        producer.handle_report(report)
+
+    assert producer.finished
+    assert not producer.completed
+    assert producer.size_complete == 0
+    assert sorted(producer.work_pool) == [intervaltree.Interval(0, 1024)]
+
+
+def test_bytes_left_by_failed_segments_are_requeued(
+    monkeypatch, mock_download_stream: stream.DownloadStream
+):
+    monkeypatch.setattr(segment, "REQUEUE_PASSES", 1)
+    producer = segment.SegmentProducer(mock_download_stream, 2)
+    # both segments are handed out, the second one gives up half way
+    producer.work_pool.chop(0, 1024)
+    producer.idle = 0
+    producer.handle_report(intervaltree.Interval(0, 512))
+    producer.handle_report(intervaltree.Interval(512, 768))
+    producer.handle_report(None)
+    assert not producer.work_pool
+
+    producer.handle_report(throughput.SegmentFailed(1, "Max retries exceeded"))
+
+    assert list(producer.work_pool.items()) == [intervaltree.Interval(768, 1024)]
+
+    # bytes are not requeued more than REQUEUE_PASSES times
+    producer.work_pool.chop(768, 1024)
+    producer.idle = 0
+    producer.handle_report(None)
+    producer.handle_report(throughput.SegmentFailed(1, "Max retries exceeded"))
+    assert not producer.work_pool
+    assert producer.finished
+    producer.close()
+
+
+def test_refused_segment_gives_up_the_file(mock_download_stream):
+    producer = segment.SegmentProducer(mock_download_stream, 2)
+    producer.work_pool.chop(0, 1024)
+    producer.idle = 0
+    producer.slots.start(0, intervaltree.Interval(512, 1024))
+
+    producer.handle_report(throughput.SegmentFailed(1, "403 Forbidden", False))
+    # the other worker stops at its next chunk
+    assert producer.slots.claim(0, 512, 64) == segment.Range(512, 512)
+    producer.handle_report(None)
+
+    assert producer.finished
+    assert not producer.work_pool
+    producer.close()
+    with pytest.raises(RuntimeError, match="403 Forbidden"):
+        producer.check_failure()
+    assert not os.path.exists(mock_download_stream.temp_path)
+    assert not os.path.exists(mock_download_stream.state_path)
+
+
+def test_segment_slots_split_steals_tail_of_largest_segment():
+    slots = segment.SegmentSlots(2)
+    slots.start(0, intervaltree.Interval(0, 100))
+    slots.start(1, intervaltree.Interval(100, 400))
+    assert slots.claim(1, 100, 40) == segment.Range(100, 140)
+
+    stolen = slots.split(min_size=10, align=16)
+
+    # remaining 260 bytes of slot 1, split point rounded to 16 bytes
+    assert stolen == intervaltree.Interval(284, 400)
+    assert slots.limit[1] == 284
+    # the worker may only finish the front half
+    assert slots.claim(1, 140, 200) == segment.Range(140, 284)
+    assert slots.claim(1, 284, 10) == segment.Range(284, 284)
+
+
+def test_segment_slots_split_respects_min_size():
+    slots = segment.SegmentSlots(1)
+    slots.start(0, intervaltree.Interval(0, 100))
+
+    assert slots.split(min_size=60) is None
+
+    slots.release(0)
+    assert slots.split(min_size=1) is None
+
+
+def test_segment_slots_hedge_wins_on_first_delivery():
+    slots = segment.SegmentSlots(2)
+    slots.start(0, intervaltree.Interval(0, 400))
+    assert slots.claim(0, 0, 100) == segment.Range(0, 100)
+
+    # the hedge starts where the straggler has got to
+    hedge = slots.start(1, segment.Range(100, 400, {"hedge": 0}))
+    assert hedge == segment.Range(100, 400)
+    assert slots.progress(0) == []
+
+    # the straggler carries on until the hedge delivers
+    assert slots.claim(0, 100, 50) == segment.Range(100, 150)
+    assert slots.claim(0, 150, 50) == segment.Range(150, 200)
+
+    # the hedge wins and skips what the straggler wrote meanwhile
+    assert slots.claim(1, 100, 60) == segment.Range(160, 160)
+    assert slots.claim(0, 200, 50) == segment.Range(200, 200)
+    assert slots.limit[0] == 200
+    assert slots.claim(1, 160, 60) == segment.Range(200, 220)
+    assert slots.claim(1, 220, 180) == segment.Range(220, 400)
+    assert slots.won.value == 1
+
+
+def test_segment_slots_straggler_finishing_stops_hedge():
+    slots = segment.SegmentSlots(2)
+    slots.start(0, intervaltree.Interval(0, 400))
+    slots.claim(0, 0, 100)
+    slots.start(1, segment.Range(100, 400, {"hedge": 0}))
+
+    assert slots.claim(0, 100, 300) == segment.Range(100, 400)
+    slots.release(0)
+
+    assert slots.claim(1, 100, 50) == segment.Range(100, 100)
+    assert slots.won.value == 0
+
+
+def test_segment_slots_hedge_of_finished_segment_is_empty():
+    slots = segment.SegmentSlots(2)
+    slots.start(0, intervaltree.Interval(0, 400))
+    assert slots.claim(0, 0, 400) == segment.Range(0, 400)
+    slots.release(0)
+
+    hedge = slots.start(1, segment.Range(100, 400, {"hedge": 0}))
+
+    assert hedge.begin == hedge.end
+    assert slots.claim(1, hedge.begin, 10) == segment.Range(400, 400)
+
+
+def test_hedge_straggling_segment(monkeypatch, mock_download_stream):
+    monkeypatch.setattr(segment, "HEDGE_MIN_AGE", 0)
+    producer = segment.SegmentProducer(mock_download_stream, 3)
+    producer.slots.start(0, intervaltree.Interval(0, 400))
+    producer.slots.start(1, intervaltree.Interval(400, 800))
+    producer.slots.start(2, intervaltree.Interval(800, 1024))
+    producer.slots.claim(0, 0, 300)
+    producer.slots.claim(1, 400, 300)
+    producer.slots.claim(2, 800, 10)
+
+    hedge = producer._hedge_segment()
+
+    assert hedge == segment.Range(810, 1024, {"hedge": 2})
+    # the same segment is not hedged twice
+    assert producer._hedge_segment() is None
+
+    producer.max_hedges = 1
+    producer.slots.start(1, intervaltree.Interval(700, 800))
+    assert producer._hedge_segment() is None
@@ -0,0 +1,123 @@
+import os
+from pathlib import Path
+import re
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from gdc_client.serve.server import BlockStore, GDCProxyServer
+
+DATA_URI = "https://api.gdc.cancer.gov/data/"
+CONTENTS = bytes(range(256)) * 40
+
+
+@pytest.fixture
+def upstream(requests_mock):
+    def respond(request, context):
+        context.headers["Content-Disposition"] = "attachment; filename=test.bam"
+        context.headers["Content-Length"] = str(len(CONTENTS))
+        match = re.fullmatch(r"bytes=(\d+)-(\d+)", request.headers.get("Range", ""))
+        if not match:
+            return CONTENTS
+        assert request.headers["X-Auth-Token"] == "token"
+        begin, end = map(int, match.groups())
+        context.status_code = 206
+        return CONTENTS[begin : end + 1]
+
+    requests_mock.get(DATA_URI + "file_id", content=respond)
+    return requests_mock
+
+
+@pytest.fixture
+def serve(tmp_path: Path):
+    servers = []
+
+    def start():
+        store = BlockStore(str(tmp_path), block_size=1000, max_size=1024 * 1024)
+        server = GDCProxyServer(("127.0.0.1", 0), DATA_URI, "token", store)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return "http://{}:{}".format(*server.server_address[:2])
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def get(url, headers=None, method="GET"):
+    request = urllib.request.Request(url, headers=headers or {}, method=method)
+    with urllib.request.urlopen(request) as r:
+        return r.status, r.headers, r.read()
+
+
+def range_requests(upstream):
+    return [r for r in upstream.request_history if "Range" in r.headers]
+
+
+def test_serve_range_requests(upstream, serve):
+    url = serve() + "/data/file_id"
+
+    status, headers, body = get(url, {"Range": "bytes=1500-2499"})
+
+    assert status == 206
+    assert headers["Content-Range"] == f"bytes 1500-2499/{len(CONTENTS)}"
+    assert body == CONTENTS[1500:2500]
+
+    status, headers, body = get(url, {"Range": "bytes=-10"})
+
+    assert status == 206
+    assert body == CONTENTS[-10:]
+
+    status, headers, body = get(url)
+
+    assert status == 200
+    assert headers["Accept-Ranges"] == "bytes"
+    assert body == CONTENTS
+
+    status, headers, body = get(url, method="HEAD")
+
+    assert headers["Content-Length"] == str(len(CONTENTS))
+    assert body == b""
+
+
+def test_serve_shares_cached_blocks(upstream, serve):
+    get(serve() + "/data/file_id", {"Range": "bytes=1500-2499"})
+    fetched = len(range_requests(upstream))
+
+    # another server on the node reads the blocks the first one cached
+    _, _, body = get(serve() + "/data/file_id", {"Range": "bytes=1000-2999"})
+
+    assert body == CONTENTS[1000:3000]
+    assert len(range_requests(upstream)) == fetched
+
+
+def test_serve_errors(upstream, serve):
+    url = serve()
+
+    with pytest.raises(urllib.error.HTTPError) as e:
+        get(url + "/data/file_id", {"Range": f"bytes={len(CONTENTS)}-"})
+    assert e.value.code == 416
+
+    with pytest.raises(urllib.error.HTTPError) as e:
+        get(url + "/files/file_id")
+    assert e.value.code == 404
+
+
+def test_block_store_evicts_least_recently_used_blocks(tmp_path: Path):
+    store = BlockStore(str(tmp_path), block_size=10, max_size=25)
+    store.put("a", 0, b"0" * 10)
+    store.put("a", 1, b"1" * 10)
+    os.utime(store.path("a", 0), (0, 0))
+    os.utime(store.path("a", 1), (1, 1))
+    store.get("a", 0)
+
+    store.put("b", 0, b"2" * 10)
+
+    assert store.get("a", 1) is None
+    assert store.get("a", 0) == b"0" * 10
+    assert store.get("b", 0) == b"2" * 10
+    assert store.size == 20